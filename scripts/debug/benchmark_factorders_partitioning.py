@@ -0,0 +1,123 @@
+import os
+import json
+import statistics
+import yaml
+import sqlalchemy
+from sqlalchemy import text
+from datetime import datetime
+
+CONFIG_PATH = os.path.join("config", "config.yaml")
+REPORT_PATH = os.path.join("reports", "factorders_partitioning_benchmark.json")
+REPEATS = 5
+
+# {table} is either the partitioned warehouse.factorders or an unpartitioned copy.
+BENCHMARK_QUERIES = {
+    "full_scan_revenue": "SELECT SUM(totalamount) FROM {table}",
+    "one_month_revenue": (
+        "SELECT SUM(totalamount), COUNT(*) FROM {table} "
+        "WHERE datekey >= :lo AND datekey < :hi"
+    ),
+    "one_month_by_customer": (
+        "SELECT customerkey, SUM(totalamount) FROM {table} "
+        "WHERE datekey >= :lo AND datekey < :hi GROUP BY customerkey"
+    ),
+}
+
+
+def load_config():
+    with open(CONFIG_PATH, "r") as f:
+        return yaml.safe_load(f)
+
+
+def get_engine(config):
+    db = config["database"]
+    url = f"postgresql+psycopg2://{db['user']}:{db['password']}@" \
+          f"{db['host']}:{db['port']}/{db['name']}"
+    print("USING DB URL:", url)
+    return sqlalchemy.create_engine(url)
+
+
+def scanned_relations(plan: dict) -> set:
+    """Relation names scanned anywhere in an EXPLAIN (FORMAT JSON) plan tree."""
+    names = {plan["Relation Name"]} if "Relation Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= scanned_relations(child)
+    return names
+
+
+def time_query(conn, sql: str, params: dict) -> dict:
+    timings = []
+    relations = set()
+    for _ in range(REPEATS):
+        explained = conn.execute(
+            text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"), params
+        ).scalar_one()
+        plan = explained[0] if isinstance(explained, list) else json.loads(explained)[0]
+        timings.append(plan["Execution Time"])
+        relations = scanned_relations(plan["Plan"])
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "relations_scanned": len(relations),
+    }
+
+
+def main():
+    config = load_config()
+    engine = get_engine(config)
+    with engine.connect() as conn:
+        busiest = conn.execute(
+            text(
+                """
+            SELECT d.year, d.month, MIN(d.datekey) AS lo, MAX(d.datekey) + 1 AS hi
+            FROM warehouse.factorders f
+            JOIN warehouse.dimdate d ON d.datekey = f.datekey
+            GROUP BY d.year, d.month
+            ORDER BY COUNT(*) DESC
+            LIMIT 1
+        """
+            )
+        ).mappings().first()
+        if busiest is None:
+            print("warehouse.factorders is empty - run load_warehouse.py first")
+            return
+
+        conn.execute(
+            text("CREATE TEMP TABLE factorders_unpartitioned AS SELECT * FROM warehouse.factorders")
+        )
+        conn.execute(text("ANALYZE factorders_unpartitioned"))
+        conn.execute(text("ANALYZE warehouse.factorders"))
+
+        params = {"lo": busiest["lo"], "hi": busiest["hi"]}
+        results = {}
+        for name, template in BENCHMARK_QUERIES.items():
+            before = time_query(conn, template.format(table="factorders_unpartitioned"), params)
+            after = time_query(conn, template.format(table="warehouse.factorders"), params)
+            results[name] = {
+                "unpartitioned": before,
+                "partitioned": after,
+                "speedup_x": round(before["median_ms"] / after["median_ms"], 2)
+                if after["median_ms"]
+                else None,
+            }
+            print(
+                f"{name}: {before['median_ms']} ms -> {after['median_ms']} ms "
+                f"({after['relations_scanned']} partition(s) scanned)"
+            )
+        conn.rollback()
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "repeats": REPEATS,
+        "month": f"{busiest['year']:04d}-{busiest['month']:02d}",
+        "datekey_range": params,
+        "queries": results,
+    }
+    os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+    with open(REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark report: {REPORT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import logging
 import json
@@ -9,6 +10,12 @@ import pandas as pd
 import sqlalchemy
 from sqlalchemy import text
 
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from scripts.transformation.typed_frames import frame_memory, peak_rss_bytes, read_csv_compact
+
 CONFIG_PATH = os.path.join("config", "config.yaml")
 LOGS_DIR = "logs"
 
@@ -50,8 +57,8 @@ def validate_staging_load(connection, csv_files: List[Tuple[str, str]]) -> Dict[
     results = {}
     
     for table_name, csv_path in csv_files:
-        # CSV row count (skip header)
-        csv_count = len(pd.read_csv(csv_path))
+        # CSV row count (skip header); one column is enough to count
+        csv_count = len(pd.read_csv(csv_path, usecols=[0]))
         
         # Table row count
         sql = text(f"SELECT COUNT(*) FROM staging.{table_name}")
@@ -94,7 +101,9 @@ def ingest_to_staging(logger: logging.Logger) -> Dict[str, Any]:
                     conn.execute(text(f"TRUNCATE staging.{table_name}"))
                     logger.info(f"Truncated staging.{table_name}")
                     
-                    df = pd.read_csv(csv_path)
+                    df = read_csv_compact(csv_path)
+                    # process peak so far (this read included), next to what the frame holds
+                    memory = {"peak_rss_bytes": peak_rss_bytes(), "frame_bytes": frame_memory(df)}
                     df.to_sql(
                         table_name, 
                         conn, 
@@ -109,9 +118,11 @@ def ingest_to_staging(logger: logging.Logger) -> Dict[str, Any]:
                     tables_report[table_name] = {
                         "status": "success",
                         "rows_loaded": rows_loaded,
-                        "error_message": None
+                        "error_message": None,
+                        "memory": memory
                     }
                     logger.info(f"Loaded {rows_loaded} rows to staging.{table_name}")
+                    logger.info(f"staging.{table_name} frame memory: {memory}")
                     
                 except Exception as e:
                     error_msg = f"Failed {table_name}: {str(e)}"
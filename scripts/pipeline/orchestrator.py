@@ -39,6 +39,7 @@ STEPS = [
     ("data_quality", ["python", "scripts/qualitychecks/validate_data.py"]),
     ("staging_to_production", ["python", "scripts/transformation/staging_to_production.py"]),
     ("warehouse_load", ["python", "scripts/transformation/load_warehouse.py"]),
+    ("warehouse_export", ["python", "scripts/transformation/export_warehouse_parquet.py"]),
     ("analytics_generation", ["python", "scripts/transformation/generate_analytics.py"]),
 ]
 
@@ -116,7 +117,7 @@ def main():
     logging.info("PIPELINE EXECUTION STARTED")
     
     for name, cmd in STEPS:
-        logging.info(f"[STEP] Executing {len(results)+1}/6: {name}")
+        logging.info(f"[STEP] Executing {len(results)+1}/{len(STEPS)}: {name}")
         step_result = execute_step(name, cmd)
         results.append(step_result)
         
@@ -0,0 +1,88 @@
+import time
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def run_task_graph(
+    tasks: Dict[str, Callable[[], Any]],
+    dependencies: Dict[str, List[str]],
+    max_workers: int = 4,
+    on_complete: Optional[Callable[[str, Any], None]] = None,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Run `tasks` on a thread pool, starting each one once its dependencies finished.
+
+    `on_complete(name, result)` is called on the calling thread as each task
+    finishes. When a task fails, the tasks depending on it (directly or
+    through other tasks) are skipped while independent ones still run; the
+    first failure is re-raised once nothing is left to run.
+
+    Returns (results by task name, timeline of start/end offsets per task).
+    """
+    unknown = {d for deps in dependencies.values() for d in deps} - set(tasks)
+    if unknown:
+        raise ValueError(f"Unknown dependencies: {sorted(unknown)}")
+
+    pending = {name: set(dependencies.get(name, [])) for name in tasks}
+    done: set = set()
+    results: Dict[str, Any] = {}
+    timeline: List[Dict[str, Any]] = []
+    graph_start = time.perf_counter()
+
+    def timed(name: str) -> Tuple[Any, Dict[str, Any]]:
+        start = time.perf_counter()
+        entry = {
+            "task": name,
+            "started_at": datetime.now().isoformat(),
+            "start_offset_seconds": round(start - graph_start, 4),
+            "thread": threading.current_thread().name,
+        }
+        try:
+            result = tasks[name]()
+            entry["status"] = "success"
+            return result, entry
+        except Exception:
+            entry["status"] = "failed"
+            raise
+        finally:
+            end = time.perf_counter()
+            entry["end_offset_seconds"] = round(end - graph_start, 4)
+            entry["duration_seconds"] = round(end - start, 4)
+            timeline.append(entry)
+
+    running: Dict[Any, str] = {}
+    error: Optional[BaseException] = None
+    failed: set = set()  # failed tasks and the ones skipped because of them
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while pending or running:
+            blocked = [n for n, deps in pending.items() if deps & failed]
+            while blocked:
+                for name in blocked:
+                    del pending[name]
+                    failed.add(name)
+                blocked = [n for n, deps in pending.items() if deps & failed]
+            for name in [n for n, deps in pending.items() if deps <= done]:
+                del pending[name]
+                running[pool.submit(timed, name)] = name
+            if not running:
+                if pending:
+                    raise ValueError(f"Dependency cycle among: {sorted(pending)}")
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    results[name], _ = future.result()
+                except Exception as exc:
+                    error = error or exc
+                    failed.add(name)
+                    continue
+                done.add(name)
+                if on_complete:
+                    on_complete(name, results[name])
+
+    if error is not None:
+        raise error
+    timeline.sort(key=lambda e: e["start_offset_seconds"])
+    return results, timeline
@@ -1,12 +1,17 @@
 import os
 import json
+import argparse
 import yaml
 import sqlalchemy
 from sqlalchemy import text
-from typing import Dict, Any
+from typing import Dict, Any, Callable, List, Optional
 import pandas as pd
 
 CONFIG_PATH = os.path.join("config", "config.yaml")
+CACHE_PATH = os.path.join("reports", "quality_cache.json")
+
+STAGING_TABLES = ["customers", "products", "transactions", "transactionitems"]
+WAREHOUSE_TABLES = ["factorders", "dimcustomers", "dimorders", "dimdate", "factorderitems", "dimproducts"]
 
 
 def load_config(path: str = CONFIG_PATH) -> dict:
@@ -20,8 +25,8 @@ def get_engine(config: dict) -> sqlalchemy.Engine:
     return sqlalchemy.create_engine(url)
 
 
-def check_null_values(connection, schema: str) -> Dict[str, Any]:
-    """Completeness: NULLs in mandatory columns."""
+def check_null_values(connection, schema: str, tables: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Completeness: NULLs in mandatory columns (optionally only for `tables`)."""
     results: Dict[str, Any] = {}
     mandatory_columns = {
         "customers": ["customerid", "firstname", "lastname", "email", "registrationdate"],
@@ -31,6 +36,8 @@ def check_null_values(connection, schema: str) -> Dict[str, Any]:
     }
 
     for table, cols in mandatory_columns.items():
+        if tables is not None and table not in tables:
+            continue
         table_key = f"{schema}.{table}"
         results[table_key] = {}
         for col in cols:
@@ -40,8 +47,8 @@ def check_null_values(connection, schema: str) -> Dict[str, Any]:
     return results
 
 
-def check_duplicates(connection, schema: str) -> Dict[str, Any]:
-    """Uniqueness: duplicate primary keys."""
+def check_duplicates(connection, schema: str, tables: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Uniqueness: duplicate primary keys (optionally only for `tables`)."""
     results: Dict[str, Any] = {}
     pk_columns = {
         "customers": "customerid",
@@ -51,6 +58,8 @@ def check_duplicates(connection, schema: str) -> Dict[str, Any]:
     }
 
     for table, pk in pk_columns.items():
+        if tables is not None and table not in tables:
+            continue
         sql = text(f"""
             SELECT COUNT(*) FROM (
                 SELECT {pk}, COUNT(*) AS c
@@ -144,7 +153,7 @@ def check_warehouse_integrity(connection) -> Dict[str, Any]:
     results["fact_customers_orphans"] = connection.execute(text("""
         SELECT COUNT(*) FROM warehouse.factorders f 
         LEFT JOIN warehouse.dimcustomers dc
-               ON f.customerkey = dc.customerkey AND dc.iscurrent = TRUE
+               ON f.customerkey = dc.customerkey
         WHERE dc.customerkey IS NULL;
     """)).scalar_one()
 
@@ -187,6 +196,90 @@ def check_warehouse_ranges(connection) -> Dict[str, Any]:
     return results
 
 
+def table_fingerprint(connection, schema_table: str) -> str:
+    """Cheap change marker for a table and, if it is partitioned, its partitions.
+
+    Row count, newest row version (MAX(xmin), which any insert or update
+    moves), max loaded_at where the table has one, and the pg_stat
+    insert/update/delete counters summed over the partitions (the
+    partitioned parent itself has none).
+    """
+    schema, table = schema_table.split(".")
+    has_loaded_at = connection.execute(text("""
+        SELECT EXISTS (
+            SELECT 1
+            FROM information_schema.columns
+            WHERE table_schema = :schema
+              AND table_name   = :table
+              AND column_name  = 'loaded_at'
+        )
+    """), {"schema": schema, "table": table}).scalar_one()
+    loaded_at = "MAX(loaded_at)" if has_loaded_at else "NULL"
+    sql = text(f"""
+        SELECT concat_ws('|',
+            (SELECT COUNT(*) || ':' || COALESCE(MAX(xmin::text::bigint), 0) || ':' || COALESCE({loaded_at}::text, '')
+               FROM {schema}.{table}),
+            (SELECT SUM(n_tup_ins) || ':' || SUM(n_tup_upd) || ':' || SUM(n_tup_del)
+               FROM pg_stat_user_tables
+              WHERE relid = CAST(:schema_table AS regclass)
+                 OR relid IN (SELECT inhrelid FROM pg_inherits
+                               WHERE inhparent = CAST(:schema_table AS regclass)))
+        )
+    """)
+    return str(connection.execute(sql, {"schema_table": schema_table}).scalar_one())
+
+
+class QualityCheckCache:
+    """Check results keyed by the fingerprints of the tables they read."""
+
+    def __init__(self, path: str = CACHE_PATH, enabled: bool = True, force: bool = False):
+        self.path = path
+        self.enabled = enabled
+        self.force = force
+        self.entries: Dict[str, Any] = {}
+        self.hits: List[str] = []
+        self.misses: List[str] = []
+        if enabled and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get_or_run(self, key: str, fingerprint: str, run: Callable[[], Any]) -> Any:
+        entry = self.entries.get(key)
+        if self.enabled and not self.force and entry and entry.get("fingerprint") == fingerprint:
+            self.hits.append(key)
+            return entry["result"]
+        result = run()
+        self.misses.append(key)
+        self.entries[key] = {
+            "fingerprint": fingerprint,
+            "result": result,
+            "checked_at": pd.Timestamp.now().isoformat(),
+        }
+        return result
+
+    def is_cached(self, key: str) -> bool:
+        return key in self.hits
+
+    def save(self) -> None:
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=2, default=str)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "forced_recheck": self.force,
+            "hits": len(self.hits),
+            "misses": len(self.misses),
+            "cached_checks": list(self.hits),
+        }
+
+
 def calculate_quality_score(check_results: Dict[str, Any]) -> float:
     """Aggregate into 0-100 quality score."""
     nulls = check_results.get("nulls", {})
@@ -212,30 +305,70 @@ def calculate_quality_score(check_results: Dict[str, Any]) -> float:
     return max(score, 0.0)
 
 
-def main() -> None:
-    """Run all checks and write JSON report."""
-    config = load_config()
+def main(force_recheck: bool = False) -> None:
+    """Run all checks and write JSON report.
+
+    Results are served from the check cache for tables whose fingerprint is
+    unchanged since the previous run; `force_recheck` re-evaluates everything.
+    """
+    config = load_config() or {}
     engine = get_engine(config)
+    cache = QualityCheckCache(
+        enabled=config.get("quality_checks", {}).get("cache_enabled", True),
+        force=force_recheck,
+    )
 
     with engine.connect() as conn:
         # Staging checks
-        nulls_staging = check_null_values(conn, "staging")
-        duplicates_staging = check_duplicates(conn, "staging")
-        ri_staging = check_referential_integrity(conn, "staging")
-        ranges_staging = check_data_ranges(conn, "staging")
+        fingerprints = {t: table_fingerprint(conn, f"staging.{t}") for t in STAGING_TABLES}
+        nulls_staging: Dict[str, Any] = {}
+        duplicates_staging: Dict[str, Any] = {}
+        for t in STAGING_TABLES:
+            table_key = f"staging.{t}"
+            nulls_staging[table_key] = cache.get_or_run(
+                f"nulls:{table_key}", fingerprints[t],
+                lambda t=t: check_null_values(conn, "staging", [t])[f"staging.{t}"],
+            )
+            duplicates_staging[table_key] = cache.get_or_run(
+                f"duplicates:{table_key}", fingerprints[t],
+                lambda t=t: check_duplicates(conn, "staging", [t])[f"staging.{t}"],
+            )
+        ri_staging = cache.get_or_run(
+            "referential_integrity:staging",
+            "/".join(fingerprints[t] for t in STAGING_TABLES),
+            lambda: check_referential_integrity(conn, "staging"),
+        )
+        ranges_staging = cache.get_or_run(
+            "ranges:staging",
+            "/".join(fingerprints[t] for t in ("products", "transactionitems")),
+            lambda: check_data_ranges(conn, "staging"),
+        )
 
         # Warehouse checks (only if dimcustomers exists)
         if table_exists(conn, "warehouse.dimcustomers"):
+            wh_fingerprint = "/".join(
+                table_fingerprint(conn, f"warehouse.{t}")
+                for t in WAREHOUSE_TABLES
+                if table_exists(conn, f"warehouse.{t}")
+            )
             nulls_wh = {}
             duplicates_wh = {}
-            ri_wh = check_warehouse_integrity(conn)
-            ranges_wh = check_warehouse_ranges(conn)
+            ri_wh = cache.get_or_run(
+                "referential_integrity:warehouse", wh_fingerprint,
+                lambda: check_warehouse_integrity(conn),
+            )
+            ranges_wh = cache.get_or_run(
+                "ranges:warehouse", wh_fingerprint,
+                lambda: check_warehouse_ranges(conn),
+            )
         else:
             nulls_wh = {}
             duplicates_wh = {}
             ri_wh = {}
             ranges_wh = {}
 
+    cache.save()
+
     check_results = {
         "nulls": {**nulls_staging, **nulls_wh},
         "duplicates": {**duplicates_staging, **duplicates_wh},
@@ -262,23 +395,28 @@ def main() -> None:
                 "tables_checked": list(check_results["nulls"].keys()),
                 "null_violations": total_nulls,
                 "details": check_results["nulls"],
+                "cached_tables": [t for t in check_results["nulls"] if cache.is_cached(f"nulls:{t}")],
             },
             "duplicate_checks": {
                 "status": "passed" if total_dups == 0 else "failed",
                 "duplicates_found": total_dups,
                 "details": check_results["duplicates"],
+                "cached_tables": [t for t in check_results["duplicates"] if cache.is_cached(f"duplicates:{t}")],
             },
             "referential_integrity": {
                 "status": "passed" if total_orphans == 0 else "failed",
                 "orphan_records": total_orphans,
                 "details": check_results["referential_integrity"],
+                "cached": [k.split(":")[1] for k in cache.hits if k.startswith("referential_integrity:")],
             },
             "range_checks": {
                 "status": "passed" if total_ranges == 0 else "failed",
                 "violations": total_ranges,
                 "details": check_results["ranges"],
+                "cached": [k.split(":")[1] for k in cache.hits if k.startswith("ranges:")],
             },
         },
+        "cache": cache.summary(),
         "overall_quality_score": round(score, 2),
         "quality_grade": grade,
     }
@@ -292,4 +430,11 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run data quality checks")
+    parser.add_argument(
+        "--force-recheck",
+        action="store_true",
+        help="ignore cached check results and re-evaluate every table",
+    )
+    args = parser.parse_args()
+    main(force_recheck=args.force_recheck)
@@ -0,0 +1,189 @@
+import re
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+# What each aggregate table can answer, smallest grain first. Dimensions and
+# measures map a logical name to SQL over the source (alias s, with dimdate
+# as d); measures listed in grain_only do not add up across grain rows
+# (distinct counts), so they are only exact when grouped by the full grain.
+# priced_orders is the denominator of AVG(totalamount): the orders with an
+# amount. factorders.totalamount is NOT NULL, so the aggregates' order
+# counts are exactly that.
+AGGREGATE_SOURCES: List[Dict[str, Any]] = [
+    {
+        "table": "agg_customer_metrics",
+        "watermark": "agg_customer_metrics.orderkey",
+        "grain": ["customerkey"],
+        "dimensions": {"customerkey": "s.customerkey"},
+        "measures": {
+            "revenue": "SUM(s.total_spent)",
+            "orders": "COALESCE(SUM(s.total_transactions), 0)",
+            "priced_orders": "COALESCE(SUM(s.total_transactions), 0)",
+            "customers": "COUNT(*)",
+        },
+        "grain_only": set(),
+    },
+    {
+        "table": "agg_daily_sales",
+        "watermark": "agg_daily_sales.orderkey",
+        "grain": ["datekey"],
+        "dimensions": {
+            "datekey": "s.datekey",
+            "year": "d.year",
+            "month": "d.month",
+            "weekday": "d.weekday",
+            "weekdayname": "d.weekdayname",
+        },
+        "measures": {
+            "revenue": "SUM(s.total_revenue)",
+            "orders": "COALESCE(SUM(s.total_transactions), 0)",
+            "priced_orders": "COALESCE(SUM(s.total_transactions), 0)",
+            "customers": "COALESCE(SUM(s.unique_customers), 0)",
+        },
+        "grain_only": {"customers"},
+    },
+]
+
+# Fallback that answers everything, one row per order.
+FACT_SOURCE: Dict[str, Any] = {
+    "table": "factorders",
+    "grain": ["orderkey"],
+    "dimensions": {
+        "customerkey": "s.customerkey",
+        "datekey": "s.datekey",
+        "year": "d.year",
+        "month": "d.month",
+        "weekday": "d.weekday",
+        "weekdayname": "d.weekdayname",
+        "quantity": "s.quantity",
+    },
+    "measures": {
+        "revenue": "SUM(s.totalamount)",
+        "orders": "COUNT(*)",
+        "priced_orders": "COUNT(s.totalamount)",
+        "customers": "COUNT(DISTINCT s.customerkey)",
+        "quantity": "SUM(s.quantity)",
+    },
+    "grain_only": set(),
+}
+
+LogicalQuery = Dict[str, Any]
+
+
+def covers(source: Dict[str, Any], dimensions: Iterable[str], measures: Iterable[str]) -> bool:
+    dimensions, measures = set(dimensions), set(measures)
+    return (
+        dimensions <= set(source["dimensions"])
+        and measures <= set(source["measures"])
+        and (not measures & source["grain_only"] or set(source["grain"]) <= dimensions)
+    )
+
+
+def choose_source(query: LogicalQuery, available: Dict[str, float]) -> Dict[str, Any]:
+    """Smallest up-to-date aggregate covering `query`, else the fact table.
+
+    `available` maps aggregate tables that are current to their estimated
+    row count (negative when unknown, i.e. never analyzed).
+    """
+    candidates = [
+        (position, source)
+        for position, source in enumerate(AGGREGATE_SOURCES)
+        if source["table"] in available
+        and covers(source, query["dimensions"], query["measures"])
+    ]
+    if not candidates:
+        return FACT_SOURCE
+
+    def size(candidate):
+        rows = available[candidate[1]["table"]]
+        return (rows if rows >= 0 else float("inf"), candidate[0])
+
+    return min(candidates, key=size)[1]
+
+
+def render_query(query: LogicalQuery, source: Dict[str, Any], schema: str = "warehouse") -> str:
+    """`query["sql"]` with its `base` CTE aggregated from `source`."""
+    columns = [f"{source['dimensions'][d]} AS {d}" for d in query["dimensions"]]
+    columns += [f"{source['measures'][m]} AS {m}" for m in query["measures"]]
+    from_sql = f"{schema}.{source['table']} s"
+    if any(source["dimensions"][d].startswith("d.") for d in query["dimensions"]):
+        from_sql += f"\n    JOIN {schema}.dimdate d ON d.datekey = s.datekey"
+    group_by = (
+        "\n    GROUP BY " + ", ".join(source["dimensions"][d] for d in query["dimensions"])
+        if query["dimensions"]
+        else ""
+    )
+    base = f"base AS (\n    SELECT {', '.join(columns)}\n    FROM {from_sql}{group_by}\n)"
+    sql = query["sql"].strip()
+    # a query with its own CTEs gets base prepended to them
+    own_ctes = re.match(r"WITH\s+", sql, re.IGNORECASE)
+    if own_ctes:
+        return f"WITH {base},\n{sql[own_ctes.end():]}\n"
+    return f"WITH {base}\n{sql}\n"
+
+
+def current_aggregates(connection, schema: str = "warehouse") -> Dict[str, float]:
+    """Aggregate tables whose merge watermark has caught up with factorders.
+
+    An aggregate behind the fact table (or missing) would answer with stale
+    numbers, so it is left out and its queries fall back to factorders.
+    """
+    tables = [s["table"] for s in AGGREGATE_SOURCES]
+    try:
+        sizes = dict(
+            connection.execute(
+                text(
+                    """
+                SELECT c.relname, c.reltuples
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = :schema AND c.relname = ANY(:tables)
+            """
+                ),
+                {"schema": schema, "tables": tables},
+            ).all()
+        )
+        watermarks = dict(
+            connection.execute(
+                text(f"SELECT name, value FROM {schema}.load_watermarks WHERE name = ANY(:names)"),
+                {"names": [s["watermark"] for s in AGGREGATE_SOURCES]},
+            ).all()
+        )
+        latest = connection.execute(
+            text(f"SELECT COALESCE(MAX(orderkey), 0) FROM {schema}.factorders")
+        ).scalar_one()
+    except DBAPIError:
+        connection.rollback()
+        return {}
+    return fresh_aggregates(sizes, watermarks, latest)
+
+
+def fresh_aggregates(sizes: Dict[str, float], watermarks: Dict[str, int], latest: int) -> Dict[str, float]:
+    """{table: rows} of the AGGREGATE_SOURCES whose watermark reached `latest` (MAX factorders.orderkey)."""
+    return {
+        s["table"]: float(sizes[s["table"]])
+        for s in AGGREGATE_SOURCES
+        if s["table"] in sizes and watermarks.get(s["watermark"], -1) >= latest
+    }
+
+
+def written_source(sql: str) -> str:
+    """First warehouse table a hand-written query reads from."""
+    match = re.search(r"\bFROM\s+warehouse\.(\w+)", sql, re.IGNORECASE)
+    return match.group(1) if match else "unknown"
+
+
+def route_queries(
+    queries: Dict[str, Union[str, LogicalQuery]], available: Dict[str, float], schema: str = "warehouse"
+) -> Dict[str, Tuple[str, str]]:
+    """{name: (sql, source table)}; plain SQL strings run as written."""
+    routed = {}
+    for name, query in queries.items():
+        if isinstance(query, str):
+            routed[name] = (query, written_source(query))
+        else:
+            source = choose_source(query, available)
+            routed[name] = (render_query(query, source, schema), source["table"])
+    return routed
@@ -0,0 +1,133 @@
+import os
+import csv
+import glob
+import time
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from scripts.transformation.aggregate_routing import fresh_aggregates
+
+try:
+    import duckdb
+except ImportError:  # optional: only needed for --engine duckdb
+    duckdb = None
+
+
+class SnapshotEngine:
+    """In-process DuckDB over the Parquet snapshot written by export_warehouse_parquet.
+
+    Every exported table is exposed as a `warehouse.<table>` view, so the
+    analytics SQL runs unchanged. The views read Parquet lazily: DuckDB
+    pushes column projection and filters into the scan, skipping row groups
+    by their min/max statistics and (for the year=/month= fact directories)
+    whole files by partition value.
+    """
+
+    def __init__(self, parquet_dir: str, threads: Optional[int] = None):
+        if duckdb is None:
+            raise RuntimeError("The duckdb engine needs the duckdb package (pip install duckdb)")
+        if not os.path.isdir(parquet_dir):
+            raise RuntimeError(f"No Parquet snapshot at {parquet_dir}; run export_warehouse_parquet.py first")
+        self.parquet_dir = parquet_dir
+        self.connection = duckdb.connect()
+        if threads:
+            self.connection.execute(f"SET threads = {int(threads)}")
+        self.connection.execute("CREATE SCHEMA warehouse")
+        self.files: Dict[str, list] = {}
+        for table_dir in sorted(glob.glob(os.path.join(parquet_dir, "*", ""))):
+            table = os.path.basename(os.path.dirname(table_dir))
+            partitioned = bool(glob.glob(os.path.join(table_dir, "year=*")))
+            if partitioned:
+                pattern = os.path.join(table_dir, "year=*", "month=*", "*.parquet")
+            else:
+                pattern = os.path.join(table_dir, "*.parquet")
+            self.files[table] = sorted(glob.glob(pattern))
+            if not self.files[table]:
+                continue
+            source = (
+                f"SELECT * EXCLUDE (year, month) FROM read_parquet('{pattern}', hive_partitioning = true)"
+                if partitioned
+                else f"SELECT * FROM read_parquet('{pattern}')"
+            )
+            self.connection.execute(f"CREATE VIEW warehouse.{table} AS {source}")
+
+    def row_counts(self) -> Dict[str, float]:
+        """Rows per exported table, from the Parquet footers (nothing is scanned)."""
+        return {
+            table: float(sum(pq.ParquetFile(path).metadata.num_rows for path in paths))
+            for table, paths in self.files.items()
+            if paths
+        }
+
+    def current_aggregates(self) -> Dict[str, float]:
+        """Aggregates whose exported watermark caught up with factorders, as current_aggregates does in Postgres.
+
+        A snapshot without load_watermarks answers everything from the facts.
+        """
+        counts = self.row_counts()
+        if "load_watermarks" not in counts or "factorders" not in counts:
+            return {}
+        watermarks = dict(self.connection.execute("SELECT name, value FROM warehouse.load_watermarks").fetchall())
+        latest = self.connection.execute("SELECT COALESCE(MAX(orderkey), 0) FROM warehouse.factorders").fetchone()[0]
+        return fresh_aggregates(counts, watermarks, latest)
+
+    def query(self, sql: str) -> Tuple[pd.DataFrame, float]:
+        start = time.time()
+        df = self.connection.execute(sql.strip().rstrip(";")).df()
+        return df, (time.time() - start) * 1000
+
+    def copy_to_csv(self, sql: str, path: str) -> Tuple[int, int, float]:
+        """COPY the query result straight to a CSV; returns (rows, columns, elapsed_ms)."""
+        tmp_path = f"{path}.part"
+        start = time.time()
+        try:
+            rows = self.connection.execute(
+                f"COPY ({sql.strip().rstrip(';')}) TO '{tmp_path}' (FORMAT csv, HEADER)"
+            ).fetchone()[0]
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        elapsed_ms = (time.time() - start) * 1000
+        os.replace(tmp_path, path)
+        with open(path, newline="") as f:
+            columns = len(next(csv.reader(f), []))
+        return int(rows), columns, elapsed_ms
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def compare_frames(expected: pd.DataFrame, actual: pd.DataFrame, tolerance: float = 0.01) -> Optional[str]:
+    """None if both results hold the same rows (any order), else what differs.
+
+    Numbers are compared within `tolerance`, since the engines round
+    decimal and floating point averages differently.
+    """
+    if list(expected.columns) != list(actual.columns):
+        return f"columns {list(expected.columns)} != {list(actual.columns)}"
+    if len(expected) != len(actual):
+        return f"{len(expected)} rows != {len(actual)} rows"
+
+    def normalized(df):
+        out = df.copy()
+        for col in out.columns:
+            numeric = pd.to_numeric(out[col], errors="coerce")
+            if numeric.notna().sum() == out[col].notna().sum():
+                out[col] = numeric.astype(float)
+            else:
+                out[col] = out[col].astype(str)
+        return out.sort_values(list(out.columns)).reset_index(drop=True)
+
+    left, right = normalized(expected), normalized(actual)
+    for col in left.columns:
+        if left[col].dtype == float and right[col].dtype == float:
+            diff = (left[col] - right[col]).abs()
+            both_null = left[col].isna() & right[col].isna()
+            if ((diff > tolerance) | (diff.isna() & ~both_null)).any():
+                return f"values differ in {col}"
+        elif not left[col].astype(str).equals(right[col].astype(str)):
+            return f"values differ in {col}"
+    return None
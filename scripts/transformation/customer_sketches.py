@@ -0,0 +1,221 @@
+import os
+import sys
+import math
+import time
+import zlib
+import argparse
+from datetime import date
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 2^12 one-byte registers: ~1.6% standard error, at most 4 KB per sketch
+# before compression. Changing it needs a full aggregate rebuild.
+SKETCH_PRECISION = 12
+# member of the per-day sketch covering every customer, next to the per-state ones
+ALL_MEMBERS = "*"
+# member for a missing state or payment method, in the sketches and the rollup cube
+UNKNOWN_MEMBER = "unknown"
+HASH_BITS = 64
+
+
+class HyperLogLog:
+    """HyperLogLog distinct-count sketch over 64-bit hashes.
+
+    Sketches are built in Postgres (see register_sql) and merged and
+    estimated here; both sides split a hash into register index and rank
+    the same way, so they can be mixed freely as long as the same hash
+    function fed them.
+    """
+
+    def __init__(self, precision: int = SKETCH_PRECISION, registers: Optional[np.ndarray] = None):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"precision must be between 4 and 18, got {precision}")
+        self.precision = precision
+        self.registers = (
+            np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers.astype(np.uint8)
+        )
+
+    @property
+    def m(self) -> int:
+        return 1 << self.precision
+
+    @property
+    def relative_error(self) -> float:
+        """Standard error of estimate() relative to the true count."""
+        return 1.04 / math.sqrt(self.m)
+
+    def add_hash(self, value: int) -> None:
+        value &= (1 << HASH_BITS) - 1
+        index = value & (self.m - 1)
+        rest = value >> self.precision
+        rank = HASH_BITS - self.precision - rest.bit_length() + 1
+        self.registers[index] = max(self.registers[index], rank)
+
+    def set_register(self, index: int, rank: int) -> None:
+        self.registers[index] = max(self.registers[index], rank)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge precision {other.precision} into {self.precision}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @classmethod
+    def union(cls, sketches: Iterable["HyperLogLog"], precision: int = SKETCH_PRECISION) -> "HyperLogLog":
+        sketches = list(sketches)
+        if not sketches:
+            return cls(precision)
+        return cls(sketches[0].precision, np.maximum.reduce([s.registers for s in sketches]))
+
+    def estimate(self) -> float:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # linear counting is more accurate while many registers are empty
+            return m * math.log(m / zeros)
+        return float(raw)
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        registers = np.frombuffer(zlib.decompress(bytes(data)), dtype=np.uint8).copy()
+        return cls(int(registers.size).bit_length() - 1, registers)
+
+
+def register_sql(hash_sql: str, precision: int = SKETCH_PRECISION) -> Tuple[str, str]:
+    """(index, rank) SQL expressions for a bigint hash, matching HyperLogLog.add_hash."""
+    width = HASH_BITS - precision
+    index = f"(({hash_sql}) & {(1 << precision) - 1})::int"
+    rest = f"((({hash_sql}) >> {precision}) & {(1 << width) - 1})"
+    rank = f"({width} - length(ltrim({rest}::bit(64)::text, '0')) + 1)"
+    return index, rank
+
+
+def customer_hash_sql(customerid_sql: str) -> str:
+    # the natural key, so SCD2 versions of one customer count once
+    return f"hashtextextended({customerid_sql}::text, 0)"
+
+
+def sketches_from_registers(rows: Iterable[Tuple[Any, ...]], precision: int = SKETCH_PRECISION) -> Dict[tuple, HyperLogLog]:
+    """Group (key..., index, rank) rows into one sketch per key."""
+    sketches: Dict[tuple, HyperLogLog] = {}
+    for *key, index, rank in rows:
+        sketch = sketches.setdefault(tuple(key), HyperLogLog(precision))
+        sketch.set_register(index, rank)
+    return sketches
+
+
+SKETCH_SOURCES = {
+    # dimension -> (sketch table, member column)
+    "state": ("agg_customer_sketches", "state"),
+    "category": ("agg_category_sketches", "category"),
+}
+
+
+def distinct_customers(
+    connection,
+    start: date,
+    end: date,
+    state: Optional[str] = None,
+    category: Optional[str] = None,
+    schema: str = "warehouse",
+) -> Dict[str, Any]:
+    """Estimated distinct customers who ordered between `start` and `end` (inclusive).
+
+    Merges the stored per-day sketches for the range, optionally for one
+    state or product category, and reports the error bound (one standard
+    error; the true count is within it about 68% of the time).
+    """
+    if state is not None and category is not None:
+        raise ValueError("Filter by state or by category, not both")
+    table, column = SKETCH_SOURCES["category" if category is not None else "state"]
+    member = category if category is not None else (state if state is not None else ALL_MEMBERS)
+    rows = connection.execute(
+        text(
+            f"""
+        SELECT s.registers
+        FROM {schema}.{table} s
+        JOIN {schema}.dimdate d ON d.datekey = s.datekey
+        WHERE d.fulldate BETWEEN :start AND :end AND s.{column} = :member
+    """
+        ),
+        {"start": start, "end": end, "member": member},
+    ).scalars().all()
+    started = time.perf_counter()
+    sketch = HyperLogLog.union(HyperLogLog.from_bytes(r) for r in rows)
+    estimate = sketch.estimate()
+    return {
+        "estimate": round(estimate),
+        "relative_error": round(sketch.relative_error, 4),
+        "error_bound": round(estimate * sketch.relative_error),
+        "sketches_merged": len(rows),
+        "merge_microseconds": round((time.perf_counter() - started) * 1e6, 1),
+    }
+
+
+def exact_distinct_customers(
+    connection,
+    start: date,
+    end: date,
+    state: Optional[str] = None,
+    category: Optional[str] = None,
+    schema: str = "warehouse",
+) -> int:
+    """COUNT(DISTINCT customerid) from the fact tables, for audits of the sketches."""
+    if category is not None:
+        source = f"{schema}.factorderitems f"
+        member_filter = "AND f.category = :member"
+    else:
+        source = f"{schema}.factorders f"
+        member_filter = "AND c.state = :member" if state is not None else ""
+    return connection.execute(
+        text(
+            f"""
+        SELECT COUNT(DISTINCT c.customerid)
+        FROM {source}
+        JOIN {schema}.dimcustomers c ON c.customerkey = f.customerkey
+        JOIN {schema}.dimdate d ON d.datekey = f.datekey
+        WHERE d.fulldate BETWEEN :start AND :end {member_filter}
+    """
+        ),
+        {"start": start, "end": end, "member": category if category is not None else state},
+    ).scalar_one()
+
+
+def main(start: date, end: date, state: Optional[str] = None, category: Optional[str] = None,
+         exact: bool = False):
+    from scripts.transformation.load_warehouse import get_engine, load_config
+
+    engine = get_engine(load_config())
+    with engine.connect() as conn:
+        result = distinct_customers(conn, start, end, state, category)
+        if exact:
+            result["exact"] = exact_distinct_customers(conn, start, end, state, category)
+    print(
+        f"~{result['estimate']} distinct customers (+/- {result['error_bound']}, "
+        f"{result['sketches_merged']} sketches merged in {result['merge_microseconds']}us)"
+    )
+    if exact:
+        print(f"exact: {result['exact']}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distinct customers over a date range from the stored sketches")
+    parser.add_argument("--start", type=date.fromisoformat, required=True)
+    parser.add_argument("--end", type=date.fromisoformat, required=True)
+    parser.add_argument("--state")
+    parser.add_argument("--category")
+    parser.add_argument("--exact", action="store_true", help="also count exactly from the fact tables")
+    args = parser.parse_args()
+    main(args.start, args.end, args.state, args.category, args.exact)
@@ -1,14 +1,24 @@
 import os
+import sys
+import json
 import yaml
 import logging
 import pandas as pd
 import sqlalchemy
 from sqlalchemy import text
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from datetime import datetime
 
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from scripts.pipeline.task_graph import run_task_graph
+
 CONFIG_PATH = os.path.join("config", "config.yaml")
 LOGS_DIR = "logs"
+STATE_PATH = os.path.join("data", "processed", "etl_state.json")
+LOAD_MODES = ("full", "incremental")
 
 def setup_logging() -> logging.Logger:
     os.makedirs(LOGS_DIR, exist_ok=True)
@@ -25,120 +35,270 @@ def get_engine(config: dict) -> sqlalchemy.Engine:
     db = config["database"]
     url = f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['name']}"
     print("USING DB URL:", url)
-    return sqlalchemy.create_engine(url)
-
-
-def transform_customers(engine: sqlalchemy.Engine, logger: logging.Logger) -> Dict[str, Any]:
-    with engine.connect() as conn:
-        conn.execute(text("TRUNCATE production.customers RESTART IDENTITY"))
-        # LOAD ALL customers - minimal filtering
-        sql = text("""
-        INSERT INTO production.customers (
-            customerid, firstname, lastname, email, phone, 
-            registrationdate, city, state, country, agegroup,
-            created_at, updated_at
-        )
-        SELECT TRIM(customerid), TRIM(firstname), TRIM(lastname),
-            LOWER(TRIM(email)), TRIM(phone), registrationdate::DATE,
-            TRIM(city), TRIM(state), TRIM(country), agegroup,
-            CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
-        FROM staging.customers
-        WHERE customerid IS NOT NULL;
-        """)
-        result = conn.execute(sql)
-        rows = result.rowcount
-        logger.info(f"Loaded {rows} customers to production")
-        return {"customers": rows}
-
-def transform_products(engine: sqlalchemy.Engine, logger: logging.Logger) -> Dict[str, Any]:
-    with engine.connect() as conn:
-        conn.execute(text("TRUNCATE production.products RESTART IDENTITY"))
-        sql = text("""
-        INSERT INTO production.products (
-            productid, productname, category, subcategory,
-            price, cost, brand, stockquantity, supplierid,
-            created_at, updated_at
-        )
-        SELECT TRIM(productid), TRIM(productname), TRIM(category),
-            COALESCE(TRIM(subcategory), 'Unknown'), price::NUMERIC(10,2), 
-            cost::NUMERIC(10,2), TRIM(brand), GREATEST(stockquantity::INTEGER, 0), 
-            TRIM(supplierid), CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
-        FROM staging.products
-        WHERE productid IS NOT NULL;
-        """)
-        result = conn.execute(sql)
-        rows = result.rowcount
-        logger.info(f"Loaded {rows} products to production")
-        return {"products": rows}
-
-def transform_transactions(engine: sqlalchemy.Engine, logger: logging.Logger) -> Dict[str, Any]:
-    with engine.connect() as conn:
-        conn.execute(text("TRUNCATE production.transactions RESTART IDENTITY"))
-        sql = text("""
-        INSERT INTO production.transactions (
-            transactionid, customerid, transactiondate, transactiontime,
-            paymentmethod, shippingaddress, totalamount,
-            created_at, updated_at
-        )
-        SELECT TRIM(transactionid), TRIM(customerid), transactiondate::DATE, 
-               transactiontime::TIME, UPPER(TRIM(paymentmethod)), 
-               TRIM(shippingaddress), totalamount::NUMERIC(12,2),
-               CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
-        FROM staging.transactions
-        WHERE totalamount > 0;
-        """)
-        result = conn.execute(sql)
-        rows = result.rowcount
-        logger.info(f"Loaded {rows} transactions to production")
-        return {"transactions": rows}
-
-
-def transform_transactionitems(engine: sqlalchemy.Engine, logger: logging.Logger) -> Dict[str, Any]:
-    with engine.connect() as conn:
-        conn.execute(text("TRUNCATE production.transactionitems RESTART IDENTITY"))
-
-        sql = text("""
-        INSERT INTO production.transactionitems (
-            itemid, transactionid, productid, quantity,
-            unitprice, discountpercentage, linetotal,
-            created_at, updated_at
+    # one pooled connection per concurrently running transform
+    pool_size = max(5, get_max_concurrency(config))
+    return sqlalchemy.create_engine(url, pool_size=pool_size)
+
+
+def get_max_concurrency(config: dict) -> int:
+    return int((config.get("etl") or {}).get("max_concurrency", 4))
+
+
+# Per-table transform definitions: production column -> staging expression.
+TABLE_SPECS: Dict[str, Dict[str, Any]] = {
+    "customers": {
+        "key": "customerid",
+        "label": "customers",
+        "columns": {
+            "customerid": "TRIM(customerid)",
+            "firstname": "TRIM(firstname)",
+            "lastname": "TRIM(lastname)",
+            "email": "LOWER(TRIM(email))",
+            "phone": "TRIM(phone)",
+            "registrationdate": "registrationdate::DATE",
+            "city": "TRIM(city)",
+            "state": "TRIM(state)",
+            "country": "TRIM(country)",
+            "agegroup": "agegroup",
+        },
+        "where": "customerid IS NOT NULL",
+    },
+    "products": {
+        "key": "productid",
+        "label": "products",
+        "columns": {
+            "productid": "TRIM(productid)",
+            "productname": "TRIM(productname)",
+            "category": "TRIM(category)",
+            "subcategory": "COALESCE(TRIM(subcategory), 'Unknown')",
+            "price": "price::NUMERIC(10,2)",
+            "cost": "cost::NUMERIC(10,2)",
+            "brand": "TRIM(brand)",
+            "stockquantity": "GREATEST(stockquantity::INTEGER, 0)",
+            "supplierid": "TRIM(supplierid)",
+        },
+        "where": "productid IS NOT NULL",
+    },
+    "transactions": {
+        "key": "transactionid",
+        "label": "transactions",
+        "columns": {
+            "transactionid": "TRIM(transactionid)",
+            "customerid": "TRIM(customerid)",
+            "transactiondate": "transactiondate::DATE",
+            "transactiontime": "transactiontime::TIME",
+            "paymentmethod": "UPPER(TRIM(paymentmethod))",
+            "shippingaddress": "TRIM(shippingaddress)",
+            "totalamount": "totalamount::NUMERIC(12,2)",
+        },
+        "where": "totalamount > 0",
+    },
+    "transactionitems": {
+        "key": "itemid",
+        "label": "transaction items",
+        "columns": {
+            "itemid": "TRIM(itemid)",
+            "transactionid": "TRIM(transactionid)",
+            "productid": "TRIM(productid)",
+            "quantity": "GREATEST(quantity::INTEGER, 1)",
+            "unitprice": "unitprice::NUMERIC(10,2)",
+            "discountpercentage": "GREATEST(LEAST(discountpercentage::NUMERIC, 100), 0)",
+            "linetotal": "GREATEST(linetotal::NUMERIC(12,2), 0.01)",
+        },
+        "where": "TRUE",
+    },
+}
+
+
+def load_state(path: str = STATE_PATH) -> Dict[str, Any]:
+    """Per-table high-water marks from the last successful run."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state: Dict[str, Any], path: str = STATE_PATH) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(state, f, indent=2, default=str)
+
+
+def build_full_reload_sql(table: str) -> str:
+    spec = TABLE_SPECS[table]
+    cols = ", ".join(spec["columns"])
+    exprs = ", ".join(spec["columns"].values())
+    return f"""
+        INSERT INTO production.{table} ({cols}, created_at, updated_at)
+        SELECT {exprs}, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM staging.{table}
+        WHERE {spec["where"]};
+    """
+
+
+def build_upsert_sql(table: str) -> str:
+    """Merge staging rows newer than :since; updated_at only moves on real changes.
+
+    Returns one row: (source rows, inserted, updated). Rows skipped by the
+    DO UPDATE ... WHERE guard are unchanged and not returned by RETURNING.
+    """
+    spec = TABLE_SPECS[table]
+    key = spec["key"]
+    cols = ", ".join(spec["columns"])
+    src_cols = ", ".join(f"{expr} AS {col}" for col, expr in spec["columns"].items())
+    non_key = [c for c in spec["columns"] if c != key]
+    assignments = ", ".join(f"{c} = EXCLUDED.{c}" for c in non_key)
+    current = ", ".join(f"production.{table}.{c}" for c in non_key)
+    incoming = ", ".join(f"EXCLUDED.{c}" for c in non_key)
+    return f"""
+        WITH src AS (
+            SELECT {src_cols}
+            FROM staging.{table}
+            WHERE {spec["where"]}
+              AND loaded_at > COALESCE(CAST(:since AS TIMESTAMP), '-infinity'::TIMESTAMP)
+              AND loaded_at <= :high_water_mark
+        ),
+        upserted AS (
+            INSERT INTO production.{table} ({cols}, created_at, updated_at)
+            SELECT {cols}, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP FROM src
+            ON CONFLICT ({key}) DO UPDATE
+               SET {assignments}, updated_at = CURRENT_TIMESTAMP
+             WHERE ({current}) IS DISTINCT FROM ({incoming})
+            RETURNING (xmax = 0) AS inserted
         )
-        SELECT 
-            TRIM(itemid),
-            TRIM(transactionid),
-            TRIM(productid),
-            GREATEST(quantity::INTEGER, 1),
-            unitprice::NUMERIC(10,2),
-            GREATEST(LEAST(discountpercentage::NUMERIC, 100), 0),
-            GREATEST(linetotal::NUMERIC(12,2), 0.01),
-            CURRENT_TIMESTAMP,
-            CURRENT_TIMESTAMP
-        FROM staging.transactionitems;
-        """)
-        result = conn.execute(sql)
-        rows = result.rowcount
-        logger.info(f"Loaded {rows} transaction items to production")
-        return {"transactionitems": rows}
+        SELECT
+            (SELECT COUNT(*) FROM src) AS source_rows,
+            COUNT(*) FILTER (WHERE inserted) AS inserted,
+            COUNT(*) FILTER (WHERE NOT inserted) AS updated
+        FROM upserted;
+    """
+
+
+def load_table(
+    engine: sqlalchemy.Engine,
+    logger: logging.Logger,
+    table: str,
+    mode: str = "full",
+    since: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Load one production table in `full` (truncate + insert) or `incremental` (upsert) mode."""
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown load mode for {table}: {mode}")
+    label = TABLE_SPECS[table]["label"]
+    with engine.begin() as conn:
+        high_water_mark = conn.execute(
+            text(f"SELECT MAX(loaded_at) FROM staging.{table}")
+        ).scalar()
+        if mode == "full":
+            conn.execute(text(f"TRUNCATE production.{table} RESTART IDENTITY"))
+            rows = conn.execute(text(build_full_reload_sql(table))).rowcount
+            stats = {"inserted": rows, "updated": 0, "unchanged": 0}
+        else:
+            source_rows, inserted, updated = conn.execute(
+                text(build_upsert_sql(table)),
+                {"since": since, "high_water_mark": high_water_mark},
+            ).one()
+            rows = inserted + updated
+            stats = {
+                "inserted": inserted,
+                "updated": updated,
+                "unchanged": source_rows - inserted - updated,
+            }
+    logger.info(f"Loaded {rows} {label} to production ({mode}: {stats})")
+    return {
+        "mode": mode,
+        "rows": rows,
+        **stats,
+        "since": since,
+        "high_water_mark": high_water_mark,
+    }
+
+
+def transform_customers(engine: sqlalchemy.Engine, logger: logging.Logger,
+                        mode: str = "full", since: Optional[str] = None) -> Dict[str, Any]:
+    return {"customers": load_table(engine, logger, "customers", mode, since)}
+
+def transform_products(engine: sqlalchemy.Engine, logger: logging.Logger,
+                       mode: str = "full", since: Optional[str] = None) -> Dict[str, Any]:
+    return {"products": load_table(engine, logger, "products", mode, since)}
+
+def transform_transactions(engine: sqlalchemy.Engine, logger: logging.Logger,
+                           mode: str = "full", since: Optional[str] = None) -> Dict[str, Any]:
+    return {"transactions": load_table(engine, logger, "transactions", mode, since)}
+
+
+def transform_transactionitems(engine: sqlalchemy.Engine, logger: logging.Logger,
+                               mode: str = "full", since: Optional[str] = None) -> Dict[str, Any]:
+    return {"transactionitems": load_table(engine, logger, "transactionitems", mode, since)}
+
+TRANSFORMS = {
+    "customers": transform_customers,
+    "products": transform_products,
+    "transactions": transform_transactions,
+    "transactionitems": transform_transactionitems,
+}
+
+# Every production table reads only its own staging table, so no transform
+# waits on another. Add edges here if one ever reads from production.
+TRANSFORM_DEPENDENCIES: Dict[str, list] = {
+    "customers": [],
+    "products": [],
+    "transactions": [],
+    "transactionitems": [],
+}
+
+def get_load_modes(config: dict) -> Dict[str, str]:
+    """Per-table load mode from config (etl.load_modes), defaulting to full."""
+    modes = (config.get("etl") or {}).get("load_modes") or {}
+    return {table: modes.get(table, "full") for table in TRANSFORMS}
 
 def main():
     logger = setup_logging()
     config = load_config()
     engine = get_engine(config)
+    modes = get_load_modes(config)
+    state = load_state()
+    max_concurrency = get_max_concurrency(config)
     
     start_time = pd.Timestamp.now()
     results = {}
+
+    def make_task(table):
+        since = state.get(table, {}).get("high_water_mark")
+        return lambda: TRANSFORMS[table](engine, logger, modes[table], since)[table]
+
+    def record_success(table, result):
+        # Each table commits on its own, so advance its mark right away
+        results[table] = result
+        state[table] = {
+            "high_water_mark": result["high_water_mark"],
+            "last_success": pd.Timestamp.now().isoformat(),
+            "mode": modes[table],
+        }
+        save_state(state)
     
     try:
-        results.update(transform_customers(engine, logger))
-        results.update(transform_products(engine, logger))
-        results.update(transform_transactions(engine, logger))
-        results.update(transform_transactionitems(engine, logger))
+        _, timeline = run_task_graph(
+            {table: make_task(table) for table in TRANSFORMS},
+            TRANSFORM_DEPENDENCIES,
+            max_workers=max_concurrency,
+            on_complete=record_success,
+        )
         
         end_time = pd.Timestamp.now()
         report = {
             "timestamp": end_time.isoformat(),
             "execution_time_seconds": (end_time - start_time).total_seconds(),
-            "tables_loaded": results,
+            "tables_loaded": {t: r["rows"] for t, r in results.items()},
+            "load_stats": {
+                t: {k: r[k] for k in ("mode", "inserted", "updated", "unchanged")}
+                for t, r in results.items()
+            },
+            "max_concurrency": max_concurrency,
+            "timeline": timeline,
             "status": "success"
         }
     except Exception as e:
@@ -0,0 +1,289 @@
+import os
+import json
+import shutil
+import argparse
+import yaml
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, text
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONFIG_PATH = os.path.join("config", "config.yaml")
+SCHEMA = "warehouse"
+
+# Fact tables are split into year=YYYY/month=MM directories by their dimdate
+# month and sorted by (datekey, key) so row-group min/max stats stay tight.
+# Dimensions and aggregates are small and written as one file each.
+FACT_TABLES = {"factorders": "orderkey", "factorderitems": "itemkey"}
+DIMENSION_TABLES = {
+    "dimcustomers": "customerkey",
+    "dimorders": "orderkey",
+    "dimdate": "datekey",
+    "dimproducts": "productkey",
+}
+# Exported too, so the snapshot can answer the analytics the way Postgres does.
+AGGREGATE_TABLES = {
+    "agg_daily_sales": "datekey",
+    "agg_customer_metrics": "customerkey",
+    "agg_product_performance": "productid",
+}
+# Lets the snapshot skip aggregates that lag the facts, as routing does in Postgres.
+STATE_TABLES = {"load_watermarks": "name"}
+MANIFEST_NAME = "_manifest.json"
+
+
+def load_config():
+    with open(CONFIG_PATH, "r") as f:
+        return yaml.safe_load(f)
+
+
+def get_engine(config):
+    db = config["database"]
+    url = f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['name']}"
+    return create_engine(url)
+
+
+def get_export_settings(config: dict) -> dict:
+    settings = config.get("parquet_export") or {}
+    return {
+        "output_dir": settings.get("output_dir", os.path.join("data", "warehouse", "parquet")),
+        "row_group_rows": int(settings.get("row_group_rows", 100000)),
+        "compression": settings.get("compression", "snappy"),
+    }
+
+
+def arrow_type(data_type: str, precision: Optional[int], scale: Optional[int]) -> pa.DataType:
+    """Arrow type for a Postgres format_type() name (as in information_schema.columns)."""
+    if data_type == "integer":
+        return pa.int32()
+    if data_type == "smallint":
+        return pa.int16()
+    if data_type == "bigint":
+        return pa.int64()
+    if data_type == "numeric":
+        # unconstrained numeric has no fixed scale to map to a decimal
+        return pa.decimal128(precision, scale) if precision else pa.float64()
+    if data_type in ("real", "double precision"):
+        return pa.float64()
+    if data_type == "boolean":
+        return pa.bool_()
+    if data_type == "date":
+        return pa.date32()
+    if data_type.startswith("timestamp"):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def table_schema(connection, table: str, schema: str = SCHEMA) -> pa.Schema:
+    # pg_attribute rather than information_schema.columns, which leaves out
+    # materialized views (warehouse.aggregate_mode: materialized_views)
+    rows = connection.execute(
+        text(
+            """
+        SELECT
+            a.attname,
+            format_type(a.atttypid, NULL),
+            CASE WHEN a.atttypid = 'numeric'::regtype AND a.atttypmod >= 0
+                 THEN ((a.atttypmod - 4) >> 16) & 65535 END,
+            CASE WHEN a.atttypid = 'numeric'::regtype AND a.atttypmod >= 0
+                 THEN (a.atttypmod - 4) & 65535 END
+        FROM pg_attribute a
+        WHERE a.attrelid = to_regclass(:relation) AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+    """
+        ),
+        {"relation": f"{schema}.{table}"},
+    ).all()
+    return pa.schema([pa.field(name, arrow_type(t, p, s)) for name, t, p, s in rows])
+
+
+def partition_fingerprints(connection, table: str, schema: str = SCHEMA) -> Dict[str, Dict[str, Any]]:
+    """Row count and content hash per year/month of a fact table, in one scan.
+
+    The datekey range of each month is kept so the export of a single
+    month can be pruned to its factorders partition.
+    """
+    rows = connection.execute(
+        text(
+            f"""
+        SELECT
+            d.year,
+            d.month,
+            MIN(f.datekey) AS lo,
+            MAX(f.datekey) AS hi,
+            COUNT(*) AS row_count,
+            SUM(hashtextextended(f::text, 0))::text AS fingerprint
+        FROM {schema}.{table} f
+        JOIN {schema}.dimdate d ON d.datekey = f.datekey
+        GROUP BY d.year, d.month
+    """
+        )
+    ).mappings()
+    return {
+        f"year={r['year']:04d}/month={r['month']:02d}": {
+            "lo": r["lo"],
+            "hi": r["hi"],
+            "rows": r["row_count"],
+            "fingerprint": r["fingerprint"],
+        }
+        for r in rows
+    }
+
+
+def table_fingerprint(connection, table: str, schema: str = SCHEMA) -> Dict[str, Dict[str, Any]]:
+    row = connection.execute(
+        text(
+            f"""
+        SELECT COUNT(*) AS row_count, COALESCE(SUM(hashtextextended(t::text, 0)), 0)::text AS fingerprint
+        FROM {schema}.{table} t
+    """
+        )
+    ).mappings().one()
+    return {"": {"rows": row["row_count"], "fingerprint": row["fingerprint"]}}
+
+
+def plan_exports(
+    current: Dict[str, Dict[str, Any]], exported: Dict[str, Dict[str, Any]]
+) -> Tuple[List[str], List[str], List[str]]:
+    """(partitions to write, unchanged partitions, partitions to delete)."""
+    changed = [
+        p for p in sorted(current)
+        if p not in exported or exported[p]["fingerprint"] != current[p]["fingerprint"]
+    ]
+    unchanged = [p for p in sorted(current) if p not in changed]
+    removed = sorted(set(exported) - set(current))
+    return changed, unchanged, removed
+
+
+def write_parquet(
+    batches: Iterable[Sequence[Sequence[Any]]], arrow_schema: pa.Schema, path: str, compression: str = "snappy"
+) -> int:
+    """Write row batches to `path`, one row group per batch, with column statistics.
+
+    The file is written under a temporary name and renamed, so readers
+    never see a half-written partition. Returns the number of rows.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.part"
+    rows = 0
+    try:
+        with pq.ParquetWriter(tmp_path, arrow_schema, compression=compression, write_statistics=True) as writer:
+            for batch in batches:
+                columns = list(zip(*batch)) if batch else [[] for _ in arrow_schema]
+                writer.write_batch(
+                    pa.RecordBatch.from_arrays(
+                        [pa.array(col, type=field.type) for col, field in zip(columns, arrow_schema)],
+                        schema=arrow_schema,
+                    )
+                )
+                rows += len(batch)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return rows
+
+
+def stream_rows(connection, sql: str, params: dict, batch_rows: int):
+    result = connection.execute(text(sql).execution_options(stream_results=True), params)
+    for partition in result.partitions(batch_rows):
+        yield partition
+
+
+def export_table(
+    connection, table: str, key: str, settings: dict, manifest: Dict[str, Any], schema: str = SCHEMA
+) -> Dict[str, Any]:
+    """Export the changed partitions of `table` and update its manifest entry."""
+    is_fact = table in FACT_TABLES
+    current = (
+        partition_fingerprints(connection, table, schema) if is_fact else table_fingerprint(connection, table, schema)
+    )
+    exported = manifest.setdefault(table, {})
+    changed, unchanged, removed = plan_exports(current, exported)
+
+    table_dir = os.path.join(settings["output_dir"], table)
+    for partition in removed:
+        shutil.rmtree(os.path.join(table_dir, partition), ignore_errors=True)
+        del exported[partition]
+
+    arrow_schema = table_schema(connection, table, schema) if changed else None
+    rows = 0
+    for partition in changed:
+        info = current[partition]
+        if is_fact:
+            sql = (
+                f"SELECT * FROM {schema}.{table} WHERE datekey BETWEEN :lo AND :hi "
+                f"ORDER BY datekey, {key}"
+            )
+            params = {"lo": info["lo"], "hi": info["hi"]}
+        else:
+            sql, params = f"SELECT * FROM {schema}.{table} ORDER BY {key}", {}
+        path = os.path.join(table_dir, partition, "part-0.parquet")
+        rows += write_parquet(
+            stream_rows(connection, sql, params, settings["row_group_rows"]),
+            arrow_schema,
+            path,
+            settings["compression"],
+        )
+        exported[partition] = {
+            "rows": info["rows"],
+            "fingerprint": info["fingerprint"],
+            "exported_at": datetime.now().isoformat(),
+        }
+    return {
+        "partitions_written": len(changed),
+        "partitions_unchanged": len(unchanged),
+        "partitions_removed": len(removed),
+        "rows_written": rows,
+    }
+
+
+def load_manifest(output_dir: str) -> Dict[str, Any]:
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir: str, manifest: Dict[str, Any]) -> None:
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(f"{path}.part", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.part", path)
+
+
+def main(full: bool = False):
+    config = load_config()
+    settings = get_export_settings(config)
+    engine = get_engine(config)
+    manifest = load_manifest(settings["output_dir"])
+    if full:
+        for table in manifest:
+            shutil.rmtree(os.path.join(settings["output_dir"], table), ignore_errors=True)
+        manifest = {}
+
+    results = {}
+    # one snapshot for every table, so facts and dimensions match
+    with engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        with conn.begin():
+            for table, key in {**DIMENSION_TABLES, **AGGREGATE_TABLES, **STATE_TABLES, **FACT_TABLES}.items():
+                results[table] = export_table(conn, table, key, settings, manifest)
+                save_manifest(settings["output_dir"], manifest)
+                r = results[table]
+                print(
+                    f"{table}: {r['partitions_written']} written, {r['partitions_unchanged']} unchanged, "
+                    f"{r['partitions_removed']} removed ({r['rows_written']} rows)"
+                )
+    print(f"Parquet snapshot: {settings['output_dir']}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the warehouse star schema to Parquet")
+    parser.add_argument("--full", action="store_true", help="re-export every partition")
+    args = parser.parse_args()
+    main(full=args.full)
@@ -1,43 +1,71 @@
 import os
+import sys
+import csv
 import time
 import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import pandas as pd
+from psycopg2 import errors as pg_errors
 from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
 import yaml
 
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from scripts.transformation.aggregate_routing import current_aggregates, route_queries
+from scripts.transformation.columnar_engine import SnapshotEngine, compare_frames
+from scripts.transformation.export_warehouse_parquet import get_export_settings
+from scripts.transformation.query_plans import compare_to_baseline, summarize_plan
+
 CONFIG_PATH = os.path.join("config", "config.yaml")
 OUTPUT_DIR = os.path.join("data", "processed", "analytics")
+CACHE_PATH = os.path.join(OUTPUT_DIR, "query_cache.json")
+# --explain runs write one plans/<timestamp>.json each; baseline.json holds
+# the plan summaries regressions are measured against.
+PLANS_DIR = os.path.join(OUTPUT_DIR, "plans")
+PLAN_BASELINE_PATH = os.path.join(PLANS_DIR, "baseline.json")
 
+# Plain SQL runs as written. Dict entries are logical queries: `sql` reads
+# a `base` CTE with the listed dimensions and measures, which
+# aggregate_routing builds from the smallest aggregate table that covers
+# them (falling back to factorders).
 QUERIES = {
     "query1_top_products": """
 SELECT 
-    f.orderkey::text AS product_name,
-    'Generic Product' AS category,
-    ROUND(SUM(f.totalamount)::numeric, 2) AS total_revenue,
-    SUM(f.quantity) AS units_sold,
-    ROUND(AVG(f.totalamount / NULLIF(f.quantity, 0))::numeric, 2) AS avg_price
-FROM warehouse.factorders f
-GROUP BY f.orderkey
-ORDER BY total_revenue DESC LIMIT 10;
+    a.productname AS product_name,
+    a.category,
+    ROUND(a.total_revenue::numeric, 2) AS total_revenue,
+    a.total_quantity_sold AS units_sold,
+    ROUND((a.total_revenue / NULLIF(a.total_quantity_sold, 0))::numeric, 2) AS avg_price
+FROM warehouse.agg_product_performance a
+ORDER BY a.total_revenue DESC LIMIT 10;
     """,
     
-    "query2_monthly_trend": """
+    "query2_monthly_trend": {
+        "dimensions": [],
+        "measures": ["revenue", "orders", "priced_orders"],
+        "sql": """
 SELECT 
     CONCAT(EXTRACT(YEAR FROM CURRENT_DATE)::text, '-', LPAD(EXTRACT(MONTH FROM CURRENT_DATE)::text, 2, '0')) AS year_month,
-    ROUND(SUM(f.totalamount)::numeric, 2) AS total_revenue,
-    COUNT(*) AS total_transactions,
-    ROUND(AVG(f.totalamount)::numeric, 2) AS average_order_value,
-    COUNT(DISTINCT f.orderkey) AS unique_customers
-FROM warehouse.factorders f;
+    ROUND(b.revenue::numeric, 2) AS total_revenue,
+    b.orders AS total_transactions,
+    ROUND((b.revenue / NULLIF(b.priced_orders, 0))::numeric, 2) AS average_order_value,
+    b.orders AS unique_customers
+FROM base b;
     """,
+    },
     
-    "query3_customer_segmentation": """
+    "query3_customer_segmentation": {
+        "dimensions": ["customerkey"],
+        "measures": ["revenue"],
+        "sql": """
 WITH customer_totals AS (
-    SELECT 
-        f.customerkey,
-        SUM(f.totalamount) AS total_spent
-    FROM warehouse.factorders f
-    GROUP BY f.customerkey
+    SELECT b.customerkey, b.revenue AS total_spent FROM base b
 )
 SELECT 
     CASE 
@@ -53,80 +81,92 @@ FROM customer_totals
 GROUP BY 1
 ORDER BY total_revenue DESC;
     """,
+    },
     
-    "query4_category_performance": """
+    "query4_category_performance": {
+        "dimensions": [],
+        "measures": ["revenue", "quantity"],
+        "sql": """
 SELECT 
     'All Categories' AS category,
-    ROUND(SUM(f.totalamount)::numeric, 2) AS total_revenue,
-    ROUND(SUM(f.totalamount * 0.15)::numeric, 2) AS total_profit,
+    ROUND(b.revenue::numeric, 2) AS total_revenue,
+    ROUND((b.revenue * 0.15)::numeric, 2) AS total_profit,
     ROUND(15.0, 2) AS profit_margin_pct,
-    SUM(f.quantity) AS units_sold
-FROM warehouse.factorders f;
+    b.quantity AS units_sold
+FROM base b;
     """,
+    },
     
-    "query5_payment_distribution": """
+    "query5_payment_distribution": {
+        "dimensions": [],
+        "measures": ["orders", "revenue"],
+        "sql": """
 SELECT 
     'Credit Card' AS payment_method,
-    COUNT(*) AS transaction_count,
-    ROUND(SUM(f.totalamount)::numeric, 2) AS total_revenue,
+    b.orders AS transaction_count,
+    ROUND(b.revenue::numeric, 2) AS total_revenue,
     100.0 AS pct_of_transactions,
     100.0 AS pct_of_revenue
-FROM warehouse.factorders f;
+FROM base b;
     """,
+    },
     
-    "query6_geographic_analysis": """
+    "query6_geographic_analysis": {
+        "dimensions": [],
+        "measures": ["revenue", "customers"],
+        "sql": """
 SELECT 
     'Haryana' AS state,
-    ROUND(SUM(f.totalamount)::numeric, 2) AS total_revenue,
-    COUNT(DISTINCT f.customerkey) AS total_customers,
-    ROUND(SUM(f.totalamount)::numeric / NULLIF(COUNT(DISTINCT f.customerkey), 0), 2) AS avg_revenue_per_customer
-FROM warehouse.factorders f;
+    ROUND(b.revenue::numeric, 2) AS total_revenue,
+    b.customers AS total_customers,
+    ROUND(b.revenue::numeric / NULLIF(b.customers, 0), 2) AS avg_revenue_per_customer
+FROM base b;
     """,
+    },
     
-    "query7_customer_lifetime_value": """
+    "query7_customer_lifetime_value": {
+        "dimensions": ["customerkey"],
+        "measures": ["revenue", "orders"],
+        "sql": """
 SELECT 
-    f.customerkey AS customer_id,
-    CONCAT('Customer_', f.customerkey) AS full_name,
-    ROUND(SUM(f.totalamount)::numeric, 2) AS total_spent,
-    COUNT(*) AS transaction_count,
+    b.customerkey AS customer_id,
+    CONCAT('Customer_', b.customerkey) AS full_name,
+    ROUND(b.revenue::numeric, 2) AS total_spent,
+    b.orders AS transaction_count,
     365 AS days_since_registration,
-    ROUND(AVG(f.totalamount)::numeric, 2) AS avg_order_value
-FROM warehouse.factorders f
-GROUP BY f.customerkey
+    ROUND((b.revenue / NULLIF(b.orders, 0))::numeric, 2) AS avg_order_value
+FROM base b
 ORDER BY total_spent DESC LIMIT 10;
     """,
+    },
     
     "query8_product_profitability": """
 SELECT 
-    f.orderkey::text AS product_name,
-    'Generic Product' AS category,
-    ROUND((SUM(f.totalamount) * 0.15)::numeric, 2) AS total_profit,
-    15.0 AS profit_margin,
-    ROUND(SUM(f.totalamount)::numeric, 2) AS revenue,
-    SUM(f.quantity) AS units_sold
-FROM warehouse.factorders f
-GROUP BY f.orderkey
-ORDER BY total_profit DESC LIMIT 10;
+    a.productname AS product_name,
+    a.category,
+    ROUND(a.total_profit::numeric, 2) AS total_profit,
+    ROUND((a.total_profit * 100 / NULLIF(a.total_revenue, 0))::numeric, 2) AS profit_margin,
+    ROUND(a.total_revenue::numeric, 2) AS revenue,
+    a.total_quantity_sold AS units_sold
+FROM warehouse.agg_product_performance a
+ORDER BY a.total_profit DESC LIMIT 10;
     """,
     
-    "query9_day_of_week_pattern": """
+    # averages are over the days with sales, per weekday
+    "query9_day_of_week_pattern": {
+        "dimensions": ["datekey", "weekday", "weekdayname"],
+        "measures": ["revenue", "orders"],
+        "sql": """
 SELECT 
-    CASE (RANDOM() * 7)::int 
-        WHEN 0 THEN 'Monday'
-        WHEN 1 THEN 'Tuesday'
-        WHEN 2 THEN 'Wednesday'
-        WHEN 3 THEN 'Thursday'
-        WHEN 4 THEN 'Friday'
-        WHEN 5 THEN 'Saturday'
-        ELSE 'Sunday'
-    END AS day_name,
-    ROUND(AVG(f.totalamount)::numeric, 2) AS avg_daily_revenue,
-    AVG(f.quantity)::numeric AS avg_daily_transactions,
-    ROUND(SUM(f.totalamount)::numeric, 2) AS total_revenue
-FROM warehouse.factorders f
-GROUP BY 1
+    TRIM(b.weekdayname) AS day_name,
+    ROUND(AVG(b.revenue)::numeric, 2) AS avg_daily_revenue,
+    ROUND(AVG(b.orders)::numeric, 2) AS avg_daily_transactions,
+    ROUND(SUM(b.revenue)::numeric, 2) AS total_revenue
+FROM base b
+GROUP BY b.weekday, b.weekdayname
 ORDER BY avg_daily_revenue DESC;
     """,
+    },
     
   "query10_discount_impact": """
 SELECT 
@@ -146,14 +186,175 @@ ORDER BY avg_volume_pct;
     """,
 }
 
+# query name -> DataFrame transform applied before export. Only these
+# queries are read into pandas; everything else is streamed with COPY.
+POSTPROCESSORS: Dict[str, Callable[[pd.DataFrame], pd.DataFrame]] = {}
+
 def load_config():
     with open(CONFIG_PATH, "r") as f:
         return yaml.safe_load(f)
 
-def get_engine(config):
+def get_engine(config, pool_size=5):
     db = config["database"]
     url = f"postgresql+psycopg2://{db['user']}:{db['password']}@{db['host']}:{db['port']}/{db['name']}"
-    return create_engine(url)
+    return create_engine(url, pool_size=pool_size, max_overflow=0)
+
+def get_analytics_settings(config: dict) -> dict:
+    settings = config.get("analytics") or {}
+    return {
+        "max_concurrency": max(1, int(settings.get("max_concurrency", 4))),
+        "query_timeout_seconds": settings.get("query_timeout_seconds", 60),
+        "cache_enabled": settings.get("cache_enabled", True),
+        "cache_max_age_hours": settings.get("cache_max_age_hours", 24),
+        "cache_max_size_mb": settings.get("cache_max_size_mb", 100),
+        "engine": settings.get("engine", "postgres"),
+        "explain": settings.get("explain", False),
+        "plan_regression_factor": float(settings.get("plan_regression_factor", 2.0)),
+    }
+
+def sql_hash(sql: str) -> str:
+    """Hash of the query text, insensitive to whitespace/indentation changes."""
+    return hashlib.sha256(" ".join(sql.split()).encode("utf-8")).hexdigest()
+
+def get_load_epoch(engine) -> Optional[int]:
+    """Warehouse version stamped by load_warehouse; None if it was never recorded."""
+    try:
+        with engine.connect() as conn:
+            value = conn.execute(
+                text("SELECT value FROM warehouse.load_watermarks WHERE name = 'load_epoch'")
+            ).scalar()
+    except DBAPIError:
+        return None
+    return None if value is None else int(value)
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class AnalyticsResultCache:
+    """Index of the CSVs in OUTPUT_DIR, keyed by SQL hash, engine and warehouse load epoch.
+
+    A hit means the CSV on disk is byte-for-byte the one the same SQL
+    produced on the same engine against the same warehouse version, so it
+    is reused as-is; a CSV rewritten since (e.g. by a duckdb run) misses.
+    Entries older than `max_age_hours` are evicted, and the least recently
+    used ones go once their CSVs on disk exceed `max_size_mb`. Evicting an
+    entry deletes its CSV.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, enabled: bool = True, force: bool = False,
+                 max_age_hours: float = 24, max_size_mb: float = 100):
+        self.path = path
+        self.enabled = enabled
+        self.force = force
+        self.max_age_seconds = max_age_hours * 3600
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.entries: Dict[str, Any] = {}
+        self.hits: List[str] = []
+        self.misses: List[str] = []
+        self.evicted: List[str] = []
+        if enabled and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def lookup(self, query_name: str, sql: str, load_epoch: Optional[int],
+               engine: str = "postgres") -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(query_name)
+        usable = (
+            self.enabled
+            and not self.force
+            and load_epoch is not None
+            and entry is not None
+            and entry["sql_hash"] == sql_hash(sql)
+            and entry["load_epoch"] == load_epoch
+            and entry.get("engine") == engine
+            and self._csv_intact(entry)
+        )
+        if not usable:
+            self.misses.append(query_name)
+            return None
+        self.hits.append(query_name)
+        entry["hits"] = entry.get("hits", 0) + 1
+        entry["last_used_at"] = time.time()
+        return dict(entry["result"], execution_time_ms=0.0, cache="hit", cache_hits=entry["hits"])
+
+    def store(self, query_name: str, sql: str, load_epoch: Optional[int], result: Dict[str, Any],
+              engine: str = "postgres") -> None:
+        if not self.enabled or load_epoch is None or result.get("status") != "success":
+            return
+        path = os.path.join(OUTPUT_DIR, result["csv_file"])
+        now = time.time()
+        self.entries[query_name] = {
+            "sql_hash": sql_hash(sql),
+            "load_epoch": load_epoch,
+            "engine": engine,
+            "csv_bytes": os.path.getsize(path),
+            "csv_sha256": file_sha256(path),
+            "created_at": now,
+            "last_used_at": now,
+            "hits": 0,
+            # plan details describe that run only, not later cache hits
+            "result": {k: v for k, v in result.items() if not k.startswith("plan")},
+        }
+
+    def evict(self) -> List[str]:
+        now = time.time()
+        for name in [n for n, e in self.entries.items() if now - e["created_at"] > self.max_age_seconds]:
+            self._drop(name)
+        by_lru = sorted(self.entries, key=lambda n: self.entries[n]["last_used_at"])
+        sizes = {name: self._csv_size(self.entries[name]) for name in by_lru}
+        total = sum(sizes.values())
+        while by_lru and total > self.max_size_bytes:
+            name = by_lru.pop(0)
+            total -= sizes[name]
+            self._drop(name)
+        return self.evicted
+
+    def save(self) -> None:
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=2, default=str)
+
+    def summary(self, load_epoch: Optional[int]) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled and load_epoch is not None,
+            "forced_refresh": self.force,
+            "load_epoch": load_epoch,
+            "hits": len(self.hits),
+            "misses": len(self.misses),
+            "evicted": list(self.evicted),
+        }
+
+    @staticmethod
+    def _csv_path(entry: Dict[str, Any]) -> str:
+        return os.path.join(OUTPUT_DIR, entry["result"]["csv_file"])
+
+    def _csv_size(self, entry: Dict[str, Any]) -> int:
+        path = self._csv_path(entry)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _csv_intact(self, entry: Dict[str, Any]) -> bool:
+        path = self._csv_path(entry)
+        return (
+            os.path.exists(path)
+            and os.path.getsize(path) == entry["csv_bytes"]
+            and file_sha256(path) == entry.get("csv_sha256")
+        )
+
+    def _drop(self, name: str) -> None:
+        entry = self.entries.pop(name)
+        path = self._csv_path(entry)
+        if os.path.exists(path):
+            os.remove(path)
+        self.evicted.append(name)
 
 def execute_query(connection, query_name: str, sql: str) -> tuple[pd.DataFrame, float]:
     start = time.time()
@@ -161,6 +362,43 @@ def execute_query(connection, query_name: str, sql: str) -> tuple[pd.DataFrame,
     elapsed_ms = (time.time() - start) * 1000
     return df, elapsed_ms
 
+def copy_query_to_csv(connection, sql: str, filename: str) -> tuple[int, int, float]:
+    """Stream `COPY (sql) TO STDOUT WITH CSV HEADER` straight into OUTPUT_DIR/filename.
+
+    Nothing is materialized in Python; the row count comes from the COPY
+    command status. The file is written under a temporary name and renamed,
+    so a failed or cancelled COPY never leaves a truncated CSV behind.
+    Returns (rows, columns, elapsed_ms).
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(OUTPUT_DIR, filename)
+    tmp_path = f"{path}.part"
+    start = time.time()
+    cursor = connection.connection.cursor()
+    try:
+        with open(tmp_path, "w", newline="") as f:
+            cursor.copy_expert(f"COPY ({sql.strip().rstrip(';')}) TO STDOUT WITH CSV HEADER", f)
+        rows = cursor.rowcount
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        cursor.close()
+    elapsed_ms = (time.time() - start) * 1000
+    os.replace(tmp_path, path)
+    with open(path, newline="") as f:
+        columns = len(next(csv.reader(f), []))
+    print(f"Exported: {path} ({rows} rows, {columns} cols, streamed)")
+    return rows, columns, elapsed_ms
+
+def explain_query(connection, sql: str) -> Any:
+    """EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output for `sql` (executes it once more)."""
+    plan = connection.execute(
+        text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql.strip().rstrip(';')}")
+    ).scalar_one()
+    return json.loads(plan) if isinstance(plan, str) else plan
+
 def export_to_csv(df: pd.DataFrame, filename: str) -> str:
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     path = os.path.join(OUTPUT_DIR, filename)
@@ -168,48 +406,334 @@ def export_to_csv(df: pd.DataFrame, filename: str) -> str:
     print(f"Exported: {path} ({len(df)} rows, {len(df.columns)} cols)")
     return path
 
-def generate_summary(results: dict) -> dict:
-    total_time = sum(r["execution_time_ms"] for r in results.values())
+def run_query_task(engine, query_name: str, sql: str, timeout_seconds: Optional[float],
+                   running: Dict[str, Any], explain: bool = False) -> Dict[str, Any]:
+    """Run one query on its own pooled connection and write its CSV.
+
+    Queries with a POSTPROCESSORS entry go through pandas; all others are
+    streamed to disk with COPY. statement_timeout makes the server cancel
+    an overrunning query; the raw DBAPI connection is published in
+    `running` so main() can cancel it too. With `explain`, the query is
+    run a second time under EXPLAIN ANALYZE and the raw plan is returned
+    under "plan".
+    """
+    print(f"Running {query_name}...")
+    csv_file = f"{query_name}.csv"
+    postprocess = POSTPROCESSORS.get(query_name)
+    with engine.connect() as conn:
+        running[query_name] = conn.connection.dbapi_connection
+        try:
+            with conn.begin():
+                if timeout_seconds:
+                    conn.execute(
+                        text("SELECT set_config('statement_timeout', :ms, true)"),
+                        {"ms": str(int(timeout_seconds * 1000))},
+                    )
+                if postprocess:
+                    df, exec_time = execute_query(conn, query_name, sql)
+                else:
+                    rows, columns, exec_time = copy_query_to_csv(conn, sql, csv_file)
+                plan = explain_query(conn, sql) if explain else None
+        finally:
+            running.pop(query_name, None)
+    if postprocess:
+        # CSV writing overlaps with the queries still running on other workers
+        df = postprocess(df)
+        export_to_csv(df, csv_file)
+        rows, columns = len(df), len(df.columns)
+    result = {
+        "status": "success",
+        "export": "pandas" if postprocess else "copy",
+        "rows": int(rows),
+        "columns": int(columns),
+        "execution_time_ms": round(exec_time, 2),
+        "csv_file": csv_file,
+    }
+    if plan is not None:
+        result["plan"] = plan
+    return result
+
+def run_queries(engine, queries: Dict[str, str], max_workers: int = 4,
+                timeout_seconds: Optional[float] = None,
+                explain: bool = False) -> Tuple[Dict[str, Any], float]:
+    """Run `queries` concurrently; returns (results in `queries` order, wall seconds).
+
+    A failing or timed-out query is recorded and does not stop the others.
+    On interrupt, queued queries are dropped and running ones are cancelled
+    server-side.
+    """
+    results: Dict[str, Any] = {}
+    running: Dict[str, Any] = {}
+    start = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {
+        pool.submit(run_query_task, engine, name, sql, timeout_seconds, running, explain): name
+        for name, sql in queries.items()
+    }
+    try:
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except (DBAPIError, pg_errors.Error) as e:
+                # COPY runs on the raw cursor, so its errors are not wrapped
+                orig = getattr(e, "orig", e)
+                results[name] = {
+                    "status": "timeout" if isinstance(orig, pg_errors.QueryCanceled) else "failed",
+                    "error": str(orig).strip(),
+                }
+            except Exception as e:
+                results[name] = {"status": "failed", "error": str(e)}
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        for dbapi_connection in list(running.values()):
+            dbapi_connection.cancel()
+        raise
+    finally:
+        pool.shutdown(wait=True)
+    wall_seconds = time.perf_counter() - start
+    return {name: results[name] for name in queries if name in results}, wall_seconds
+
+def record_plans(results: Dict[str, Any], factor: float = 2.0,
+                 update_baseline: bool = False) -> Dict[str, Any]:
+    """Move raw plans out of `results` into PLANS_DIR and flag regressions.
+
+    Each result keeps a condensed "plan" summary plus "plan_regressions"
+    against PLAN_BASELINE_PATH. Queries without a baseline entry (or all of
+    them with `update_baseline`) have this run's summary recorded as the
+    new baseline. Returns {"plans_file", "regressions"} for the summary.
+    """
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(PLAN_BASELINE_PATH):
+        with open(PLAN_BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    raw_plans, regressions = {}, {}
+    for name, result in results.items():
+        plan = result.pop("plan", None)
+        if plan is None:
+            continue
+        raw_plans[name] = plan
+        current = summarize_plan(plan)
+        flags = []
+        if name in baseline and not update_baseline:
+            flags = compare_to_baseline(current, baseline[name], factor, factor)
+        else:
+            baseline[name] = current
+        result["plan"] = current
+        result["plan_regressions"] = flags
+        if flags:
+            regressions[name] = flags
+            print(f"PLAN REGRESSION {name}: {'; '.join(flags)}")
+
+    os.makedirs(PLANS_DIR, exist_ok=True)
+    plans_path = os.path.join(PLANS_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(plans_path, "w") as f:
+        json.dump(raw_plans, f, indent=2)
+    with open(PLAN_BASELINE_PATH, "w") as f:
+        json.dump(baseline, f, indent=2)
+    return {"plans_file": plans_path, "regressions": regressions}
+
+def run_snapshot_queries(snapshot: SnapshotEngine, queries: Dict[str, str]) -> Tuple[Dict[str, Any], float]:
+    """Run `queries` on the DuckDB snapshot and write their CSVs.
+
+    Queries run one at a time: DuckDB already spreads each one over its
+    own threads. Failures are recorded like run_queries() does.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    results: Dict[str, Any] = {}
+    start = time.perf_counter()
+    for name, sql in queries.items():
+        print(f"Running {name} (duckdb)...")
+        csv_file = f"{name}.csv"
+        postprocess = POSTPROCESSORS.get(name)
+        try:
+            if postprocess:
+                df, exec_time = snapshot.query(sql)
+                df = postprocess(df)
+                export_to_csv(df, csv_file)
+                rows, columns = len(df), len(df.columns)
+            else:
+                rows, columns, exec_time = snapshot.copy_to_csv(sql, os.path.join(OUTPUT_DIR, csv_file))
+                print(f"Exported: {os.path.join(OUTPUT_DIR, csv_file)} ({rows} rows, {columns} cols, duckdb)")
+        except Exception as e:
+            results[name] = {"status": "failed", "error": str(e)}
+            continue
+        results[name] = {
+            "status": "success",
+            "export": "duckdb",
+            "rows": int(rows),
+            "columns": int(columns),
+            "execution_time_ms": round(exec_time, 2),
+            "csv_file": csv_file,
+        }
+    return results, time.perf_counter() - start
+
+def compare_engines(engine, snapshot: SnapshotEngine, postgres_queries: Dict[str, str],
+                    snapshot_queries: Dict[str, str]) -> Dict[str, Any]:
+    """Run each query on Postgres and on the snapshot, check they agree and time both.
+
+    Each engine runs the SQL routed for it. The results only agree when
+    the snapshot was exported after the last warehouse load.
+    """
+    comparison: Dict[str, Any] = {}
+    with engine.connect() as conn:
+        for name, sql in postgres_queries.items():
+            try:
+                expected, postgres_ms = execute_query(conn, name, sql)
+                actual, duckdb_ms = snapshot.query(snapshot_queries[name])
+            except Exception as e:
+                conn.rollback()
+                comparison[name] = {"match": False, "error": str(e)}
+                continue
+            mismatch = compare_frames(expected, actual)
+            comparison[name] = {
+                "match": mismatch is None,
+                "postgres_ms": round(postgres_ms, 2),
+                "duckdb_ms": round(duckdb_ms, 2),
+                "speedup_x": round(postgres_ms / duckdb_ms, 2) if duckdb_ms else None,
+            }
+            if mismatch:
+                comparison[name]["mismatch"] = mismatch
+                print(f"ENGINE MISMATCH {name}: {mismatch}")
+    return comparison
+
+def generate_summary(results: dict, wall_seconds: float = 0.0, max_concurrency: int = 1,
+                     cache: Optional[dict] = None, plans: Optional[dict] = None,
+                     engine: str = "postgres") -> dict:
+    total_time = sum(r.get("execution_time_ms", 0) for r in results.values())
     return {
         "generation_timestamp": pd.Timestamp.now().isoformat(),
-        "queries_executed": len(results),
+        "engine": engine,
+        "cache": cache or {"enabled": False},
+        "plans": plans or {"captured": False},
+        "queries_executed": sum(1 for r in results.values() if r.get("status") == "success"),
+        "queries_failed": sum(1 for r in results.values() if r.get("status") != "success"),
+        "max_concurrency": max_concurrency,
+        # sum of per-query latencies vs. elapsed time for the whole batch
         "total_execution_time_seconds": round(total_time / 1000, 2),
+        "wall_clock_seconds": round(wall_seconds, 2),
         "query_results": results
     }
 
-def main():
+def main(max_concurrency: Optional[int] = None, query_timeout: Optional[float] = None,
+         refresh: bool = False, explain: Optional[bool] = None, update_baseline: bool = False,
+         engine_name: Optional[str] = None, compare: bool = False):
     print("Generating Analytics Queries (FACTORDERS ONLY)...")
     config = load_config()
-    engine = get_engine(config)
-    summary = {"query_results": {}, "queries_executed": 0}
+    settings = get_analytics_settings(config)
+    workers = max_concurrency or settings["max_concurrency"]
+    timeout_seconds = query_timeout if query_timeout is not None else settings["query_timeout_seconds"]
+    engine_name = engine_name or settings["engine"]
+    if engine_name not in ("postgres", "duckdb"):
+        raise ValueError(f"Unknown analytics engine: {engine_name}")
+    on_snapshot = engine_name == "duckdb"
+    # plans are Postgres EXPLAIN output
+    explain = (settings["explain"] if explain is None else explain) and not on_snapshot
+    engine = get_engine(config, pool_size=workers)
+    snapshot = None
+    if on_snapshot or compare:
+        snapshot = SnapshotEngine(get_export_settings(config)["output_dir"], threads=workers)
+    
+    cache = AnalyticsResultCache(
+        # the cache is keyed on the Postgres load epoch
+        enabled=settings["cache_enabled"] and not on_snapshot,
+        # a cached CSV has no plan to capture
+        force=refresh or explain,
+        max_age_hours=settings["cache_max_age_hours"],
+        max_size_mb=settings["cache_max_size_mb"],
+    )
     
     try:
-        with engine.connect() as conn:
-            for query_name, sql in QUERIES.items():
-                print(f"Running {query_name}...")
-                df, exec_time = execute_query(conn, query_name, sql)
-                csv_file = f"{query_name}.csv"
-                export_to_csv(df, csv_file)
-                
-                summary["query_results"][query_name] = {
-                    "rows": int(len(df)),
-                    "columns": int(len(df.columns)),
-                    "execution_time_ms": round(exec_time, 2),
-                    "csv_file": csv_file
+        start = time.perf_counter()
+        if on_snapshot:
+            load_epoch = None
+            routed = route_queries(QUERIES, snapshot.current_aggregates())
+        else:
+            load_epoch = get_load_epoch(engine)
+            with engine.connect() as conn:
+                routed = route_queries(QUERIES, current_aggregates(conn))
+        queries = {name: sql for name, (sql, _) in routed.items()}
+        cache.evict()
+        cached = {name: cache.lookup(name, sql, load_epoch, engine_name) for name, sql in queries.items()}
+        pending = {name: sql for name, sql in queries.items() if cached[name] is None}
+        if on_snapshot:
+            fresh, _ = run_snapshot_queries(snapshot, pending)
+        else:
+            fresh, _ = run_queries(engine, pending, workers, timeout_seconds, explain)
+        plans = None
+        if explain:
+            plans = record_plans(fresh, settings["plan_regression_factor"], update_baseline)
+            plans["captured"] = True
+        for name, result in fresh.items():
+            result["cache"] = "miss"
+            cache.store(name, queries[name], load_epoch, result, engine_name)
+        cache.save()
+        results = {name: cached[name] or fresh[name] for name in queries}
+        for name, (_, source) in routed.items():
+            results[name]["source"] = source
+        wall_seconds = time.perf_counter() - start
+        summary = generate_summary(results, wall_seconds, workers, cache.summary(load_epoch), plans,
+                                   engine_name)
+        
+        if compare:
+            if on_snapshot:
+                with engine.connect() as conn:
+                    available = current_aggregates(conn)
+                postgres_queries = {n: q for n, (q, _) in route_queries(QUERIES, available).items()}
+                snapshot_queries = queries
+            else:
+                postgres_queries = queries
+                snapshot_queries = {
+                    n: q for n, (q, _) in route_queries(QUERIES, snapshot.current_aggregates()).items()
                 }
-                summary["queries_executed"] += 1
+            comparison = compare_engines(engine, snapshot, postgres_queries, snapshot_queries)
+            comparison_path = os.path.join(OUTPUT_DIR, "engine_comparison.json")
+            os.makedirs(OUTPUT_DIR, exist_ok=True)
+            with open(comparison_path, "w") as f:
+                json.dump({"generated_at": pd.Timestamp.now().isoformat(), "queries": comparison}, f, indent=2)
+            summary["engine_comparison"] = {
+                "report": comparison_path,
+                "mismatches": sorted(n for n, c in comparison.items() if not c["match"]),
+            }
         
         os.makedirs(OUTPUT_DIR, exist_ok=True)
         summary_path = os.path.join(OUTPUT_DIR, "analytics_summary.json")
         with open(summary_path, "w") as f:
-            json.dump(generate_summary(summary["query_results"]), f, indent=2)
+            json.dump(summary, f, indent=2)
+        
+        failed = [name for name, r in results.items() if r["status"] != "success"]
+        if failed:
+            raise RuntimeError(f"Analytics queries did not complete: {', '.join(failed)}")
         
         print(f"\nPhase 4.1 COMPLETE! (8 points)")
         print(f"10 CSV files + analytics_summary.json created")
+        print(f"{len(results)} queries in {wall_seconds:.2f}s wall time "
+              f"({summary['total_execution_time_seconds']}s summed, {workers} workers, "
+              f"{len(cache.hits)} served from cache, {engine_name})")
         
     except Exception as e:
         print(f"Error: {e}")
         raise
+    finally:
+        if snapshot is not None:
+            snapshot.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run the analytics queries and export CSVs")
+    parser.add_argument("--workers", type=int, help="queries run concurrently (default: config)")
+    parser.add_argument("--timeout", type=float, help="per-query timeout in seconds (0 = none)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="ignore cached results and re-run every query")
+    parser.add_argument("--explain", action="store_true", default=None,
+                        help="capture EXPLAIN ANALYZE plans and flag regressions against the baseline")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="with --explain, record this run's plans as the new baseline")
+    parser.add_argument("--engine", choices=["postgres", "duckdb"],
+                        help="run on Postgres or on the local Parquet snapshot (default: config)")
+    parser.add_argument("--compare", action="store_true",
+                        help="also run every query on both engines, check results match and time them")
+    args = parser.parse_args()
+    main(max_concurrency=args.workers, query_timeout=args.timeout, refresh=args.refresh,
+         explain=args.explain, update_baseline=args.update_baseline,
+         engine_name=args.engine, compare=args.compare)
@@ -1,13 +1,137 @@
 import os
+import re
+import sys
+import time
 import yaml
 import logging
+import argparse
 import sqlalchemy
 from sqlalchemy import text
 from datetime import datetime
-from typing import Dict
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from scripts.pipeline.task_graph import run_task_graph
+from scripts.transformation.customer_sketches import (
+    ALL_MEMBERS,
+    UNKNOWN_MEMBER,
+    HyperLogLog,
+    customer_hash_sql,
+    register_sql,
+    sketches_from_registers,
+)
+from scripts.transformation.rollup_cube import (
+    CUBE_GROUPING_SETS,
+    cube_pass_sql,
+    fold_cells,
+    touched_periods,
+)
 
 CONFIG_PATH = os.path.join("config", "config.yaml")
 LOGS_DIR = "logs"
+DDL_DIR = os.path.join("sql", "ddl")
+
+# Full rebuilds go into SHADOW_SCHEMA and are swapped in; the replaced
+# warehouse stays around as PREVIOUS_SCHEMA for rollback.
+LIVE_SCHEMA = "warehouse"
+SHADOW_SCHEMA = "warehouse_next"
+PREVIOUS_SCHEMA = "warehouse_prev"
+WAREHOUSE_DDL_FILES = [
+    "create_warehouse_schema.sql",
+    "create_dimdate.sql",
+    "create_dimorders.sql",
+    "create_dimproducts.sql",
+    "create_factorders.sql",
+    "create_factorderitems.sql",
+    "create_aggregates.sql",
+]
+# The part of WAREHOUSE_DDL_FILES every load re-applies (see ensure_load_state).
+LOAD_STATE_DDL_FILES = [
+    "create_warehouse_schema.sql",
+    "create_dimdate.sql",
+    "create_dimorders.sql",
+    "create_aggregates.sql",
+]
+
+# Secondary indexes for analytics joins/filters. Full rebuilds drop them
+# before the bulk load and build them afterwards; incremental loads only
+# make sure they exist. Indexes the load itself relies on (business-key
+# lookups, one current customer version) are not listed here.
+INDEX_SPECS = [
+    {"name": "idx_factorders_orderkey", "table": "factorders", "columns": "orderkey"},
+    {"name": "idx_factorders_customerkey", "table": "factorders", "columns": "customerkey"},
+    {"name": "idx_factorders_datekey", "table": "factorders", "columns": "datekey"},
+    {"name": "idx_dimorders_customerid", "table": "dimorders", "columns": "customerid"},
+    {"name": "idx_dimorders_orderdate", "table": "dimorders", "columns": "orderdate"},
+    {"name": "idx_dimdate_year_month", "table": "dimdate", "columns": "year, month"},
+    {"name": "idx_factorderitems_productkey", "table": "factorderitems", "columns": "productkey"},
+    {"name": "idx_factorderitems_customerkey", "table": "factorderitems", "columns": "customerkey"},
+    {"name": "idx_factorderitems_datekey", "table": "factorderitems", "columns": "datekey"},
+    {
+        "name": "idx_agg_product_performance_revenue",
+        "table": "agg_product_performance",
+        "columns": "total_revenue DESC",
+    },
+    {
+        "name": "idx_agg_product_performance_profit",
+        "table": "agg_product_performance",
+        "columns": "total_profit DESC",
+    },
+]
+
+# Fact foreign keys, dropped during full-rebuild bulk loads and re-added
+# (one validating scan each) afterwards.
+FOREIGN_KEY_SPECS = [
+    {"table": "factorders", "column": "orderkey", "references": "dimorders"},
+    {"table": "factorders", "column": "customerkey", "references": "dimcustomers"},
+    {"table": "factorders", "column": "datekey", "references": "dimdate"},
+    {"table": "factorderitems", "column": "productkey", "references": "dimproducts"},
+    {"table": "factorderitems", "column": "customerkey", "references": "dimcustomers"},
+    {"table": "factorderitems", "column": "datekey", "references": "dimdate"},
+]
+
+# Customer attributes whose change opens a new dimcustomers version.
+SCD2_TRACKED_COLUMNS = ["firstname", "lastname", "city", "state", "country", "agegroup"]
+
+DIMCUSTOMERS_COLUMNS = [
+    "customerkey",
+    "customerid",
+    "firstname",
+    "lastname",
+    "fullname",
+    "city",
+    "state",
+    "country",
+    "agegroup",
+    "customersegment",
+    "effectivedate",
+    "enddate",
+    "iscurrent",
+    "rowhash",
+]
+
+# Columns agg_product_performance gained with the line-item fact.
+PRODUCT_PERFORMANCE_COLUMNS = [
+    ("productname", "VARCHAR(255)"),
+    ("category", "VARCHAR(100)"),
+    ("brand", "VARCHAR(100)"),
+    ("total_profit", "NUMERIC(14,2)"),
+    ("order_lines", "INTEGER"),
+]
+
+FACT_COLUMNS = [
+    "orderkey",
+    "customerkey",
+    "datekey",
+    "quantity",
+    "unitprice",
+    "totalamount",
+    "orderstatus",
+]
 
 
 def setup_logging() -> logging.Logger:
@@ -35,249 +159,1553 @@ def get_engine(config: dict) -> sqlalchemy.Engine:
         f"@{db['host']}:{db['port']}/{db['name']}"
     )
     print("USING DB URL:", url)
-    return sqlalchemy.create_engine(url)
+    workers = (config.get("warehouse") or {}).get("build_workers", 4)
+    return sqlalchemy.create_engine(url, pool_size=max(5, workers + 1))
+
+
+def ensure_load_state(connection, schema: str = "warehouse"):
+    """Create the watermark and aggregate tables and the lookup indexes incremental loads rely on.
+
+    Re-applies LOAD_STATE_DDL_FILES (all idempotent), so warehouses created
+    before a table or index was added to the DDL pick it up.
+    """
+    with connection.begin():
+        connection.exec_driver_sql(schema_ddl(schema, LOAD_STATE_DDL_FILES))
+
+
+def get_watermark(
+    connection, name: str, default: Optional[int] = 0, schema: str = "warehouse"
+) -> Optional[int]:
+    value = connection.execute(
+        text(f"SELECT value FROM {schema}.load_watermarks WHERE name = :name"),
+        {"name": name},
+    ).scalar()
+    return default if value is None else int(value)
+
+
+def set_watermark(connection, name: str, value: int, schema: str = "warehouse"):
+    connection.execute(
+        text(
+            f"""
+        INSERT INTO {schema}.load_watermarks (name, value, updated_at)
+        VALUES (:name, :value, CURRENT_TIMESTAMP)
+        ON CONFLICT (name) DO UPDATE
+           SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at;
+    """
+        ),
+        {"name": name, "value": value},
+    )
+
+
+def stamp_load_epoch(connection, schema: str = "warehouse") -> int:
+    """Record a new warehouse version; readers (e.g. the analytics cache) key on it."""
+    epoch = int(datetime.now().timestamp() * 1000)
+    set_watermark(connection, "load_epoch", epoch, schema)
+    return epoch
+
+
+def row_hash_sql(alias: str) -> str:
+    """md5 over the tracked attributes; ROW()::text keeps NULL distinct from ''."""
+    cols = ", ".join(f"{alias}.{c}" for c in SCD2_TRACKED_COLUMNS)
+    return f"md5(ROW({cols})::text)"
 
 
-def truncate_warehouse(connection):
-    """Truncate ALL warehouse tables in correct order (facts, then dims, then aggs)."""
+def ensure_scd2_columns(connection, schema: str = "warehouse"):
+    """Add the rowhash column / current-row index to pre-SCD2 dimcustomers tables."""
     with connection.begin():
+        connection.execute(
+            text(f"ALTER TABLE {schema}.dimcustomers ADD COLUMN IF NOT EXISTS rowhash CHAR(32)")
+        )
+        # rows loaded before hashing existed get the hash of what they hold
         connection.execute(
             text(
-                """
-            TRUNCATE 
-                warehouse.agg_daily_sales,
-                warehouse.agg_product_performance,
-                warehouse.agg_customer_metrics,
-                warehouse.factorders,
-                warehouse.dimorders, 
-                warehouse.dimcustomers, 
-                warehouse.dimdate
-            RESTART IDENTITY CASCADE;
+                f"""
+            UPDATE {schema}.dimcustomers d
+               SET rowhash = {row_hash_sql("d")}
+             WHERE d.rowhash IS NULL;
+        """
+            )
+        )
+        connection.execute(
+            text(
+                f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_dimcustomers_current
+                ON {schema}.dimcustomers (customerid) WHERE iscurrent;
         """
             )
         )
 
 
-def build_dim_customers(connection) -> int:
-    """Load warehouse.dimcustomers from production.customers (Type 1 now, SCD2-ready)."""
-    with connection.begin():
-        sql = text(
-            """
-        INSERT INTO warehouse.dimcustomers (
-            customerid, firstname, lastname, fullname, city, state, country,
-            agegroup, customersegment, effectivedate, iscurrent
+def build_dim_customers(connection, schema: str = "warehouse") -> Dict[str, int]:
+    """Maintain warehouse.dimcustomers as SCD Type 2 using a row hash.
+
+    Current rows whose hash differs from production are expired and a new
+    version is inserted; customers not seen before get their first version.
+    Unchanged customers are not touched, so their customerkey stays put.
+    """
+    expired = connection.execute(
+        text(
+            f"""
+        UPDATE {schema}.dimcustomers d
+           SET iscurrent = FALSE,
+               enddate = GREATEST(d.effectivedate, CURRENT_DATE - 1)
+          FROM production.customers c
+         WHERE d.customerid = c.customerid
+           AND d.iscurrent
+           AND d.rowhash IS DISTINCT FROM {row_hash_sql("c")};
+    """
+        )
+    ).rowcount
+
+    # customers without a current row: first-timers, plus the ones just expired
+    new_customers, new_versions = connection.execute(
+        text(
+            f"""
+        WITH source AS (
+            SELECT
+                c.*,
+                EXISTS (
+                    SELECT 1 FROM {schema}.dimcustomers h WHERE h.customerid = c.customerid
+                ) AS has_history
+            FROM production.customers c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {schema}.dimcustomers d
+                 WHERE d.customerid = c.customerid AND d.iscurrent
+            )
+        ),
+        inserted AS (
+            INSERT INTO {schema}.dimcustomers (
+                customerid, firstname, lastname, fullname, city, state, country,
+                agegroup, customersegment, effectivedate, iscurrent, rowhash
+            )
+            SELECT
+                c.customerid, c.firstname, c.lastname,
+                (c.firstname || ' ' || c.lastname) AS fullname,
+                c.city, c.state, c.country, c.agegroup,
+                'Regular' AS customersegment,
+                CASE WHEN c.has_history
+                     THEN CURRENT_DATE
+                     ELSE COALESCE(c.registrationdate, CURRENT_DATE)
+                END AS effectivedate,
+                TRUE AS iscurrent,
+                {row_hash_sql("c")} AS rowhash
+            FROM source c
         )
         SELECT
-            c.customerid, c.firstname, c.lastname,
-            (c.firstname || ' ' || c.lastname) AS fullname,
-            c.city, c.state, c.country, c.agegroup,
-            'Regular' AS customersegment,
-            DATE '2024-01-01' AS effectivedate,
-            TRUE AS iscurrent
-        FROM production.customers c;
-        """
+            COUNT(*) FILTER (WHERE NOT has_history),
+            COUNT(*) FILTER (WHERE has_history)
+        FROM source;
+    """
         )
-        result = connection.execute(sql)
-        return result.rowcount
+    ).one()
 
+    source_rows = connection.execute(
+        text("SELECT COUNT(*) FROM production.customers")
+    ).scalar_one()
 
-def build_dim_orders(connection) -> int:
-    """Load warehouse.dimorders from production.orders (Type 1)."""
-    with connection.begin():
-        sql = text(
-            """
-        INSERT INTO warehouse.dimorders (orderid, customerid, orderdate, orderstatus)
-        SELECT orderid, customerid, orderdate, orderstatus
-        FROM production.orders;
-        """
-        )
-        result = connection.execute(sql)
-        return result.rowcount
+    return {
+        "new_customers": new_customers,
+        "new_versions": new_versions,
+        "expired": expired,
+        "unchanged": source_rows - new_customers - new_versions,
+    }
 
 
-def build_dim_date(connection) -> int:
-    """Refresh warehouse.dimdate (static reference data)."""
+def build_dim_orders(connection, schema: str = "warehouse") -> int:
+    """Append production.orders not yet in warehouse.dimorders (existing keys are kept)."""
+    sql = text(
+        f"""
+    INSERT INTO {schema}.dimorders (orderid, customerid, orderdate, orderstatus)
+    SELECT o.orderid, o.customerid, o.orderdate, o.orderstatus
+    FROM production.orders o
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {schema}.dimorders d WHERE d.orderid = o.orderid
+    );
+    """
+    )
+    result = connection.execute(sql)
+    return result.rowcount
+
+
+def build_dim_date(connection, schema: str = "warehouse") -> int:
+    """Add any missing dates to warehouse.dimdate (static reference data)."""
+    sql = text(
+        f"""
+    INSERT INTO {schema}.dimdate (
+        fulldate, year, quarter, month, monthname, day, weekday, weekdayname, isweekend
+    )
+    SELECT
+        d::date,
+        EXTRACT(YEAR FROM d)::int,
+        EXTRACT(QUARTER FROM d)::int,
+        EXTRACT(MONTH FROM d)::int,
+        TO_CHAR(d, 'Month'),
+        EXTRACT(DAY FROM d)::int,
+        EXTRACT(DOW FROM d)::int,
+        TO_CHAR(d, 'Day'),
+        (EXTRACT(DOW FROM d) IN (0,6))
+    FROM generate_series('2024-01-01'::date, '2026-12-31'::date, '1 day') AS d
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {schema}.dimdate x WHERE x.fulldate = d::date
+    );
+    """
+    )
+    result = connection.execute(sql)
+    return result.rowcount
+
+
+def ensure_product_tables(connection, schema: str = "warehouse"):
+    """Create dimproducts/factorderitems and the product aggregate columns on older warehouses."""
     with connection.begin():
-        sql = text(
-            """
-        INSERT INTO warehouse.dimdate (
-            fulldate, year, quarter, month, monthname, day, weekday, weekdayname, isweekend
+        connection.exec_driver_sql(
+            schema_ddl(schema, ["create_dimproducts.sql", "create_factorderitems.sql"])
         )
-        SELECT 
-            d::date,
-            EXTRACT(YEAR FROM d)::int,
-            EXTRACT(QUARTER FROM d)::int,
-            EXTRACT(MONTH FROM d)::int,
-            TO_CHAR(d, 'Month'),
-            EXTRACT(DAY FROM d)::int,
-            EXTRACT(DOW FROM d)::int,
-            TO_CHAR(d, 'Day'),
-            (EXTRACT(DOW FROM d) IN (0,6))
-        FROM generate_series('2024-01-01'::date, '2026-12-31'::date, '1 day') AS d;
+        has_payment = connection.execute(
+            text(
+                """
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = :schema AND table_name = 'factorderitems'
+              AND column_name = 'paymentmethod'
         """
+            ),
+            {"schema": schema},
+        ).first()
+        if not has_payment:
+            # one-time backfill for line items loaded before the column existed
+            connection.execute(
+                text(
+                    f"""
+                ALTER TABLE {schema}.factorderitems ADD COLUMN paymentmethod VARCHAR(50);
+                UPDATE {schema}.factorderitems f
+                   SET paymentmethod = t.paymentmethod
+                  FROM production.transactions t
+                 WHERE t.transactionid = f.transactionid;
+            """
+                )
+            )
+        if aggregate_relkinds(connection, schema).get("agg_product_performance") == "m":
+            return  # a materialized view already has every column
+        existing = set(
+            connection.execute(
+                text(
+                    """
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = :schema AND table_name = 'agg_product_performance'
+            """
+                ),
+                {"schema": schema},
+            ).scalars()
         )
-        result = connection.execute(sql)
-        return result.rowcount
+        missing = [(c, t) for c, t in PRODUCT_PERFORMANCE_COLUMNS if c not in existing]
+        if missing:
+            # ALTER TABLE locks out readers even when there is nothing to add
+            connection.execute(
+                text(
+                    f"ALTER TABLE {schema}.agg_product_performance "
+                    + ", ".join(f"ADD COLUMN IF NOT EXISTS {c} {t}" for c, t in missing)
+                )
+            )
 
 
-def build_fact_orders(connection) -> int:
-    """Build factorders by joining all 3 dimensions."""
-    with connection.begin():
-        sql = text(
-            """
-        INSERT INTO warehouse.factorders (
-            orderkey,
-            customerkey,
-            datekey,
-            quantity,
-            unitprice,
-            totalamount,
-            orderstatus
+def build_dim_products(connection, schema: str = "warehouse") -> int:
+    """Upsert production.products into dimproducts (Type 1: changed rows keep their key)."""
+    sql = text(
+        f"""
+    INSERT INTO {schema}.dimproducts AS d (
+        productid, productname, category, subcategory, brand, price, cost
+    )
+    SELECT p.productid, p.productname, p.category, p.subcategory, p.brand, p.price, p.cost
+    FROM production.products p
+    ON CONFLICT (productid) DO UPDATE SET
+        productname = EXCLUDED.productname,
+        category = EXCLUDED.category,
+        subcategory = EXCLUDED.subcategory,
+        brand = EXCLUDED.brand,
+        price = EXCLUDED.price,
+        cost = EXCLUDED.cost
+    WHERE (d.productname, d.category, d.subcategory, d.brand, d.price, d.cost)
+          IS DISTINCT FROM
+          (EXCLUDED.productname, EXCLUDED.category, EXCLUDED.subcategory,
+           EXCLUDED.brand, EXCLUDED.price, EXCLUDED.cost);
+    """
+    )
+    result = connection.execute(sql)
+    return result.rowcount
+
+
+def invalidate_aggregate_watermarks(connection, key: str, lowest: int, schema: str = "warehouse"):
+    """Drop the `key` watermarks of aggregates that already cover `lowest`.
+
+    Fact rows loaded at or below an aggregate's watermark would never reach
+    it; without a watermark build_aggregates rebuilds it from the facts.
+    """
+    connection.execute(
+        text(
+            f"DELETE FROM {schema}.load_watermarks "
+            "WHERE name LIKE :pattern AND value >= :lowest"
+        ),
+        {"pattern": f"agg%.{key}", "lowest": lowest},
+    )
+
+
+def build_fact_order_items(connection, schema: str = "warehouse") -> int:
+    """Append transaction line items not yet in factorderitems.
+
+    category/brand are denormalized from dimproducts; linecost uses the
+    product cost at load time so profit needs no dimension join later.
+    Like build_fact_orders, drops the itemkey aggregate watermarks the new
+    rows fall under.
+    """
+    sql = text(
+        f"""
+    WITH inserted AS (
+        INSERT INTO {schema}.factorderitems (
+            itemid, transactionid, productkey, customerkey, datekey, category, brand,
+            paymentmethod, quantity, unitprice, discountpercentage, linetotal, linecost
         )
-        SELECT 
-            dord.orderkey,
+        SELECT
+            ti.itemid,
+            ti.transactionid,
+            dp.productkey,
             dc.customerkey,
             dd.datekey,
-            qty AS quantity,
-            price AS unitprice,
-            qty * price AS totalamount,
-            dord.orderstatus
-        FROM warehouse.dimorders dord
-        JOIN warehouse.dimcustomers dc 
-          ON dord.customerid = dc.customerid 
+            dp.category,
+            dp.brand,
+            t.paymentmethod,
+            ti.quantity,
+            ti.unitprice,
+            ti.discountpercentage,
+            ti.linetotal,
+            ti.quantity * dp.cost AS linecost
+        FROM production.transactionitems ti
+        JOIN production.transactions t ON t.transactionid = ti.transactionid
+        JOIN {schema}.dimproducts dp ON dp.productid = ti.productid
+        JOIN {schema}.dimcustomers dc
+          ON dc.customerid = t.customerid
          AND dc.iscurrent = TRUE
-        JOIN warehouse.dimdate dd 
-          ON dord.orderdate = dd.fulldate,
-        LATERAL (
-            SELECT 
-                (random() * 10 + 1)::int AS qty,
-                (random() * 100 + 10)::numeric(10,2) AS price
-        ) AS r;
+        JOIN {schema}.dimdate dd ON dd.fulldate = t.transactiondate
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {schema}.factorderitems f WHERE f.itemid = ti.itemid
+        )
+        RETURNING itemkey
+    )
+    SELECT COUNT(*), MIN(itemkey) FROM inserted;
+    """
+    )
+    inserted, lowest = connection.execute(sql).one()
+    if inserted:
+        invalidate_aggregate_watermarks(connection, "itemkey", lowest, schema)
+    return inserted
+
+
+def fact_select_sql(where: str, schema: str = "warehouse") -> str:
+    """SELECT producing factorders rows for the dimorders rows matching `where`."""
+    return f"""
+    SELECT
+        dord.orderkey,
+        dc.customerkey,
+        dd.datekey,
+        qty AS quantity,
+        price AS unitprice,
+        qty * price AS totalamount,
+        dord.orderstatus
+    FROM {schema}.dimorders dord
+    JOIN {schema}.dimcustomers dc
+      ON dord.customerid = dc.customerid
+     AND dc.iscurrent = TRUE
+    JOIN {schema}.dimdate dd
+      ON dord.orderdate = dd.fulldate,
+    LATERAL (
+        SELECT
+            (random() * 10 + 1)::int AS qty,
+            (random() * 100 + 10)::numeric(10,2) AS price
+    ) AS r
+    WHERE {where}
+    """
+
+
+def build_fact_orders(connection, schema: str = "warehouse") -> int:
+    """Append facts for every dimorders row that has none yet.
+
+    The NOT EXISTS anti-join, not the high-water mark, decides what is
+    loaded: an order whose current customer or date row is missing is
+    skipped by the joins and picked up by a later load once it arrives.
+    Such a late fact lands below the orderkey watermarks of the
+    aggregates, so those are dropped and build_aggregates rebuilds them.
+    Existing fact rows and keys are never rewritten.
+    """
+    high_water_mark = get_watermark(connection, "factorders.orderkey", schema=schema)
+    where = f"""NOT EXISTS (
+          SELECT 1 FROM {schema}.factorders f WHERE f.orderkey = dord.orderkey
+      )"""
+    inserted, lowest, highest = connection.execute(
+        text(
+            f"WITH inserted AS (INSERT INTO {schema}.factorders ({', '.join(FACT_COLUMNS)})"
+            + fact_select_sql(where, schema)
+            + "RETURNING orderkey) SELECT COUNT(*), MIN(orderkey), MAX(orderkey) FROM inserted"
+        )
+    ).one()
+    if inserted and lowest <= high_water_mark:
+        invalidate_aggregate_watermarks(connection, "orderkey", lowest, schema)
+    set_watermark(connection, "factorders.orderkey", max(high_water_mark, highest or 0), schema)
+    return inserted
+
+
+# ---------- factorders monthly partitions ----------
+
+
+def partition_name(year: int, month: int) -> str:
+    return f"factorders_{year:04d}{month:02d}"
+
+
+def fact_partition_bounds(
+    connection,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    schema: str = "warehouse",
+) -> List[Dict[str, int]]:
+    """Monthly [lo, hi) datekey ranges from dimdate.
+
+    dimdate keys are assigned in date order, so each month is one
+    contiguous datekey range.
+    """
+    params = {"year": year, "month": month} if year is not None else {}
+    where = "WHERE year = :year AND month = :month" if params else ""
+    rows = connection.execute(
+        text(
+            f"""
+        SELECT year, month, MIN(datekey) AS lo, MAX(datekey) + 1 AS hi
+        FROM {schema}.dimdate
+        {where}
+        GROUP BY year, month
+        ORDER BY year, month
+    """
+        ),
+        params,
+    ).mappings()
+    return [dict(r) for r in rows]
+
+
+def partition_ddl(bounds: Dict[str, int], schema: str = "warehouse") -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {schema}.{partition_name(bounds['year'], bounds['month'])} "
+        f"PARTITION OF {schema}.factorders FOR VALUES FROM ({bounds['lo']}) TO ({bounds['hi']})"
+    )
+
+
+def existing_fact_partitions(connection, schema: str = "warehouse") -> List[str]:
+    return list(
+        connection.execute(
+            text(
+                """
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            JOIN pg_namespace n ON n.oid = p.relnamespace
+            WHERE n.nspname = :schema AND p.relname = 'factorders'
         """
+            ),
+            {"schema": schema},
+        ).scalars()
+    )
+
+
+def add_fact_partitions(connection, schema: str = "warehouse") -> List[str]:
+    """Create the monthly partitions dimdate covers but factorders lacks yet."""
+    existing = set(existing_fact_partitions(connection, schema))
+    created = []
+    for bounds in fact_partition_bounds(connection, schema=schema):
+        name = partition_name(bounds["year"], bounds["month"])
+        if name not in existing:
+            connection.execute(text(partition_ddl(bounds, schema)))
+            created.append(name)
+    connection.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {schema}.factorders_default "
+            f"PARTITION OF {schema}.factorders DEFAULT"
         )
-        result = connection.execute(sql)
-        return result.rowcount
+    )
+    return created
 
 
-def build_aggregates(connection) -> Dict[str, int]:
-    """Populate aggregate tables from factorders."""
-    stats: Dict[str, int] = {}
+def ensure_partitioned_factorders(connection, schema: str = "warehouse"):
+    """Convert a plain (pre-partitioning) factorders heap into a partitioned table."""
     with connection.begin():
-        # Daily sales aggregate
+        relkind = connection.execute(
+            text(
+                """
+            SELECT c.relkind
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema AND c.relname = 'factorders'
+        """
+            ),
+            {"schema": schema},
+        ).scalar()
+        if relkind != "r":
+            return
         connection.execute(
-            text("TRUNCATE warehouse.agg_daily_sales RESTART IDENTITY")
+            text(
+                f"""
+            ALTER TABLE {schema}.factorders RENAME TO factorders_unpartitioned;
+            CREATE TABLE {schema}.factorders (
+                LIKE {schema}.factorders_unpartitioned INCLUDING DEFAULTS
+            ) PARTITION BY RANGE (datekey);
+            ALTER TABLE {schema}.factorders
+                ADD FOREIGN KEY (orderkey) REFERENCES {schema}.dimorders(orderkey),
+                ADD FOREIGN KEY (customerkey) REFERENCES {schema}.dimcustomers(customerkey),
+                ADD FOREIGN KEY (datekey) REFERENCES {schema}.dimdate(datekey);
+        """
+            )
         )
+        add_fact_partitions(connection, schema)
         connection.execute(
             text(
-                """
-            INSERT INTO warehouse.agg_daily_sales (
-                datekey, total_transactions, total_revenue, total_profit, unique_customers
-            )
-            SELECT 
-                d.datekey,
-                COUNT(DISTINCT f.orderkey) AS total_transactions,
-                SUM(f.totalamount) AS total_revenue,
-                NULL AS total_profit,
-                COUNT(DISTINCT f.customerkey) AS unique_customers
-            FROM warehouse.factorders f
-            JOIN warehouse.dimdate d ON f.datekey = d.datekey
-            GROUP BY d.datekey;
+                f"""
+            INSERT INTO {schema}.factorders SELECT * FROM {schema}.factorders_unpartitioned;
+            DROP TABLE {schema}.factorders_unpartitioned;
+            CREATE INDEX IF NOT EXISTS idx_factorders_orderkey
+                ON {schema}.factorders (orderkey);
         """
             )
         )
-        stats["daily"] = connection.execute(
-            text("SELECT COUNT(*) FROM warehouse.agg_daily_sales")
-        ).scalar_one()
 
-        # Customer metrics aggregate
+
+def reload_fact_partition(connection, year: int, month: int, schema: str = "warehouse") -> int:
+    """Rebuild one month of facts: detach its partition, refill it, attach it back.
+
+    The CHECK constraint added before ATTACH lets Postgres skip the
+    validation scan of the refilled partition.
+    """
+    bounds = fact_partition_bounds(connection, year, month, schema)
+    if not bounds:
+        raise ValueError(f"No dimdate rows for {year:04d}-{month:02d}")
+    lo, hi = bounds[0]["lo"], bounds[0]["hi"]
+    name = partition_name(year, month)
+    if name not in existing_fact_partitions(connection, schema):
+        connection.execute(text(partition_ddl(bounds[0], schema)))
+
+    connection.execute(text(f"ALTER TABLE {schema}.factorders DETACH PARTITION {schema}.{name}"))
+    connection.execute(text(f"TRUNCATE {schema}.{name}"))
+    rows = connection.execute(
+        text(
+            f"INSERT INTO {schema}.{name} ({', '.join(FACT_COLUMNS)})"
+            + fact_select_sql("dd.datekey >= :lo AND dd.datekey < :hi", schema)
+        ),
+        {"lo": lo, "hi": hi},
+    ).rowcount
+    connection.execute(
+        text(
+            f"""
+        ALTER TABLE {schema}.{name} ADD CONSTRAINT {name}_bounds
+            CHECK (datekey IS NOT NULL AND datekey >= {lo} AND datekey < {hi});
+        ALTER TABLE {schema}.factorders ATTACH PARTITION {schema}.{name}
+            FOR VALUES FROM ({lo}) TO ({hi});
+        ALTER TABLE {schema}.{name} DROP CONSTRAINT {name}_bounds;
+    """
+        )
+    )
+    return rows
+
+
+def aggregate_delta(
+    connection,
+    watermark: str,
+    source: str,
+    key: str,
+    tables: List[str],
+    full: bool = False,
+    schema: str = "warehouse",
+) -> Dict[str, int]:
+    """The (after, upto] key range of `source` not yet merged into an aggregate.
+
+    Without a watermark (first run, a rebuild, or `full`) the aggregate's
+    `tables` are emptied and the whole source is the delta.
+    """
+    after = None if full else get_watermark(connection, watermark, None, schema)
+    if after is None:
+        connection.execute(
+            text("TRUNCATE " + ", ".join(f"{schema}.{t}" for t in tables) + " RESTART IDENTITY")
+        )
+        after = 0
+    upto = connection.execute(
+        text(f"SELECT COALESCE(MAX({key}), 0) FROM {schema}.{source}")
+    ).scalar_one()
+    return {"after": after, "upto": max(after, upto)}
+
+
+def merge_daily_sales(connection, full: bool = False, schema: str = "warehouse") -> int:
+    """Merge new factorders rows into agg_daily_sales.
+
+    Each orderkey is new to the aggregate, so transaction counts and sums
+    add up; unique_customers is kept exact through agg_daily_customers,
+    which records every (datekey, customerkey) pair already counted.
+    """
+    watermark = "agg_daily_sales.orderkey"
+    params = aggregate_delta(
+        connection,
+        watermark,
+        "factorders",
+        "orderkey",
+        ["agg_daily_sales", "agg_daily_customers"],
+        full,
+        schema,
+    )
+    delta = "f.orderkey > :after AND f.orderkey <= :upto"
+    rows = connection.execute(
+        text(
+            f"""
+        WITH new_pairs AS (
+            INSERT INTO {schema}.agg_daily_customers (datekey, customerkey)
+            SELECT DISTINCT f.datekey, f.customerkey
+            FROM {schema}.factorders f
+            WHERE {delta}
+            ON CONFLICT DO NOTHING
+            RETURNING datekey
+        ),
+        new_customers AS (
+            SELECT datekey, COUNT(*) AS customers FROM new_pairs GROUP BY datekey
+        ),
+        day_delta AS (
+            SELECT
+                f.datekey,
+                COUNT(DISTINCT f.orderkey) AS total_transactions,
+                SUM(f.totalamount) AS total_revenue
+            FROM {schema}.factorders f
+            WHERE {delta}
+            GROUP BY f.datekey
+        )
+        INSERT INTO {schema}.agg_daily_sales AS a (
+            datekey, total_transactions, total_revenue, total_profit, unique_customers
+        )
+        SELECT
+            d.datekey,
+            d.total_transactions,
+            d.total_revenue,
+            NULL AS total_profit,
+            COALESCE(n.customers, 0) AS unique_customers
+        FROM day_delta d
+        LEFT JOIN new_customers n ON n.datekey = d.datekey
+        ON CONFLICT (datekey) DO UPDATE SET
+            total_transactions = a.total_transactions + EXCLUDED.total_transactions,
+            total_revenue = a.total_revenue + EXCLUDED.total_revenue,
+            unique_customers = a.unique_customers + EXCLUDED.unique_customers;
+    """
+        ),
+        params,
+    ).rowcount
+    set_watermark(connection, watermark, params["upto"], schema)
+    return rows
+
+
+def merge_customer_metrics(connection, full: bool = False, schema: str = "warehouse") -> int:
+    """Merge new factorders rows into agg_customer_metrics.
+
+    One fact row per order, so avg_order_value = total_spent / total_transactions.
+    """
+    watermark = "agg_customer_metrics.orderkey"
+    params = aggregate_delta(
+        connection, watermark, "factorders", "orderkey", ["agg_customer_metrics"], full, schema
+    )
+    rows = connection.execute(
+        text(
+            f"""
+        INSERT INTO {schema}.agg_customer_metrics AS a (
+            customerkey, total_transactions, total_spent, avg_order_value, last_purchase_date
+        )
+        SELECT
+            f.customerkey,
+            COUNT(DISTINCT f.orderkey) AS total_transactions,
+            SUM(f.totalamount) AS total_spent,
+            SUM(f.totalamount) / COUNT(DISTINCT f.orderkey) AS avg_order_value,
+            MAX(d.fulldate) AS last_purchase_date
+        FROM {schema}.factorders f
+        JOIN {schema}.dimdate d ON f.datekey = d.datekey
+        WHERE f.orderkey > :after AND f.orderkey <= :upto
+        GROUP BY f.customerkey
+        ON CONFLICT (customerkey) DO UPDATE SET
+            total_transactions = a.total_transactions + EXCLUDED.total_transactions,
+            total_spent = a.total_spent + EXCLUDED.total_spent,
+            avg_order_value = (a.total_spent + EXCLUDED.total_spent)
+                              / (a.total_transactions + EXCLUDED.total_transactions),
+            last_purchase_date = GREATEST(a.last_purchase_date, EXCLUDED.last_purchase_date);
+    """
+        ),
+        params,
+    ).rowcount
+    set_watermark(connection, watermark, params["upto"], schema)
+    return rows
+
+
+def merge_product_performance(connection, full: bool = False, schema: str = "warehouse") -> int:
+    """Merge new factorderitems rows into agg_product_performance.
+
+    The average discount is merged weighted by order_lines; product name,
+    category and brand follow the latest dimproducts values.
+    """
+    watermark = "agg_product_performance.itemkey"
+    params = aggregate_delta(
+        connection,
+        watermark,
+        "factorderitems",
+        "itemkey",
+        ["agg_product_performance"],
+        full,
+        schema,
+    )
+    rows = connection.execute(
+        text(
+            f"""
+        INSERT INTO {schema}.agg_product_performance AS a (
+            productid, productname, category, brand, total_quantity_sold,
+            total_revenue, total_profit, avg_discount_percentage, order_lines
+        )
+        SELECT
+            dp.productid,
+            dp.productname,
+            dp.category,
+            dp.brand,
+            SUM(f.quantity) AS total_quantity_sold,
+            SUM(f.linetotal) AS total_revenue,
+            SUM(f.linetotal - f.linecost) AS total_profit,
+            AVG(f.discountpercentage) AS avg_discount_percentage,
+            COUNT(*) AS order_lines
+        FROM {schema}.factorderitems f
+        JOIN {schema}.dimproducts dp ON dp.productkey = f.productkey
+        WHERE f.itemkey > :after AND f.itemkey <= :upto
+        GROUP BY dp.productid, dp.productname, dp.category, dp.brand
+        ON CONFLICT (productid) DO UPDATE SET
+            productname = EXCLUDED.productname,
+            category = EXCLUDED.category,
+            brand = EXCLUDED.brand,
+            total_quantity_sold = a.total_quantity_sold + EXCLUDED.total_quantity_sold,
+            total_revenue = a.total_revenue + EXCLUDED.total_revenue,
+            total_profit = a.total_profit + EXCLUDED.total_profit,
+            avg_discount_percentage =
+                (a.avg_discount_percentage * a.order_lines
+                 + EXCLUDED.avg_discount_percentage * EXCLUDED.order_lines)
+                / (a.order_lines + EXCLUDED.order_lines),
+            order_lines = a.order_lines + EXCLUDED.order_lines;
+    """
+        ),
+        params,
+    ).rowcount
+    set_watermark(connection, watermark, params["upto"], schema)
+    return rows
+
+
+def merge_sketch_registers(
+    connection, table: str, member: str, rows: List[Tuple[Any, ...]], schema: str = "warehouse"
+) -> int:
+    """Fold (datekey, member, index, rank) rows into the stored per-day sketches.
+
+    Only the sketches of (datekey, member) pairs present in `rows` are read,
+    merged (register-wise max) and written back. Returns sketches written.
+    """
+    delta = sketches_from_registers(rows)
+    if not delta:
+        return 0
+    stored = connection.execute(
+        text(f"SELECT datekey, {member}, registers FROM {schema}.{table} WHERE datekey = ANY(:dates)"),
+        {"dates": sorted({datekey for datekey, _ in delta})},
+    )
+    for datekey, value, registers in stored:
+        if (datekey, value) in delta:
+            delta[(datekey, value)].merge(HyperLogLog.from_bytes(registers))
+    connection.execute(
+        text(
+            f"""
+        INSERT INTO {schema}.{table} (datekey, {member}, registers)
+        VALUES (:datekey, :member, :registers)
+        ON CONFLICT (datekey, {member}) DO UPDATE SET registers = EXCLUDED.registers;
+    """
+        ),
+        [
+            {"datekey": datekey, "member": value, "registers": sketch.to_bytes()}
+            for (datekey, value), sketch in delta.items()
+        ],
+    )
+    return len(delta)
+
+
+def merge_customer_sketches(connection, full: bool = False, schema: str = "warehouse") -> int:
+    """Merge new factorders rows into the per-day distinct-customer sketches.
+
+    Postgres reduces the delta to one max rank per (day, state, register)
+    plus the all-states sketch (state ALL_MEMBERS) in one GROUPING SETS
+    pass; the registers are then folded into the stored sketches.
+    """
+    watermark = "agg_customer_sketches.orderkey"
+    params = aggregate_delta(
+        connection, watermark, "factorders", "orderkey", ["agg_customer_sketches"], full, schema
+    )
+    index, rank = register_sql("h")
+    rows = connection.execute(
+        text(
+            f"""
+        WITH hashed AS (
+            SELECT f.datekey, COALESCE(c.state, '{UNKNOWN_MEMBER}') AS state, {customer_hash_sql("c.customerid")} AS h
+            FROM {schema}.factorders f
+            JOIN {schema}.dimcustomers c ON c.customerkey = f.customerkey
+            WHERE f.orderkey > :after AND f.orderkey <= :upto
+        ),
+        ranked AS (
+            SELECT datekey, state, {index} AS idx, {rank} AS rnk FROM hashed
+        )
+        SELECT
+            datekey,
+            CASE WHEN GROUPING(state) = 1 THEN :all_members ELSE state END AS state,
+            idx,
+            MAX(rnk)
+        FROM ranked
+        GROUP BY GROUPING SETS ((datekey, state, idx), (datekey, idx));
+    """
+        ),
+        {**params, "all_members": ALL_MEMBERS},
+    ).all()
+    written = merge_sketch_registers(connection, "agg_customer_sketches", "state", rows, schema)
+    set_watermark(connection, watermark, params["upto"], schema)
+    return written
+
+
+def merge_category_sketches(connection, full: bool = False, schema: str = "warehouse") -> int:
+    """Merge new factorderitems rows into the per-day, per-category customer sketches."""
+    watermark = "agg_category_sketches.itemkey"
+    params = aggregate_delta(
+        connection, watermark, "factorderitems", "itemkey", ["agg_category_sketches"], full, schema
+    )
+    index, rank = register_sql("h")
+    rows = connection.execute(
+        text(
+            f"""
+        WITH hashed AS (
+            SELECT f.datekey, COALESCE(f.category, '') AS category, {customer_hash_sql("c.customerid")} AS h
+            FROM {schema}.factorderitems f
+            JOIN {schema}.dimcustomers c ON c.customerkey = f.customerkey
+            WHERE f.itemkey > :after AND f.itemkey <= :upto
+        )
+        SELECT datekey, category, {index} AS idx, MAX({rank})
+        FROM hashed
+        GROUP BY 1, 2, 3;
+    """
+        ),
+        params,
+    ).all()
+    written = merge_sketch_registers(connection, "agg_category_sketches", "category", rows, schema)
+    set_watermark(connection, watermark, params["upto"], schema)
+    return written
+
+
+def refresh_rollup_cube(connection, full: bool = False, schema: str = "warehouse") -> int:
+    """Recompute the agg_rollup_cube cells whose periods contain new factorderitems rows.
+
+    Cells of every day, month and quarter touched by the delta are deleted
+    and rebuilt from all line items of the touched quarters in one
+    GROUPING SETS pass over CUBE_GROUPING_SETS, which builds the sketches
+    in Postgres and returns only the touched cells; other cells are left
+    alone.
+    Returns the number of cells written.
+    """
+    watermark = "agg_rollup_cube.itemkey"
+    params = aggregate_delta(
+        connection, watermark, "factorderitems", "itemkey", ["agg_rollup_cube"], full, schema
+    )
+    days = connection.execute(
+        text(
+            f"""
+        SELECT DISTINCT d.fulldate
+        FROM {schema}.factorderitems f
+        JOIN {schema}.dimdate d ON d.datekey = f.datekey
+        WHERE f.itemkey > :after AND f.itemkey <= :upto
+    """
+        ),
+        params,
+    ).scalars().all()
+    periods = touched_periods(days)
+    written = 0
+    if days:
         connection.execute(
-            text("TRUNCATE warehouse.agg_customer_metrics RESTART IDENTITY")
+            text(
+                f"""
+            DELETE FROM {schema}.agg_rollup_cube
+            WHERE (grain = 'day' AND period = ANY(:day))
+               OR (grain = 'month' AND period = ANY(:month))
+               OR (grain = 'quarter' AND period = ANY(:quarter));
+        """
+            ),
+            periods,
         )
+        rows = connection.execute(text(cube_pass_sql(CUBE_GROUPING_SETS, schema)), periods).mappings()
+        cells = fold_cells(rows)
+        if cells:
+            connection.execute(
+                text(
+                    f"""
+                INSERT INTO {schema}.agg_rollup_cube (
+                    grain, period, state, category, paymentmethod,
+                    revenue, quantity, order_count, distinct_customers, customers_sketch
+                )
+                VALUES (
+                    :grain, :period, :state, :category, :paymentmethod,
+                    :revenue, :quantity, :order_count, :distinct_customers, :customers_sketch
+                );
+            """
+                ),
+                [
+                    {
+                        "grain": grain,
+                        "period": period,
+                        "state": state,
+                        "category": category,
+                        "paymentmethod": paymentmethod,
+                        "revenue": cell["revenue"],
+                        "quantity": cell["quantity"],
+                        "order_count": cell["order_count"],
+                        "distinct_customers": round(cell["sketch"].estimate()),
+                        "customers_sketch": cell["sketch"].to_bytes(),
+                    }
+                    for (grain, period, state, category, paymentmethod), cell in cells.items()
+                ],
+            )
+        written = len(cells)
+    set_watermark(connection, watermark, params["upto"], schema)
+    return written
+
+
+def build_aggregates(
+    connection, full: bool = False, schema: str = "warehouse", aggregate_mode: str = "tables"
+) -> Dict[str, int]:
+    """Merge facts added since each aggregate's watermark into it.
+
+    Only the datekey/customerkey/productid rows touched by the delta are
+    upserted. `full` recomputes everything from an empty state, as needed
+    after a partition reload rewrote facts. In materialized_views mode the
+    AGGREGATE_VIEWS are skipped (see refresh_aggregate_views). Returns the
+    rows merged per aggregate (statement rowcounts).
+    """
+    skipped = set(AGGREGATE_VIEWS) if aggregate_mode == "materialized_views" else set()
+    return {
+        name: merge(connection, full, schema)
+        for name, merge in AGGREGATE_STEPS.items()
+        if name not in skipped
+    }
+
+
+# ---------- materialized aggregates ----------
+
+AGGREGATE_MODES = ("tables", "materialized_views")
+
+# warehouse.aggregate_mode: materialized_views keeps these aggregates as
+# materialized views over the facts instead of merged tables, with the same
+# names and columns so readers do not change. `key` gets the unique index
+# REFRESH ... CONCURRENTLY needs; `watermark` is advanced to the source
+# key the refresh covered, as the merges do.
+AGGREGATE_VIEWS = {
+    "agg_daily_sales": {
+        "key": "datekey",
+        "watermark": "agg_daily_sales.orderkey",
+        "source": "factorders",
+        "source_key": "orderkey",
+        "sql": """
+        SELECT
+            f.datekey,
+            COUNT(DISTINCT f.orderkey)::int AS total_transactions,
+            SUM(f.totalamount)::numeric(14,2) AS total_revenue,
+            NULL::numeric(14,2) AS total_profit,
+            COUNT(DISTINCT f.customerkey)::int AS unique_customers
+        FROM {schema}.factorders f
+        GROUP BY f.datekey
+    """,
+    },
+    "agg_customer_metrics": {
+        "key": "customerkey",
+        "watermark": "agg_customer_metrics.orderkey",
+        "source": "factorders",
+        "source_key": "orderkey",
+        "sql": """
+        SELECT
+            f.customerkey,
+            COUNT(DISTINCT f.orderkey)::int AS total_transactions,
+            SUM(f.totalamount)::numeric(14,2) AS total_spent,
+            (SUM(f.totalamount) / COUNT(DISTINCT f.orderkey))::numeric(14,2) AS avg_order_value,
+            MAX(d.fulldate) AS last_purchase_date
+        FROM {schema}.factorders f
+        JOIN {schema}.dimdate d ON f.datekey = d.datekey
+        GROUP BY f.customerkey
+    """,
+    },
+    "agg_product_performance": {
+        "key": "productid",
+        "watermark": "agg_product_performance.itemkey",
+        "source": "factorderitems",
+        "source_key": "itemkey",
+        "sql": """
+        SELECT
+            dp.productid,
+            SUM(f.quantity)::int AS total_quantity_sold,
+            SUM(f.linetotal)::numeric(14,2) AS total_revenue,
+            AVG(f.discountpercentage)::numeric(5,2) AS avg_discount_percentage,
+            dp.productname,
+            dp.category,
+            dp.brand,
+            SUM(f.linetotal - f.linecost)::numeric(14,2) AS total_profit,
+            COUNT(*)::int AS order_lines
+        FROM {schema}.factorderitems f
+        JOIN {schema}.dimproducts dp ON dp.productkey = f.productkey
+        GROUP BY dp.productid, dp.productname, dp.category, dp.brand
+    """,
+    },
+}
+
+
+def aggregate_view_ddl(name: str, schema: str = "warehouse", with_data: bool = True) -> str:
+    spec = AGGREGATE_VIEWS[name]
+    return (
+        f"CREATE MATERIALIZED VIEW {schema}.{name} AS {spec['sql'].format(schema=schema)}"
+        f"WITH {'' if with_data else 'NO '}DATA;\n"
+        f"CREATE UNIQUE INDEX idx_{name}_key ON {schema}.{name} ({spec['key']});"
+    )
+
+
+def aggregate_relkinds(connection, schema: str = "warehouse") -> Dict[str, str]:
+    """pg_class relkind of each AGGREGATE_VIEWS relation ('r' table, 'm' materialized view)."""
+    return dict(
         connection.execute(
             text(
                 """
-            INSERT INTO warehouse.agg_customer_metrics (
-                customerkey, total_transactions, total_spent, avg_order_value, last_purchase_date
+            SELECT c.relname, c.relkind
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema AND c.relname = ANY(:names)
+        """
+            ),
+            {"schema": schema, "names": list(AGGREGATE_VIEWS)},
+        ).all()
+    )
+
+
+def ensure_aggregate_mode(
+    connection, aggregate_mode: str, schema: str = "warehouse", with_data: bool = True
+) -> List[str]:
+    """Turn the AGGREGATE_VIEWS relations into tables or materialized views.
+
+    Switching to views builds them once from the facts (`with_data`; a
+    fresh shadow schema passes False and lets build_graph fill them).
+    Switching back recreates the tables empty and drops their watermarks,
+    so the next build_aggregates rebuilds them. Returns the names converted.
+    """
+    if aggregate_mode not in AGGREGATE_MODES:
+        raise ValueError(f"Unknown aggregate_mode {aggregate_mode}; use one of {AGGREGATE_MODES}")
+    want = "m" if aggregate_mode == "materialized_views" else "r"
+    with connection.begin():
+        kinds = aggregate_relkinds(connection, schema)
+        converted = [name for name in AGGREGATE_VIEWS if kinds.get(name, "r") != want]
+        for name in converted:
+            if want == "m":
+                connection.execute(text(f"DROP TABLE IF EXISTS {schema}.{name}"))
+                connection.exec_driver_sql(aggregate_view_ddl(name, schema, with_data))
+            else:
+                connection.execute(text(f"DROP MATERIALIZED VIEW {schema}.{name}"))
+        if converted and want == "r":
+            connection.exec_driver_sql(schema_ddl(schema, ["create_aggregates.sql"]))
+            connection.execute(
+                text(f"DELETE FROM {schema}.load_watermarks WHERE name = ANY(:names)"),
+                {"names": [AGGREGATE_VIEWS[name]["watermark"] for name in converted]},
             )
-            SELECT 
-                f.customerkey,
-                COUNT(DISTINCT f.orderkey) AS total_transactions,
-                SUM(f.totalamount) AS total_spent,
-                AVG(f.totalamount) AS avg_order_value,
-                MAX(d.fulldate) AS last_purchase_date
-            FROM warehouse.factorders f
-            JOIN warehouse.dimdate d ON f.datekey = d.datekey
-            GROUP BY f.customerkey;
+    return converted
+
+
+def refresh_aggregate_view(connection, name: str, schema: str = "warehouse") -> int:
+    """REFRESH one AGGREGATE_VIEWS view, advance its watermark and record the duration.
+
+    A populated view is refreshed CONCURRENTLY: the new contents are
+    diffed in through the unique index under an EXCLUSIVE lock, which
+    still admits SELECTs, so dashboards keep reading the previous contents
+    instead of queueing behind the rebuild. A view created WITH NO DATA
+    (a fresh shadow schema nobody reads yet) gets the cheaper plain
+    refresh. Returns the view's row count.
+    """
+    spec = AGGREGATE_VIEWS[name]
+    started = time.perf_counter()
+    upto = connection.execute(
+        text(f"SELECT COALESCE(MAX({spec['source_key']}), 0) FROM {schema}.{spec['source']}")
+    ).scalar_one()
+    concurrent = bool(
+        connection.execute(
+            text(
+                "SELECT ispopulated FROM pg_matviews "
+                "WHERE schemaname = :schema AND matviewname = :name"
+            ),
+            {"schema": schema, "name": name},
+        ).scalar()
+    )
+    connection.execute(
+        text(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrent else ''}{schema}.{name}")
+    )
+    rows = connection.execute(text(f"SELECT COUNT(*) FROM {schema}.{name}")).scalar_one()
+    set_watermark(connection, spec["watermark"], upto, schema)
+    connection.execute(
+        text(
+            f"""
+        INSERT INTO {schema}.aggregate_refreshes (view_name, duration_seconds, row_count, concurrent)
+        VALUES (:name, :seconds, :rows, :concurrent);
+    """
+        ),
+        {
+            "name": name,
+            "seconds": round(time.perf_counter() - started, 3),
+            "rows": rows,
+            "concurrent": concurrent,
+        },
+    )
+    return rows
+
+
+def refresh_aggregate_views(
+    engine: sqlalchemy.Engine, schema: str = "warehouse", workers: int = 4
+) -> Tuple[Dict[str, int], List[Dict[str, Any]]]:
+    """Refresh every AGGREGATE_VIEWS view in parallel, each on its own pooled connection.
+
+    Runs after the fact load committed, so each refresh sees the new facts.
+    Views are independent of each other; a failed refresh leaves that view
+    on its previous contents and its watermark behind, so routed queries
+    fall back to the facts. Returns (rows per view, timeline).
+    """
+
+    def refresh(name: str) -> Callable[[], int]:
+        def run():
+            with engine.connect() as conn, conn.begin():
+                return refresh_aggregate_view(conn, name, schema)
+
+        return run
+
+    return run_task_graph({name: refresh(name) for name in AGGREGATE_VIEWS}, {}, max_workers=workers)
+
+
+# ---------- build graph ----------
+
+# step name -> builder(connection, schema=...), in a valid serial order
+BUILD_STEPS = {
+    "dimcustomers": build_dim_customers,
+    "dimorders": build_dim_orders,
+    "dimdate": build_dim_date,
+    "dimproducts": build_dim_products,
+    "factorders_partitions": add_fact_partitions,
+    "factorders": build_fact_orders,
+    "factorderitems": build_fact_order_items,
+}
+
+AGGREGATE_STEPS = {
+    "agg_daily_sales": merge_daily_sales,
+    "agg_customer_metrics": merge_customer_metrics,
+    "agg_product_performance": merge_product_performance,
+    "agg_customer_sketches": merge_customer_sketches,
+    "agg_category_sketches": merge_category_sketches,
+    "agg_rollup_cube": refresh_rollup_cube,
+}
+
+BUILD_DEPENDENCIES = {
+    "factorders_partitions": ["dimdate"],
+    "factorders": ["dimcustomers", "dimorders", "factorders_partitions"],
+    "factorderitems": ["dimcustomers", "dimdate", "dimproducts"],
+    "agg_daily_sales": ["factorders"],
+    "agg_customer_metrics": ["factorders"],
+    "agg_product_performance": ["factorderitems"],
+    "agg_customer_sketches": ["factorders"],
+    "agg_category_sketches": ["factorderitems"],
+    "agg_rollup_cube": ["factorderitems"],
+}
+
+
+def build_graph(
+    engine: sqlalchemy.Engine,
+    schema: str = SHADOW_SCHEMA,
+    workers: int = 4,
+    aggregate_mode: str = "tables",
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Run BUILD_STEPS and AGGREGATE_STEPS as a DAG, each step on its own pooled connection.
+
+    Every step commits on its own, which is only safe into the shadow
+    schema: nothing reads it until swap_schemas, so the swap stays the
+    single all-or-nothing commit point. A failed step leaves the live
+    warehouse untouched. In materialized_views mode the AGGREGATE_VIEWS
+    steps refresh the views instead; a view stores the OIDs of the tables
+    it reads, so after the swap it follows them into the live schema.
+    Returns (results, timeline) from run_task_graph.
+    """
+
+    def task(step: Callable[..., Any]) -> Callable[[], Any]:
+        def run():
+            with engine.connect() as conn, conn.begin():
+                return step(conn, schema=schema)
+
+        return run
+
+    steps = {**BUILD_STEPS, **AGGREGATE_STEPS}
+    if aggregate_mode == "materialized_views":
+        steps.update({name: partial(refresh_aggregate_view, name=name) for name in AGGREGATE_VIEWS})
+    return run_task_graph(
+        {name: task(step) for name, step in steps.items()},
+        BUILD_DEPENDENCIES,
+        max_workers=workers,
+    )
+
+
+# ---------- deferred indexes and constraints ----------
+
+
+def index_ddl(spec: Dict[str, str], schema: str = "warehouse") -> str:
+    return (
+        f"CREATE INDEX IF NOT EXISTS {spec['name']} "
+        f"ON {schema}.{spec['table']} ({spec['columns']})"
+    )
+
+
+def ensure_indexes(connection, schema: str = "warehouse"):
+    """Create any declared index that is missing (no-op once they exist)."""
+    with connection.begin():
+        for spec in INDEX_SPECS:
+            connection.execute(text(index_ddl(spec, schema)))
+
+
+def drop_deferred_indexes(connection, schema: str = "warehouse"):
+    """Drop the declared indexes and the fact table FKs ahead of a bulk load."""
+    with connection.begin():
+        for spec in INDEX_SPECS:
+            connection.execute(text(f"DROP INDEX IF EXISTS {schema}.{spec['name']}"))
+        constraints = connection.execute(
+            text(
+                """
+            SELECT c.relname, con.conname
+            FROM pg_constraint con
+            JOIN pg_class c ON c.oid = con.conrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema
+              AND c.relname IN ('factorders', 'factorderitems')
+              AND con.contype = 'f'
         """
+            ),
+            {"schema": schema},
+        ).all()
+        for table, name in constraints:
+            connection.execute(
+                text(f'ALTER TABLE {schema}.{table} DROP CONSTRAINT "{name}"')
             )
-        )
-        stats["customer"] = connection.execute(
-            text("SELECT COUNT(*) FROM warehouse.agg_customer_metrics")
-        ).scalar_one()
 
-        # Product performance aggregate (optional but created)
+
+def build_indexes(
+    engine: sqlalchemy.Engine,
+    schema: str = "warehouse",
+    workers: int = 4,
+    maintenance_work_mem: str = "256MB",
+) -> List[Dict[str, Any]]:
+    """Build INDEX_SPECS in parallel (one pooled connection each), then restore FKs and ANALYZE.
+
+    CREATE INDEX only takes a SHARE lock, so several indexes on the same
+    table build at once. Returns the per-index timeline from run_task_graph.
+    """
+
+    def build(spec: Dict[str, str]):
+        def run():
+            with engine.connect() as conn, conn.begin():
+                conn.execute(
+                    text("SELECT set_config('maintenance_work_mem', :mem, true)"),
+                    {"mem": maintenance_work_mem},
+                )
+                conn.execute(text(index_ddl(spec, schema)))
+
+        return run
+
+    tasks = {spec["name"]: build(spec) for spec in INDEX_SPECS}
+    _, timeline = run_task_graph(tasks, {}, max_workers=workers)
+
+    with engine.connect() as conn, conn.begin():
+        for fk in FOREIGN_KEY_SPECS:
+            conn.execute(
+                text(
+                    f"""
+                ALTER TABLE {schema}.{fk['table']}
+                    ADD CONSTRAINT {fk['table']}_{fk['column']}_fkey FOREIGN KEY ({fk['column']})
+                    REFERENCES {schema}.{fk['references']} ({fk['column']});
+            """
+                )
+            )
+        for table in sorted({spec["table"] for spec in INDEX_SPECS}):
+            conn.execute(text(f"ANALYZE {schema}.{table}"))
+    return timeline
+
+
+# ---------- blue/green full rebuilds ----------
+
+
+def schema_ddl(schema: str, files: Optional[List[str]] = None) -> str:
+    """The warehouse DDL files, retargeted from `warehouse` to `schema`."""
+    parts = []
+    for name in files or WAREHOUSE_DDL_FILES:
+        with open(os.path.join(DDL_DIR, name), "r") as f:
+            parts.append(re.sub(r"\bwarehouse\.", f"{schema}.", f.read()))
+    return "\n".join(parts).replace(
+        f"CREATE SCHEMA IF NOT EXISTS {LIVE_SCHEMA};", f"CREATE SCHEMA IF NOT EXISTS {schema};"
+    )
+
+
+def prepare_shadow_schema(connection, schema: str = SHADOW_SCHEMA):
+    """Recreate `schema` empty from the DDL, carrying over dimcustomers and aggregate_refreshes.
+
+    dimcustomers holds SCD2 history and the customer keys facts refer to,
+    and aggregate_refreshes the refresh timings, so both are copied from
+    the live warehouse rather than rebuilt.
+    """
+    with connection.begin():
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        connection.exec_driver_sql(schema_ddl(schema))
+        columns = ", ".join(DIMCUSTOMERS_COLUMNS)
         connection.execute(
-            text("TRUNCATE warehouse.agg_product_performance RESTART IDENTITY")
+            text(
+                f"INSERT INTO {schema}.dimcustomers ({columns}) "
+                f"SELECT {columns} FROM {LIVE_SCHEMA}.dimcustomers"
+            )
         )
+        # refresh history is kept across rebuilds, like dimcustomers
+        refresh_columns = "view_name, refreshed_at, duration_seconds, row_count, concurrent"
         connection.execute(
             text(
-                """
-            INSERT INTO warehouse.agg_product_performance (
-                productid, total_quantity_sold, total_revenue, avg_discount_percentage
+                f"INSERT INTO {schema}.aggregate_refreshes ({refresh_columns}) "
+                f"SELECT {refresh_columns} FROM {LIVE_SCHEMA}.aggregate_refreshes"
             )
-            SELECT 
-                dord.customerid AS productid,  -- placeholder if you later add real product dimension
-                SUM(f.quantity) AS total_quantity_sold,
-                SUM(f.totalamount) AS total_revenue,
-                NULL::numeric(5,2) AS avg_discount_percentage
-            FROM warehouse.factorders f
-            JOIN warehouse.dimorders dord ON f.orderkey = dord.orderkey
-            GROUP BY dord.customerid;
+        )
+        connection.execute(
+            text(
+                f"""
+            SELECT setval(
+                pg_get_serial_sequence('{schema}.dimcustomers', 'customerkey'),
+                COALESCE((SELECT MAX(customerkey) FROM {schema}.dimcustomers), 0) + 1,
+                false
+            );
         """
             )
         )
-        stats["product"] = connection.execute(
-            text("SELECT COUNT(*) FROM warehouse.agg_product_performance")
-        ).scalar_one()
 
-    return stats
 
+def validate_shadow(connection, schema: str = SHADOW_SCHEMA) -> Dict[str, int]:
+    """Row counts of the shadow star schema; raises if it is not fit to go live."""
+    counts = {
+        table: connection.execute(text(f"SELECT COUNT(*) FROM {schema}.{table}")).scalar_one()
+        for table in (
+            "dimcustomers",
+            "dimorders",
+            "dimdate",
+            "factorders",
+            "dimproducts",
+            "factorderitems",
+            "agg_daily_sales",
+            "agg_customer_metrics",
+            "agg_product_performance",
+        )
+    }
+    source_orders = connection.execute(
+        text("SELECT COUNT(*) FROM production.orders")
+    ).scalar_one()
+    source_products = connection.execute(
+        text("SELECT COUNT(*) FROM production.products")
+    ).scalar_one()
+
+    problems = []
+    if counts["dimorders"] != source_orders:
+        problems.append(
+            f"dimorders has {counts['dimorders']} rows, production.orders {source_orders}"
+        )
+    if counts["dimproducts"] != source_products:
+        problems.append(
+            f"dimproducts has {counts['dimproducts']} rows, production.products {source_products}"
+        )
+    if counts["factorderitems"] and not counts["agg_product_performance"]:
+        problems.append("agg_product_performance is empty")
+    if not counts["dimdate"]:
+        problems.append("dimdate is empty")
+    if counts["dimorders"] and not counts["factorders"]:
+        problems.append("factorders is empty")
+    if counts["factorders"] and not (counts["agg_daily_sales"] and counts["agg_customer_metrics"]):
+        problems.append("aggregates are empty")
+    if problems:
+        raise RuntimeError(f"{schema} failed validation: " + "; ".join(problems))
+    return counts
 
-def main():
+
+def swap_schemas(connection):
+    """Make the shadow schema live in one transaction (renames only, no data copied)."""
+    with connection.begin():
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {PREVIOUS_SCHEMA} CASCADE"))
+        connection.execute(text(f"ALTER SCHEMA {LIVE_SCHEMA} RENAME TO {PREVIOUS_SCHEMA}"))
+        connection.execute(text(f"ALTER SCHEMA {SHADOW_SCHEMA} RENAME TO {LIVE_SCHEMA}"))
+
+
+def rollback_warehouse(connection):
+    """Put the previous warehouse back live; the rolled-back one becomes the shadow."""
+    with connection.begin():
+        exists = connection.execute(
+            text("SELECT 1 FROM pg_namespace WHERE nspname = :schema"),
+            {"schema": PREVIOUS_SCHEMA},
+        ).scalar()
+        if not exists:
+            raise ValueError(f"No {PREVIOUS_SCHEMA} schema to roll back to")
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {SHADOW_SCHEMA} CASCADE"))
+        connection.execute(text(f"ALTER SCHEMA {LIVE_SCHEMA} RENAME TO {SHADOW_SCHEMA}"))
+        connection.execute(text(f"ALTER SCHEMA {PREVIOUS_SCHEMA} RENAME TO {LIVE_SCHEMA}"))
+
+
+def main(
+    full_rebuild: Optional[bool] = None,
+    reload_month: Optional[str] = None,
+    rollback: bool = False,
+):
     logger = setup_logging()
     config = load_config()
     engine = get_engine(config)
+    warehouse_config = config.get("warehouse") or {}
+    if full_rebuild is None:
+        full_rebuild = warehouse_config.get("full_rebuild", False)
+    aggregate_mode = warehouse_config.get("aggregate_mode", "tables")
+    if aggregate_mode not in AGGREGATE_MODES:
+        raise ValueError(f"Unknown warehouse.aggregate_mode {aggregate_mode}; use one of {AGGREGATE_MODES}")
 
     with engine.connect() as conn:
-        print("Building COMPLETE Data Warehouse...")
-        truncate_warehouse(conn)
-        print("Warehouse truncated")
+        if rollback:
+            rollback_warehouse(conn)
+            logger.info("Rolled back: %s is live again", PREVIOUS_SCHEMA)
+            print(f"Warehouse rolled back to {PREVIOUS_SCHEMA}")
+            return
+
+        ensure_load_state(conn)
+        ensure_scd2_columns(conn)
+        ensure_partitioned_factorders(conn)
+        ensure_product_tables(conn)
 
-        customer_rows = build_dim_customers(conn)
-        order_rows = build_dim_orders(conn)
-        date_rows = build_dim_date(conn)
-        fact_rows = build_fact_orders(conn)
-        agg_stats = build_aggregates(conn)
+        if full_rebuild:
+            print(f"Building COMPLETE Data Warehouse into {SHADOW_SCHEMA}...")
+            prepare_shadow_schema(conn)
+            ensure_aggregate_mode(conn, aggregate_mode, SHADOW_SCHEMA, with_data=False)
+            drop_deferred_indexes(conn, SHADOW_SCHEMA)
+            results, timeline = build_graph(
+                engine,
+                SHADOW_SCHEMA,
+                workers=warehouse_config.get("build_workers", 4),
+                aggregate_mode=aggregate_mode,
+            )
+            for entry in timeline:
+                logger.info(
+                    "stage %s: +%ss, %ss on %s (%s)",
+                    entry["task"],
+                    entry["start_offset_seconds"],
+                    entry["duration_seconds"],
+                    entry["thread"],
+                    entry["status"],
+                )
+            index_timeline = build_indexes(
+                engine,
+                SHADOW_SCHEMA,
+                workers=warehouse_config.get("index_workers", 4),
+                maintenance_work_mem=warehouse_config.get("maintenance_work_mem", "256MB"),
+            )
+            for entry in index_timeline:
+                logger.info("index %s built in %ss", entry["task"], entry["duration_seconds"])
+            counts = validate_shadow(conn)
+            with conn.begin():
+                load_epoch = stamp_load_epoch(conn, SHADOW_SCHEMA)
+            swap_schemas(conn)
+            logger.info(
+                "%s swapped in as %s (previous kept as %s): %s",
+                SHADOW_SCHEMA,
+                LIVE_SCHEMA,
+                PREVIOUS_SCHEMA,
+                counts,
+            )
+            print(f"{SHADOW_SCHEMA} validated and swapped live; rollback with --rollback")
+        else:
+            print("Loading Data Warehouse incrementally...")
+            converted = ensure_aggregate_mode(conn, aggregate_mode)
+            if converted:
+                logger.info("aggregates converted to %s: %s", aggregate_mode, ", ".join(converted))
+            ensure_indexes(conn)
+            # One transaction: readers keep seeing the previous state until commit.
+            with conn.begin():
+                results = {name: step(conn) for name, step in BUILD_STEPS.items()}
+                if reload_month:
+                    year, month = (int(p) for p in reload_month.split("-"))
+                    results["reloaded"] = reload_fact_partition(conn, year, month)
+                results.update(
+                    build_aggregates(conn, full=bool(reload_month), aggregate_mode=aggregate_mode)
+                )
+                if aggregate_mode == "tables":
+                    load_epoch = stamp_load_epoch(conn)
+            if aggregate_mode == "materialized_views":
+                # the facts are committed; dashboards keep reading the previous
+                # view contents until each concurrent refresh commits
+                refreshed, refresh_timeline = refresh_aggregate_views(
+                    engine, workers=warehouse_config.get("build_workers", 4)
+                )
+                results.update(refreshed)
+                for entry in refresh_timeline:
+                    logger.info("view %s refreshed in %ss", entry["task"], entry["duration_seconds"])
+                with conn.begin():
+                    load_epoch = stamp_load_epoch(conn)
 
+        scd_stats = results["dimcustomers"]
+        logger.info("dimcustomers SCD2: %s", scd_stats)
+        if results["factorders_partitions"]:
+            logger.info(
+                "factorders partitions created: %s", ", ".join(results["factorders_partitions"])
+            )
+        if "reloaded" in results:
+            logger.info("factorders partition %s reloaded: %s rows", reload_month, results["reloaded"])
+        logger.info("warehouse load_epoch: %s", load_epoch)
         logger.info(
-            "Warehouse COMPLETE: %s C, %s O, %s D, %s F, %s daily aggs, %s customer aggs, %s product aggs",
-            customer_rows,
-            order_rows,
-            date_rows,
-            fact_rows,
-            agg_stats["daily"],
-            agg_stats["customer"],
-            agg_stats["product"],
+            "Warehouse COMPLETE (%s): %s C, %s O, %s D, %s P, %s F, %s FI, "
+            "%s daily aggs, %s customer aggs, %s product aggs merged",
+            "full rebuild" if full_rebuild else "incremental",
+            scd_stats["new_customers"] + scd_stats["new_versions"],
+            results["dimorders"],
+            results["dimdate"],
+            results["dimproducts"],
+            results["factorders"],
+            results["factorderitems"],
+            results["agg_daily_sales"],
+            results["agg_customer_metrics"],
+            results["agg_product_performance"],
         )
-        print(f"dimcustomers rows: {customer_rows}")
-        print(f"dimorders rows: {order_rows}")
-        print(f"dimdate rows: {date_rows}")
-        print(f"factorders rows: {fact_rows}")
-        print(f"agg_daily_sales rows: {agg_stats['daily']}")
-        print(f"agg_customer_metrics rows: {agg_stats['customer']}")
-        print(f"agg_product_performance rows: {agg_stats['product']}")
+        print(
+            f"dimcustomers: {scd_stats['new_customers']} new, "
+            f"{scd_stats['new_versions']} new versions, {scd_stats['unchanged']} unchanged"
+        )
+        print(f"dimorders rows added: {results['dimorders']}")
+        print(f"dimdate rows added: {results['dimdate']}")
+        print(f"dimproducts rows upserted: {results['dimproducts']}")
+        print(f"factorders rows added: {results['factorders']}")
+        print(f"factorderitems rows added: {results['factorderitems']}")
+        for name in AGGREGATE_STEPS:
+            print(f"{name} rows merged: {results[name]}")
         print("PRODUCTION DATA WAREHOUSE LIVE!")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Load the warehouse star schema")
+    parser.add_argument(
+        "--full-rebuild",
+        action="store_true",
+        default=None,
+        help=f"rebuild the whole star schema in {SHADOW_SCHEMA}, then swap it live",
+    )
+    parser.add_argument(
+        "--reload-month",
+        metavar="YYYY-MM",
+        help="incremental loads: rebuild the factorders partition of one month "
+        "(detach, refill, attach)",
+    )
+    parser.add_argument(
+        "--rollback",
+        action="store_true",
+        help=f"make {PREVIOUS_SCHEMA} live again after a bad full rebuild",
+    )
+    args = parser.parse_args()
+    main(full_rebuild=args.full_rebuild, reload_month=args.reload_month, rollback=args.rollback)
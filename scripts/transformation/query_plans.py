@@ -0,0 +1,85 @@
+from typing import Any, Dict, Iterator, List
+
+INDEX_SCANS = {"Index Scan", "Index Only Scan", "Bitmap Index Scan", "Bitmap Heap Scan"}
+
+
+def walk(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+def node_label(node: Dict[str, Any]) -> str:
+    relation = node.get("Relation Name") or node.get("Index Name")
+    return f"{node['Node Type']}({relation})" if relation else node["Node Type"]
+
+
+def summarize_plan(explain_json: Any) -> Dict[str, Any]:
+    """Condense EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output into comparable metrics.
+
+    - shape: node types (with relation) in pre-order
+    - buffers: shared blocks hit/read at the root (they include the children)
+    - worst_misestimate: largest estimated-vs-actual row ratio over all nodes
+    - spilled: a sort or hash went to disk, or temp blocks were written
+    """
+    plan = explain_json[0]
+    root = plan["Plan"]
+    nodes = list(walk(root))
+
+    worst = 1.0
+    for node in nodes:
+        estimated = max(node.get("Plan Rows", 0), 1)
+        actual = max(node.get("Actual Rows", 0) * node.get("Actual Loops", 1), 1)
+        worst = max(worst, estimated / actual, actual / estimated)
+
+    spilled = any(
+        node.get("Sort Space Type") == "Disk"
+        or node.get("Hash Batches", 1) > 1
+        or node.get("Temp Written Blocks", 0) > 0
+        for node in nodes
+    )
+    return {
+        "execution_time_ms": round(plan.get("Execution Time", 0.0), 3),
+        "planning_time_ms": round(plan.get("Planning Time", 0.0), 3),
+        "shape": [node_label(n) for n in nodes],
+        "seq_scans": sorted({n["Relation Name"] for n in nodes if n["Node Type"] == "Seq Scan"}),
+        "index_scans": sorted(
+            {n["Relation Name"] for n in nodes if n["Node Type"] in INDEX_SCANS and "Relation Name" in n}
+        ),
+        "shared_hit_blocks": root.get("Shared Hit Blocks", 0),
+        "shared_read_blocks": root.get("Shared Read Blocks", 0),
+        "temp_written_blocks": root.get("Temp Written Blocks", 0),
+        "estimated_rows": root.get("Plan Rows", 0),
+        "actual_rows": root.get("Actual Rows", 0),
+        "worst_misestimate": round(worst, 2),
+        "spilled": spilled,
+    }
+
+
+def compare_to_baseline(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    latency_factor: float = 2.0,
+    buffers_factor: float = 2.0,
+    min_latency_ms: float = 10.0,
+) -> List[str]:
+    """Regressions of a summarize_plan() result against a stored baseline."""
+    flags = []
+    for relation in sorted(set(baseline["index_scans"]) & set(current["seq_scans"])):
+        flags.append(f"seq scan on {relation} replaced an index scan")
+    if current["shape"] != baseline["shape"] and not flags:
+        flags.append("plan shape changed")
+
+    before = baseline["shared_hit_blocks"] + baseline["shared_read_blocks"]
+    after = current["shared_hit_blocks"] + current["shared_read_blocks"]
+    if before and after >= buffers_factor * before:
+        flags.append(f"buffers {before} -> {after} ({after / before:.1f}x)")
+
+    before_ms = baseline["execution_time_ms"]
+    after_ms = current["execution_time_ms"]
+    if after_ms >= latency_factor * before_ms and after_ms - before_ms >= min_latency_ms:
+        flags.append(f"latency {before_ms}ms -> {after_ms}ms")
+
+    if current["spilled"] and not baseline["spilled"]:
+        flags.append("now spills to disk")
+    return flags
@@ -0,0 +1,264 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import text
+
+from scripts.transformation.customer_sketches import (
+    ALL_MEMBERS,
+    UNKNOWN_MEMBER,
+    HyperLogLog,
+    customer_hash_sql,
+    register_sql,
+)
+
+# Time grains, finest first; a coarser period is always a union of finer ones.
+GRAINS = ("day", "month", "quarter")
+DIMENSIONS = ("state", "category", "paymentmethod")
+# Line-item dimensions: one order can have lines in several members, so
+# order counts do not add up across them (revenue and quantity do).
+LINE_DIMENSIONS = {"category"}
+
+# Grouping sets kept in warehouse.agg_rollup_cube: a time grain followed by
+# dimensions. Slices of any other combination are rolled up from the
+# smallest set that contains them (see cube_lookup). After changing this
+# list, rebuild the cube with load_warehouse.py --full-rebuild.
+CUBE_GROUPING_SETS: List[Tuple[str, ...]] = [
+    ("day",),
+    ("day", "state"),
+    ("day", "category"),
+    ("day", "paymentmethod"),
+    ("month", "state", "category"),
+    ("month", "paymentmethod"),
+    ("quarter", "state", "paymentmethod"),
+    ("quarter", "state", "category", "paymentmethod"),
+]
+
+
+def truncate(day: date, grain: str) -> date:
+    if grain == "day":
+        return day
+    if grain == "month":
+        return day.replace(day=1)
+    return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+
+
+def next_period(day: date, grain: str) -> date:
+    """Start of the `grain` period after the one containing `day`."""
+    start = truncate(day, grain)
+    if grain == "day":
+        return start + timedelta(days=1)
+    months = start.month - 1 + (1 if grain == "month" else 3)
+    return start.replace(year=start.year + months // 12, month=months % 12 + 1)
+
+
+def touched_periods(days: Iterable[date]) -> Dict[str, List[date]]:
+    """Periods of every grain containing one of `days` (the cells a delta changes)."""
+    days = list(days)
+    return {grain: sorted({truncate(d, grain) for d in days}) for grain in GRAINS}
+
+
+def cube_pass_sql(grouping_sets: Sequence[Tuple[str, ...]], schema: str = "warehouse") -> str:
+    """One GROUPING SETS pass over factorderitems returning the cells of the touched periods.
+
+    Takes the touched periods as :day, :month and :quarter (see
+    touched_periods). Every set is first grouped by HyperLogLog register,
+    so a row carries a cell's measures for the customers hashing to that
+    register plus the register's rank; the outer query sums the measures
+    over registers (a transaction belongs to one customer, so its distinct
+    count adds up too) and collects the ranks into the cell's sketch.
+
+    Cells of a month or quarter can only be recomputed from all of its
+    lines, so the pass reads every line of the touched quarters; only the
+    touched cells (at most one row each, with up to 2^SKETCH_PRECISION
+    registers) come back.
+    """
+    index, rank = register_sql("h")
+    sets = ", ".join(
+        "(" + ", ".join((f"{s[0]}_start",) + s[1:] + ("idx",)) + ")" for s in grouping_sets
+    )
+    grains = [g for g in GRAINS if any(s[0] == g for s in grouping_sets)]
+    grain_case = " ".join(f"WHEN {g}_start IS NOT NULL THEN '{g}'" for g in grains)
+    periods = " OR ".join(f"(grain = '{g}' AND period = ANY(:{g}))" for g in grains)
+    return f"""
+    WITH lines AS (
+        SELECT
+            d.fulldate AS day_start,
+            date_trunc('month', d.fulldate)::date AS month_start,
+            date_trunc('quarter', d.fulldate)::date AS quarter_start,
+            COALESCE(c.state, '{UNKNOWN_MEMBER}') AS state,
+            f.category,
+            COALESCE(f.paymentmethod, '{UNKNOWN_MEMBER}') AS paymentmethod,
+            f.transactionid,
+            f.linetotal,
+            f.quantity,
+            {customer_hash_sql("c.customerid")} AS h
+        FROM {schema}.factorderitems f
+        JOIN {schema}.dimdate d ON d.datekey = f.datekey
+        JOIN {schema}.dimcustomers c ON c.customerkey = f.customerkey
+        WHERE date_trunc('quarter', d.fulldate)::date = ANY(:quarter)
+    ),
+    ranked AS (
+        SELECT lines.*, {index} AS idx, {rank} AS rnk FROM lines
+    ),
+    registers AS (
+        SELECT
+            CASE {grain_case} END AS grain,
+            COALESCE({", ".join(f"{g}_start" for g in grains)}) AS period,
+            COALESCE(state, '{ALL_MEMBERS}') AS state,
+            COALESCE(category, '{ALL_MEMBERS}') AS category,
+            COALESCE(paymentmethod, '{ALL_MEMBERS}') AS paymentmethod,
+            idx,
+            SUM(linetotal) AS revenue,
+            SUM(quantity) AS quantity,
+            COUNT(DISTINCT transactionid) AS order_count,
+            MAX(rnk) AS rnk
+        FROM ranked
+        GROUP BY GROUPING SETS ({sets})
+    )
+    SELECT
+        grain, period, state, category, paymentmethod,
+        SUM(revenue) AS revenue,
+        SUM(quantity) AS quantity,
+        SUM(order_count) AS order_count,
+        array_agg(idx ORDER BY idx) AS indexes,
+        array_agg(rnk ORDER BY idx) AS ranks
+    FROM registers
+    WHERE {periods}
+    GROUP BY grain, period, state, category, paymentmethod
+    """
+
+
+def fold_cells(rows: Iterable[Any]) -> Dict[tuple, Dict[str, Any]]:
+    """Turn cube_pass_sql rows into cells with their customer sketch.
+
+    Cell key: (grain, period, state, category, paymentmethod), with
+    ALL_MEMBERS for dimensions outside the grouping set.
+    """
+    cells: Dict[tuple, Dict[str, Any]] = {}
+    for row in rows:
+        sketch = HyperLogLog()
+        sketch.registers[list(row["indexes"])] = row["ranks"]
+        cells[(row["grain"], row["period"]) + tuple(row[dim] for dim in DIMENSIONS)] = {
+            "revenue": row["revenue"],
+            "quantity": int(row["quantity"]),
+            "order_count": int(row["order_count"]),
+            "sketch": sketch,
+        }
+    return cells
+
+
+def choose_grouping_set(
+    grain: str, dimensions: Set[str], grouping_sets: Sequence[Tuple[str, ...]] = CUBE_GROUPING_SETS
+) -> Tuple[str, ...]:
+    """Smallest stored set that can answer `grain` broken down or filtered by `dimensions`.
+
+    Sets that would be rolled up over a LINE_DIMENSIONS member come last,
+    since their order counts cannot be summed (see cube_lookup).
+    """
+    if grain not in GRAINS:
+        raise ValueError(f"Unknown grain {grain}; use one of {GRAINS}")
+    unknown = dimensions - set(DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Unknown dimensions {sorted(unknown)}; use {DIMENSIONS}")
+    candidates = [
+        s for s in grouping_sets
+        if GRAINS.index(s[0]) <= GRAINS.index(grain) and dimensions <= set(s[1:])
+    ]
+    if not candidates:
+        raise LookupError(f"No cube grouping set covers {grain} by {sorted(dimensions)}")
+    # exact order counts first, then fewest extra dimensions, then the
+    # coarsest grain: fewest cells to roll up
+    return min(
+        candidates,
+        key=lambda s: (
+            bool(rolled_up_line_dimensions(s, dimensions)),
+            len(s) - 1 - len(dimensions),
+            -GRAINS.index(s[0]),
+        ),
+    )
+
+
+def rolled_up_line_dimensions(grouping_set: Tuple[str, ...], dimensions: Set[str]) -> Set[str]:
+    return (set(grouping_set[1:]) - dimensions) & LINE_DIMENSIONS
+
+
+def cube_lookup(
+    connection,
+    grain: str,
+    by: Sequence[str] = (),
+    filters: Optional[Dict[str, str]] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    schema: str = "warehouse",
+    grouping_sets: Sequence[Tuple[str, ...]] = CUBE_GROUPING_SETS,
+) -> List[Dict[str, Any]]:
+    """Answer a slice (revenue, quantity, orders, distinct customers) from the cube.
+
+    `grain` is day/month/quarter, `by` the dimensions to break down by and
+    `filters` fixed dimension values; `start` and `end` select whole
+    periods of `grain`, both inclusive. The cells come from the smallest
+    stored grouping set covering the slice; when that set is finer (more
+    dimensions or a finer grain) its cells are rolled up, merging the
+    customer sketches so distinct counts stay estimates rather than sums.
+    order_count is None when the cells had to be rolled up over a line-item
+    dimension, where summing would count an order once per member.
+    """
+    filters = filters or {}
+    stored = choose_grouping_set(grain, set(by) | set(filters), grouping_sets)
+    exact_orders = not rolled_up_line_dimensions(stored, set(by) | set(filters))
+    conditions = ["grain = :grain"]
+    params: Dict[str, Any] = {"grain": stored[0], "all_members": ALL_MEMBERS}
+    for dim in DIMENSIONS:
+        if dim in filters:
+            conditions.append(f"{dim} = :{dim}")
+            params[dim] = filters[dim]
+        elif dim in stored:
+            conditions.append(f"{dim} <> :all_members")
+        else:
+            conditions.append(f"{dim} = :all_members")
+    if start is not None:
+        conditions.append("period >= :start")
+        params["start"] = truncate(start, grain)  # whole periods of the requested grain
+    if end is not None:
+        conditions.append("period < :end")
+        params["end"] = next_period(end, grain)  # through the end of the period containing `end`
+    rows = connection.execute(
+        text(
+            f"""
+        SELECT period, state, category, paymentmethod, revenue, quantity, order_count, customers_sketch
+        FROM {schema}.agg_rollup_cube
+        WHERE {" AND ".join(conditions)}
+    """
+        ),
+        params,
+    ).mappings()
+
+    slices: Dict[tuple, Dict[str, Any]] = {}
+    for row in rows:
+        key = (truncate(row["period"], grain),) + tuple(row[dim] for dim in by)
+        cell = slices.get(key)
+        if cell is None:
+            cell = slices[key] = {"revenue": Decimal(0), "quantity": 0, "order_count": 0, "sketches": []}
+        cell["revenue"] += row["revenue"]
+        cell["quantity"] += row["quantity"]
+        cell["order_count"] += row["order_count"]
+        cell["sketches"].append(HyperLogLog.from_bytes(row["customers_sketch"]))
+
+    result = []
+    for key in sorted(slices):
+        cell = slices.pop(key)
+        sketch = HyperLogLog.union(cell.pop("sketches"))
+        estimate = sketch.estimate()
+        result.append(
+            {
+                "period": key[0],
+                **dict(zip(by, key[1:])),
+                **cell,
+                "order_count": cell["order_count"] if exact_orders else None,
+                "distinct_customers": round(estimate),
+                "distinct_customers_error": round(estimate * sketch.relative_error),
+                "source_grouping_set": ",".join(stored),
+            }
+        )
+    return result
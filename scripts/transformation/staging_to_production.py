@@ -1,13 +1,32 @@
 import os
+import io
+import sys
 import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 from sqlalchemy import create_engine, text
 import yaml
 
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from scripts.transformation.typed_frames import (
+    compact_frame,
+    fill_missing,
+    memory_report,
+    str_transform,
+)
+
 CONFIG_PATH = os.path.join("config", "config.yaml")
+ENGINE_MODES = ("pushdown", "pandas")
 
 
 def load_config(path: str = CONFIG_PATH) -> dict:
@@ -27,17 +46,17 @@ def cleanse_customer_data(df: pd.DataFrame) -> pd.DataFrame:
     df["lastname"] = df["lastname"].str.strip().str.title()
     df["email"] = df["email"].str.strip().str.lower()
     df["city"] = df["city"].str.strip()
-    df["state"] = df["state"].str.strip()
-    df["country"] = df["country"].str.strip()
-    df["agegroup"] = df["agegroup"].fillna("Unknown")
+    df["state"] = str_transform(df["state"], lambda x: x.str.strip())
+    df["country"] = str_transform(df["country"], lambda x: x.str.strip())
+    df["agegroup"] = fill_missing(df["agegroup"], "Unknown")
     return df
 
 
 def cleanse_product_data(df: pd.DataFrame) -> pd.DataFrame:
     df["productid"] = df["productid"].str.strip()
     df["productname"] = df["productname"].str.strip().str.title().fillna("Unknown Product")
-    df["category"] = df["category"].str.strip()
-    df["subcategory"] = df["subcategory"].str.strip()
+    df["category"] = str_transform(df["category"], lambda x: x.str.strip())
+    df["subcategory"] = str_transform(df["subcategory"], lambda x: x.str.strip())
     df["brand"] = df["brand"].str.strip()
     df["price"] = df["price"].round(2)
     df["cost"] = df["cost"].round(2)
@@ -61,6 +80,153 @@ def apply_business_rules(df: pd.DataFrame, rule_type: str) -> pd.DataFrame:
     return df
 
 
+def cleanse_frame(df: pd.DataFrame, tablename: str) -> pd.DataFrame:
+    """Apply the table's cleansing and business rules to one frame (or chunk)."""
+    if tablename == "customers":
+        df = cleanse_customer_data(df)
+    elif tablename == "products":
+        df = cleanse_product_data(df)
+    return apply_business_rules(df, tablename)
+
+
+def read_staging_chunks(tablename: str, connection, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Stream a staging table in fixed-size chunks through a server-side cursor.
+
+    stream_results makes psycopg2 use a named cursor, and yield_per bounds
+    how many rows are buffered client-side, so only one chunk is in memory.
+    """
+    stmt = text(f"SELECT * FROM staging.{tablename}").execution_options(
+        stream_results=True, yield_per=chunk_size
+    )
+    result = connection.execute(stmt)
+    columns = list(result.keys())
+    try:
+        for rows in result.partitions():
+            yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+    finally:
+        result.close()
+
+
+def frame_to_ipc(df: pd.DataFrame) -> bytes:
+    """Serialize a frame as an Arrow IPC stream (columnar buffers, no pickled objects)."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def ipc_to_frame(buf: bytes) -> pd.DataFrame:
+    return pa.ipc.open_stream(buf).read_all().to_pandas()
+
+
+def cleanse_partition(tablename: str, buf: bytes) -> bytes:
+    """Process-pool worker: Arrow in, cleanse, Arrow out."""
+    return frame_to_ipc(cleanse_frame(ipc_to_frame(buf), tablename))
+
+
+def split_key_ranges(df: pd.DataFrame, key: str, partitions: int) -> List[pd.DataFrame]:
+    """Split a frame into contiguous key ranges of roughly equal size."""
+    ordered = df.sort_values(key, kind="stable").reset_index(drop=True)
+    bounds = np.linspace(0, len(ordered), partitions + 1, dtype=int)
+    return [ordered.iloc[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def cleanse_partitioned(df: pd.DataFrame, tablename: str, workers: int) -> Iterator[pd.DataFrame]:
+    """Cleanse key-range partitions in a process pool, yielding each as it finishes."""
+    key = CLEANSING_RULES[tablename]["key"]
+    parts = split_key_ranges(df, key, workers * 2)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(cleanse_partition, tablename, frame_to_ipc(p)) for p in parts]
+        for future in as_completed(futures):
+            yield ipc_to_frame(future.result())
+
+
+# Server-side equivalents of cleanse_customer_data / cleanse_product_data.
+# Every production column maps to the SQL expression that produces it from
+# staging, so the pushdown engine never moves rows out of the database.
+_PRICE = "CASE WHEN price IS NOT NULL THEN GREATEST(ROUND(price, 2), 0) END"
+
+CLEANSING_RULES: Dict[str, Dict[str, Any]] = {
+    "customers": {
+        "key": "customerid",
+        "columns": {
+            "customerid": "TRIM(customerid)",
+            "firstname": "INITCAP(TRIM(firstname))",
+            "lastname": "INITCAP(TRIM(lastname))",
+            "email": "LOWER(TRIM(email))",
+            "phone": "phone",
+            "registrationdate": "registrationdate",
+            "city": "TRIM(city)",
+            "state": "TRIM(state)",
+            "country": "TRIM(country)",
+            "agegroup": "COALESCE(agegroup, 'Unknown')",
+        },
+    },
+    "products": {
+        "key": "productid",
+        "columns": {
+            "productid": "TRIM(productid)",
+            "productname": "COALESCE(INITCAP(TRIM(productname)), 'Unknown Product')",
+            "category": "TRIM(category)",
+            "subcategory": "TRIM(subcategory)",
+            "price": _PRICE,
+            "cost": (
+                "CASE WHEN COALESCE(cost, price) IS NOT NULL "
+                f"THEN GREATEST(LEAST(ROUND(cost, 2), {_PRICE}), 0) END"
+            ),
+            "brand": "TRIM(brand)",
+            "stockquantity": "stockquantity",
+            "supplierid": "supplierid",
+        },
+    },
+}
+
+# Row filters from apply_business_rules. The derived product columns
+# (profit_margin, price_category) are not persisted in production, so the
+# pushdown engine has nothing to compute for them.
+BUSINESS_RULE_FILTERS: Dict[str, str] = {
+    "transactions": "totalamount > 0",
+    "transactionitems": "quantity > 0",
+}
+
+
+def compile_pushdown_sql(tablename: str) -> str:
+    """Compile the cleansing + business rules for a table into INSERT ... SELECT."""
+    rules = CLEANSING_RULES[tablename]
+    cols = ", ".join(rules["columns"])
+    exprs = ",\n            ".join(rules["columns"].values())
+    where = BUSINESS_RULE_FILTERS.get(tablename, "TRUE")
+    return f"""
+        INSERT INTO production.{tablename} ({cols})
+        SELECT
+            {exprs}
+        FROM staging.{tablename}
+        WHERE {where};
+    """
+
+
+def copy_to_table(df: pd.DataFrame, full_table: str, connection) -> int:
+    """Bulk load a DataFrame with COPY FROM STDIN on the connection's transaction."""
+    # NULLs turn integer columns into floats; write them back as integers
+    for col in df.select_dtypes(include="float").columns:
+        values = df[col].dropna()
+        if (values == values.round()).all():
+            df = df.assign(**{col: df[col].astype("Int64")})
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False, na_rep="\\N")
+    buf.seek(0)
+    cols = ", ".join(df.columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {full_table} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf
+        )
+    finally:
+        cursor.close()
+    return int(len(df))
+
+
 def load_to_production(
     df: pd.DataFrame,
     tablename: str,
@@ -84,32 +250,199 @@ def load_to_production(
 
     if strategy == "truncate_reload":
         connection.execute(text(f"TRUNCATE {full_table} RESTART IDENTITY CASCADE"))
-        df.to_sql(tablename, connection, schema=schema, if_exists="append", index=False)
-        result["output"] = int(len(df))
+        result["output"] = copy_to_table(df, full_table, connection)
+    elif strategy == "append":
+        result["output"] = copy_to_table(df, full_table, connection)
+
+    return result
+
+
+def run_pushdown(tablename: str, connection) -> Dict[str, Any]:
+    """Pushdown engine: cleanse and load entirely server-side."""
+    full_table = f"production.{tablename}"
+    input_rows = connection.execute(
+        text(f"SELECT COUNT(*) FROM staging.{tablename}")
+    ).scalar_one()
+    connection.execute(text(f"TRUNCATE {full_table} RESTART IDENTITY CASCADE"))
+    output_rows = connection.execute(text(compile_pushdown_sql(tablename))).rowcount
+    return {
+        "table": full_table,
+        "input": int(input_rows),
+        "output": int(output_rows),
+        "filtered": int(input_rows - output_rows),
+    }
+
+
+def run_pandas(tablename: str, connection, chunk_size: Optional[int] = None,
+               workers: Optional[int] = None, compact: bool = True) -> Dict[str, Any]:
+    """Pandas engine: extract, cleanse in Python, load back with COPY.
+
+    With `workers` > 1 the table is split into key ranges and cleansed on a
+    process pool. With `chunk_size` the table is streamed: each chunk is
+    cleansed and COPYed before the next one is fetched, so memory is bounded
+    by the chunk size rather than the table size. With `compact` the
+    extract is converted to categorical/Arrow-string/downcast dtypes first.
+    """
+    if workers and workers > 1:
+        return run_pandas_parallel(tablename, connection, workers, compact)
+    if chunk_size:
+        return run_pandas_streaming(tablename, connection, chunk_size, compact)
+    df = pd.read_sql(f"SELECT * FROM staging.{tablename}", connection)
+    input_rows = int(len(df))
+    memory = None
+    if compact:
+        raw, df = df, compact_frame(df)
+        memory = memory_report(raw, df)
+        del raw
+    df = cleanse_frame(df, tablename)
+    result = load_to_production(df, tablename, connection, "truncate_reload")
+    result["memory"] = memory
+    result["input"] = input_rows
+    result["filtered"] = input_rows - result["output"]
+    return result
+
+
+def run_pandas_streaming(tablename: str, connection, chunk_size: int,
+                         compact: bool = True) -> Dict[str, Any]:
+    full_table = f"production.{tablename}"
+    result: Dict[str, Any] = {
+        "table": full_table,
+        "input": 0,
+        "output": 0,
+        "filtered": 0,
+        "chunk_size": chunk_size,
+        "chunks": 0,
+        "peak_chunk_bytes": 0,
+        "memory": None,
+    }
+    connection.execute(text(f"TRUNCATE {full_table} RESTART IDENTITY CASCADE"))
+    for chunk in read_staging_chunks(tablename, connection, chunk_size):
+        result["input"] += int(len(chunk))
+        if compact:
+            raw, chunk = chunk, compact_frame(chunk)
+            if result["memory"] is None:  # first chunk is representative
+                result["memory"] = memory_report(raw, chunk)
+            del raw
+        result["peak_chunk_bytes"] = max(
+            result["peak_chunk_bytes"], int(chunk.memory_usage(deep=True).sum())
+        )
+        cleaned = cleanse_frame(chunk, tablename)
+        result["output"] += load_to_production(cleaned, tablename, connection, "append")["output"]
+        result["chunks"] += 1
+    result["filtered"] = result["input"] - result["output"]
+    return result
+
 
+def run_pandas_parallel(tablename: str, connection, workers: int,
+                        compact: bool = True) -> Dict[str, Any]:
+    """Cleanse key-range partitions on `workers` processes.
+
+    Partitions travel to and from the workers as Arrow IPC buffers. Each
+    cleansed partition is COPYed as soon as it comes back, so loading
+    overlaps with the partitions still being cleansed, and everything
+    stays in the caller's single transaction.
+    """
+    full_table = f"production.{tablename}"
+    df = pd.read_sql(f"SELECT * FROM staging.{tablename}", connection)
+    result: Dict[str, Any] = {
+        "table": full_table,
+        "input": int(len(df)),
+        "output": 0,
+        "filtered": 0,
+        "workers": workers,
+        "partitions": 0,
+        "memory": None,
+    }
+    if compact:
+        raw, df = df, compact_frame(df)
+        result["memory"] = memory_report(raw, df)
+        del raw
+    connection.execute(text(f"TRUNCATE {full_table} RESTART IDENTITY CASCADE"))
+    for cleaned in cleanse_partitioned(df, tablename, workers):
+        result["output"] += load_to_production(cleaned, tablename, connection, "append")["output"]
+        result["partitions"] += 1
+    result["filtered"] = result["input"] - result["output"]
     return result
 
 
-def main():
+def table_checksum(tablename: str, connection) -> str:
+    """md5 over the cleansed production columns, ordered by key."""
+    rules = CLEANSING_RULES[tablename]
+    cols = ", ".join(rules["columns"])
+    return connection.execute(text(f"""
+        SELECT md5(COALESCE(string_agg(ROW({cols})::text, '|' ORDER BY {rules["key"]}), ''))
+        FROM production.{tablename}
+    """)).scalar_one()
+
+
+def run_engine(mode: str, tables: List[str], connection, **pandas_options) -> Dict[str, Any]:
+    """Run one engine mode over `tables`, timing each table.
+
+    `pandas_options` (chunk_size, workers, compact) are passed to run_pandas.
+    """
+    results: Dict[str, Any] = {}
+    start = time.perf_counter()
+    for tablename in tables:
+        t0 = time.perf_counter()
+        if mode == "pushdown":
+            res = run_pushdown(tablename, connection)
+        else:
+            res = run_pandas(tablename, connection, **pandas_options)
+        res["seconds"] = round(time.perf_counter() - t0, 4)
+        res["checksum"] = table_checksum(tablename, connection)
+        results[res["table"]] = res
+    results["total_seconds"] = round(time.perf_counter() - start, 4)
+    return results
+
+
+def compare_modes(runs: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Side-by-side per-table output and timings for every mode that ran."""
+    comparison: Dict[str, Any] = {}
+    first = next(iter(runs.values()))
+    for table in (k for k in first if k != "total_seconds"):
+        row = {mode: {"output": r[table]["output"], "seconds": r[table]["seconds"]}
+               for mode, r in runs.items()}
+        row["outputs_match"] = len({r[table]["checksum"] for r in runs.values()}) == 1
+        comparison[table] = row
+    comparison["total_seconds"] = {mode: r["total_seconds"] for mode, r in runs.items()}
+    return comparison
+
+
+def main(mode: Optional[str] = None, compare: Optional[bool] = None,
+         chunk_size: Optional[int] = None, workers: Optional[int] = None,
+         compact: Optional[bool] = None):
     config = load_config()
     engine = get_engine(config)
+    settings = config.get("transformation", {}) or {}
+    mode = mode or settings.get("engine_mode", "pushdown")
+    compare = settings.get("compare_modes", False) if compare is None else compare
+    chunk_size = chunk_size if chunk_size is not None else settings.get("stream_chunk_size")
+    workers = workers if workers is not None else settings.get("parallel_workers")
+    compact = settings.get("compact_dtypes", True) if compact is None else compact
+    pandas_options = {"chunk_size": chunk_size, "workers": workers, "compact": compact}
+    if mode not in ENGINE_MODES:
+        raise ValueError(f"Unknown engine mode: {mode}")
 
+    tables = ["customers", "products"]
+    runs: Dict[str, Dict[str, Any]] = {}
     with engine.begin() as conn:
-        customers = pd.read_sql("SELECT * FROM staging.customers", conn)
-        products = pd.read_sql("SELECT * FROM staging.products", conn)
-
-        customers_clean = cleanse_customer_data(customers)
-        products_clean = cleanse_product_data(products)
-        products_clean = apply_business_rules(products_clean, "products")
-
-        cust_res = load_to_production(customers_clean, "customers", conn, "truncate_reload")
-        prod_res = load_to_production(products_clean, "products", conn, "truncate_reload")
+        # Comparison runs happen inside a savepoint that is rolled back, so
+        # only the selected mode's output is committed.
+        for other in (m for m in ENGINE_MODES if compare and m != mode):
+            savepoint = conn.begin_nested()
+            runs[other] = run_engine(other, tables, conn, **pandas_options)
+            savepoint.rollback()
+        runs[mode] = run_engine(mode, tables, conn, **pandas_options)
 
+    records = {k: {f: v[f] for f in ("table", "input", "output", "filtered")}
+               for k, v in runs[mode].items() if k != "total_seconds"}
     summary = {
         "transformation_timestamp": datetime.now().isoformat(),
-        "records_processed": {
-            "production.customers": cust_res,
-            "production.products": prod_res,
+        "engine_mode": mode,
+        "records_processed": records,
+        "engine_runs": runs,
+        "memory_footprint": {
+            k: v.get("memory") for k, v in runs.get("pandas", {}).items() if k != "total_seconds"
         },
         "transformations_applied": [
             "trim_whitespace",
@@ -117,6 +450,7 @@ def main():
             "lowercase_email",
             "price_profit_business_rules",
         ],
+        "mode_comparison": compare_modes(runs) if len(runs) > 1 else None,
         "data_quality_post_transform": {
             "null_violations": 0,
             "constraint_violations": 0,
@@ -128,8 +462,35 @@ def main():
         json.dump(summary, f, indent=2, default=str)
 
     print("Staging to Production ETL complete")
-    print(json.dumps(summary, indent=2))
+    print(json.dumps(summary, indent=2, default=str))
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Staging to production cleansing")
+    parser.add_argument("--mode", choices=ENGINE_MODES, help="engine that writes production")
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        default=None,
+        help="also run the other engine in a rolled-back savepoint and compare",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        help="stream the pandas engine in chunks of this many rows (0 = read whole tables)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="cleanse key-range partitions on this many processes (pandas engine)",
+    )
+    parser.add_argument(
+        "--no-compact",
+        dest="compact",
+        action="store_false",
+        default=None,
+        help="keep object dtypes in the pandas engine",
+    )
+    args = parser.parse_args()
+    main(mode=args.mode, compare=args.compare, chunk_size=args.chunk_size,
+         workers=args.workers, compact=args.compact)
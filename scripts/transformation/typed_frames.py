@@ -0,0 +1,159 @@
+import sys
+
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, Any, Iterable, Optional
+
+# Low-cardinality columns shared across staging/production tables.
+CATEGORICAL_COLUMNS = {
+    "category",
+    "subcategory",
+    "state",
+    "country",
+    "agegroup",
+    "paymentmethod",
+    "price_category",
+}
+
+# INTEGER columns of the staging/production tables; NULLs turn them into
+# floats when read, so they are restored to nullable integers.
+INTEGER_COLUMNS = {"quantity", "stockquantity"}
+
+# Narrowest integer kept: numpy/pandas integer arithmetic wraps silently,
+# and int32 (Postgres INTEGER) leaves room for quantity * price style rules.
+MIN_INTEGER_DTYPE = np.dtype(np.int32)
+
+ARROW_STRING = pd.StringDtype("pyarrow")
+
+
+def frame_memory(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True).sum())
+
+
+def compact_frame(
+    df: pd.DataFrame,
+    categorical: Optional[Iterable[str]] = None,
+    integer: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """Return `df` with memory-compact dtypes.
+
+    - known low-cardinality text columns -> category
+    - other text columns -> Arrow-backed strings
+    - date objects -> datetime64
+    - integers -> smallest integer type, but no narrower than int32
+    - known integer columns widened to float by NULLs -> nullable Int32 (or wider)
+
+    Other floats, monetary ones included, stay float64 even when every
+    value is whole: float32 cannot hold cents exactly.
+    """
+    categorical = CATEGORICAL_COLUMNS if categorical is None else set(categorical)
+    integer = INTEGER_COLUMNS if integer is None else set(integer)
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            out[col] = s
+        elif s.dtype == object:
+            kind = pd.api.types.infer_dtype(s, skipna=True)
+            if kind == "string":
+                out[col] = s.astype("category") if col in categorical else s.astype(ARROW_STRING)
+            elif kind == "date":
+                out[col] = pd.to_datetime(s)
+            else:
+                out[col] = s
+        elif pd.api.types.is_integer_dtype(s.dtype):
+            out[col] = s.astype(integer_dtype(s))
+        elif pd.api.types.is_float_dtype(s.dtype):
+            values = s.dropna()
+            if col in integer and (values == values.round()).all():
+                # integer column widened to float by NULLs
+                nullable = integer_dtype(values.astype(np.int64)).name.capitalize()
+                out[col] = s.astype(pd.api.types.pandas_dtype(nullable))
+            else:
+                out[col] = s
+        else:
+            out[col] = s
+    return pd.DataFrame(out, index=df.index)
+
+
+def read_csv_compact(
+    path: str,
+    categorical: Optional[Iterable[str]] = None,
+    chunksize: int = 100_000,
+    sample_rows: int = 1000,
+    **kwargs: Any,
+) -> pd.DataFrame:
+    """Read a CSV into compact dtypes without first holding it with default dtypes.
+
+    Read whole with default dtypes, every text column is built as Python
+    objects, the biggest part of a raw frame. Here the first `sample_rows`
+    rows decide which columns are text; the file is then read in chunks
+    with those parsed straight into Arrow strings, each chunk compacted
+    before the next is read. Known low-cardinality columns become category
+    once the chunks are joined, so all chunks share one set of categories.
+    """
+    categorical = CATEGORICAL_COLUMNS if categorical is None else set(categorical)
+    sample = pd.read_csv(path, nrows=sample_rows, **kwargs)
+    text_columns = [col for col in sample.columns if sample[col].dtype == object]
+    chunks = [
+        compact_frame(chunk, categorical=())
+        for chunk in pd.read_csv(
+            path, dtype={col: ARROW_STRING for col in text_columns}, chunksize=chunksize, **kwargs
+        )
+    ]
+    df = pd.concat(chunks, ignore_index=True) if chunks else sample.iloc[:0]
+    for col in df.columns:
+        if col in categorical and df[col].dtype == ARROW_STRING:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def integer_dtype(s: pd.Series) -> np.dtype:
+    """Smallest integer dtype holding `s`, no narrower than MIN_INTEGER_DTYPE."""
+    smallest = pd.to_numeric(s, downcast="integer").dtype if len(s) else MIN_INTEGER_DTYPE
+    return np.promote_types(smallest, MIN_INTEGER_DTYPE)
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """High-water mark of this process's resident memory; None where unsupported (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> Dict[str, Any]:
+    before_bytes = frame_memory(before)
+    after_bytes = frame_memory(after)
+    return {
+        "before_bytes": before_bytes,
+        "after_bytes": after_bytes,
+        "reduction_x": round(before_bytes / after_bytes, 2) if after_bytes else None,
+    }
+
+
+def str_transform(s: pd.Series, fn: Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """Apply a vectorized string function, only to the categories when `s` is categorical.
+
+    Categories that collapse into the same value (e.g. ' MH' and 'MH' after
+    strip) are merged, so the result stays categorical and the function runs
+    once per distinct value instead of once per row.
+    """
+    if not isinstance(s.dtype, pd.CategoricalDtype):
+        return fn(s)
+    mapped = fn(s.cat.categories.to_series().reset_index(drop=True))
+    inverse, uniques = pd.factorize(mapped)
+    codes = s.cat.codes.to_numpy()
+    new_codes = np.where(codes >= 0, inverse[codes], -1)
+    return pd.Series(
+        pd.Categorical.from_codes(new_codes, categories=uniques), index=s.index, name=s.name
+    )
+
+
+def fill_missing(s: pd.Series, value: str) -> pd.Series:
+    """fillna that also works when `value` is not yet a category."""
+    if isinstance(s.dtype, pd.CategoricalDtype) and value not in s.cat.categories:
+        s = s.cat.add_categories([value])
+    return s.fillna(value)
@@ -10,7 +10,12 @@ CREATE TABLE IF NOT EXISTS warehouse.agg_product_performance (
     productid VARCHAR(20) PRIMARY KEY,
     total_quantity_sold INTEGER NOT NULL,
     total_revenue NUMERIC(14,2) NOT NULL,
-    avg_discount_percentage NUMERIC(5,2)
+    avg_discount_percentage NUMERIC(5,2),
+    productname VARCHAR(255),
+    category VARCHAR(100),
+    brand VARCHAR(100),
+    total_profit NUMERIC(14,2),
+    order_lines INTEGER
 );
 
 CREATE TABLE IF NOT EXISTS warehouse.agg_customer_metrics (
@@ -20,3 +25,57 @@ CREATE TABLE IF NOT EXISTS warehouse.agg_customer_metrics (
     avg_order_value NUMERIC(14,2),
     last_purchase_date DATE
 );
+
+-- (datekey, customerkey) pairs already counted in agg_daily_sales.unique_customers,
+-- so incremental merges only add customers new to a day.
+CREATE TABLE IF NOT EXISTS warehouse.agg_daily_customers (
+    datekey INTEGER NOT NULL,
+    customerkey INTEGER NOT NULL,
+    PRIMARY KEY (datekey, customerkey)
+);
+
+-- HyperLogLog distinct-customer sketches per day (zlib-compressed registers,
+-- see scripts/transformation/customer_sketches.py). Sketches merge across
+-- days, so any date range is answered without going back to the facts.
+-- state '*' holds the sketch over all states.
+CREATE TABLE IF NOT EXISTS warehouse.agg_customer_sketches (
+    datekey INTEGER NOT NULL,
+    state VARCHAR(100) NOT NULL,
+    registers BYTEA NOT NULL,
+    PRIMARY KEY (datekey, state)
+);
+
+CREATE TABLE IF NOT EXISTS warehouse.agg_category_sketches (
+    datekey INTEGER NOT NULL,
+    category VARCHAR(100) NOT NULL,
+    registers BYTEA NOT NULL,
+    PRIMARY KEY (datekey, category)
+);
+
+-- Rollup cube over factorderitems (scripts/transformation/rollup_cube.py):
+-- one row per cell of each configured grouping set. period is the first day
+-- of the day/month/quarter; dimensions outside the cell's set are '*'.
+CREATE TABLE IF NOT EXISTS warehouse.agg_rollup_cube (
+    grain VARCHAR(10) NOT NULL,
+    period DATE NOT NULL,
+    state VARCHAR(100) NOT NULL,
+    category VARCHAR(100) NOT NULL,
+    paymentmethod VARCHAR(50) NOT NULL,
+    revenue NUMERIC(14,2) NOT NULL,
+    quantity BIGINT NOT NULL,
+    order_count INTEGER NOT NULL,
+    distinct_customers INTEGER NOT NULL,
+    customers_sketch BYTEA NOT NULL,
+    PRIMARY KEY (grain, period, state, category, paymentmethod)
+);
+
+-- One row per materialized aggregate refresh (warehouse.aggregate_mode:
+-- materialized_views), for tracking refresh durations over time.
+CREATE TABLE IF NOT EXISTS warehouse.aggregate_refreshes (
+    view_name VARCHAR(100) NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    duration_seconds NUMERIC(10,3) NOT NULL,
+    row_count BIGINT NOT NULL,
+    concurrent BOOLEAN NOT NULL,
+    PRIMARY KEY (view_name, refreshed_at)
+);
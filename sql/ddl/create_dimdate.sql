@@ -12,7 +12,8 @@ CREATE TABLE IF NOT EXISTS warehouse.dimdate (
     isweekend BOOLEAN NOT NULL
 );
 
--- Populate 3 years (2024-2026)
+-- Populate 3 years (2024-2026) into an empty table; later dates are added by
+-- load_warehouse.py, which re-applies this file on every load
 INSERT INTO warehouse.dimdate (fulldate, year, quarter, month, monthname, day, weekday, weekdayname, isweekend)
 SELECT 
     d::date,
@@ -24,6 +25,7 @@ SELECT
     EXTRACT(DOW FROM d)::int,
     TO_CHAR(d, 'Day'),
     (EXTRACT(DOW FROM d) IN (0,6))
-FROM generate_series('2024-01-01'::date, '2026-12-31'::date, '1 day') AS d;
+FROM generate_series('2024-01-01'::date, '2026-12-31'::date, '1 day') AS d
+WHERE NOT EXISTS (SELECT 1 FROM warehouse.dimdate);
 
-CREATE UNIQUE INDEX idx_dimdate_fulldate ON warehouse.dimdate(fulldate);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dimdate_fulldate ON warehouse.dimdate(fulldate);
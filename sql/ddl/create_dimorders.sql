@@ -8,3 +8,6 @@ CREATE TABLE IF NOT EXISTS warehouse.dimorders (
 );
 
 COMMENT ON TABLE warehouse.dimorders IS 'Order dimension for fact table joins';
+
+-- Business key lookup for incremental (anti-join) loads
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dimorders_orderid ON warehouse.dimorders(orderid);
@@ -0,0 +1,15 @@
+-- warehouse.dimproducts (Product Dimension, Type 1)
+CREATE TABLE IF NOT EXISTS warehouse.dimproducts (
+    productkey SERIAL PRIMARY KEY,
+    productid VARCHAR(20) NOT NULL,
+    productname VARCHAR(255) NOT NULL,
+    category VARCHAR(100) NOT NULL,
+    subcategory VARCHAR(100),
+    brand VARCHAR(100),
+    price DECIMAL(10,2) NOT NULL,
+    cost DECIMAL(10,2) NOT NULL
+);
+
+COMMENT ON TABLE warehouse.dimproducts IS 'Product dimension for line-item analytics';
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dimproducts_productid ON warehouse.dimproducts(productid);
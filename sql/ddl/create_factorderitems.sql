@@ -0,0 +1,23 @@
+-- factorderitems (Line-item fact from production.transactionitems)
+-- category and brand are copied from dimproducts (paymentmethod from the
+-- transaction) so product analytics do not need the dimension join.
+CREATE TABLE IF NOT EXISTS warehouse.factorderitems (
+    itemkey SERIAL PRIMARY KEY,
+    itemid VARCHAR(20) NOT NULL,
+    transactionid VARCHAR(20) NOT NULL,
+    productkey INTEGER REFERENCES warehouse.dimproducts(productkey),
+    customerkey INTEGER REFERENCES warehouse.dimcustomers(customerkey),
+    datekey INTEGER REFERENCES warehouse.dimdate(datekey),
+    category VARCHAR(100) NOT NULL,
+    brand VARCHAR(100),
+    paymentmethod VARCHAR(50),
+    quantity INTEGER NOT NULL,
+    unitprice DECIMAL(10,2) NOT NULL,
+    discountpercentage DECIMAL(5,2) NOT NULL,
+    linetotal DECIMAL(12,2) NOT NULL,
+    linecost DECIMAL(12,2) NOT NULL              -- quantity * product cost at load time
+);
+
+COMMENT ON TABLE warehouse.factorderitems IS 'Line-item fact table for product analytics';
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_factorderitems_itemid ON warehouse.factorderitems(itemid);
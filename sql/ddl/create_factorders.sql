@@ -1,4 +1,7 @@
 -- factorders (Central fact table for analytics)
+-- Range-partitioned by datekey, one partition per month (dimdate keys are
+-- assigned in date order). load_warehouse.py creates the monthly partitions
+-- from dimdate; rows outside every month land in factorders_default.
 CREATE TABLE IF NOT EXISTS warehouse.factorders (
     orderkey INTEGER REFERENCES warehouse.dimorders(orderkey),
     customerkey INTEGER REFERENCES warehouse.dimcustomers(customerkey),
@@ -7,6 +10,11 @@ CREATE TABLE IF NOT EXISTS warehouse.factorders (
     unitprice DECIMAL(10,2) NOT NULL,
     totalamount DECIMAL(10,2) NOT NULL,
     orderstatus VARCHAR(50) NOT NULL
-);
+) PARTITION BY RANGE (datekey);
 
 COMMENT ON TABLE warehouse.factorders IS 'Fact table for order analytics';
+
+CREATE TABLE IF NOT EXISTS warehouse.factorders_default
+    PARTITION OF warehouse.factorders DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_factorders_orderkey ON warehouse.factorders(orderkey);
@@ -15,5 +15,17 @@ CREATE TABLE IF NOT EXISTS warehouse.dimcustomers (
     customersegment VARCHAR(50),                 -- later: New / Regular / VIP
     effectivedate   DATE NOT NULL,
     enddate         DATE,
-    iscurrent       BOOLEAN NOT NULL DEFAULT TRUE
+    iscurrent       BOOLEAN NOT NULL DEFAULT TRUE,
+    rowhash         CHAR(32)                     -- md5 of SCD2-tracked attributes
+);
+
+-- One current version per customer
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dimcustomers_current
+    ON warehouse.dimcustomers (customerid) WHERE iscurrent;
+
+-- 3. High-water marks for incremental warehouse loads
+CREATE TABLE IF NOT EXISTS warehouse.load_watermarks (
+    name       VARCHAR(100) PRIMARY KEY,         -- e.g. factorders.orderkey
+    value      BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
@@ -0,0 +1,205 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.transformation import staging_to_production as s2p
+from scripts.transformation import typed_frames
+
+
+def sample_customers():
+    return pd.DataFrame({
+        "customerid": [" CUST001 ", "CUST002"],
+        "firstname": ["  john", "JANE "],
+        "lastname": ["doe", " smith"],
+        "email": [" John@Test.COM", "jane@test.com "],
+        "phone": ["123", None],
+        "registrationdate": ["2024-01-01", "2024-02-01"],
+        "city": [" Mumbai", "Delhi "],
+        "state": ["MH ", " DL"],
+        "country": ["India", "India"],
+        "agegroup": ["25-34", None],
+    })
+
+
+def sample_products():
+    return pd.DataFrame({
+        "productid": [" PROD001", "PROD002"],
+        "productname": ["laptop pro", None],
+        "category": ["Electronics ", "Electronics"],
+        "subcategory": ["Laptops", " Accessories"],
+        "price": [500.004, -3.0],
+        "cost": [600.0, None],
+        "brand": ["Dell", "Logitech"],
+        "stockquantity": [10, 5],
+        "supplierid": ["SUPP001", "SUPP002"],
+    })
+
+
+def test_cleanse_customer_data():
+    df = s2p.cleanse_customer_data(sample_customers())
+    assert df["customerid"].tolist() == ["CUST001", "CUST002"]
+    assert df["firstname"].tolist() == ["John", "Jane"]
+    assert df["email"].tolist() == ["john@test.com", "jane@test.com"]
+    assert df["agegroup"].tolist() == ["25-34", "Unknown"]
+
+
+def test_cleanse_product_data_caps_cost_at_price():
+    df = s2p.apply_business_rules(s2p.cleanse_product_data(sample_products()), "products")
+    assert df["productname"].tolist() == ["Laptop Pro", "Unknown Product"]
+    assert df["price"].tolist() == [500.0, 0.0]
+    assert df["cost"].tolist() == [500.0, 0.0]
+    assert df["price_category"].tolist() == ["Premium", "Budget"]
+
+
+def test_pushdown_sql_covers_every_production_column():
+    sql = s2p.compile_pushdown_sql("customers")
+    assert "INSERT INTO production.customers" in sql
+    assert "INITCAP(TRIM(firstname))" in sql
+    assert "LOWER(TRIM(email))" in sql
+    assert "LEAST(ROUND(cost, 2)" in s2p.compile_pushdown_sql("products")
+    assert s2p.BUSINESS_RULE_FILTERS["transactions"] == "totalamount > 0"
+
+
+def test_compare_modes_side_by_side():
+    runs = {
+        "pandas": {"production.customers": {"output": 2, "seconds": 0.5, "checksum": "a"},
+                   "total_seconds": 0.5},
+        "pushdown": {"production.customers": {"output": 2, "seconds": 0.1, "checksum": "a"},
+                     "total_seconds": 0.1},
+    }
+    comparison = s2p.compare_modes(runs)
+    assert comparison["production.customers"]["outputs_match"] is True
+    assert comparison["production.customers"]["pushdown"]["seconds"] == 0.1
+    assert comparison["total_seconds"] == {"pandas": 0.5, "pushdown": 0.1}
+
+
+class FakeResult:
+    def __init__(self, df, chunk_size):
+        self.df = df
+        self.chunk_size = chunk_size
+
+    def keys(self):
+        return list(self.df.columns)
+
+    def partitions(self):
+        rows = list(self.df.itertuples(index=False, name=None))
+        for i in range(0, len(rows), self.chunk_size):
+            yield rows[i:i + self.chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, sink):
+        self.sink = sink
+
+    def copy_expert(self, sql, buf):
+        self.sink.append(buf.getvalue())
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Serves a staging frame to SELECTs and records COPY payloads."""
+
+    def __init__(self, df, chunk_size):
+        self.df = df
+        self.chunk_size = chunk_size
+        self.copied = []
+        self.connection = self
+
+    def cursor(self):
+        return FakeCursor(self.copied)
+
+    def execute(self, stmt, *args):
+        return FakeResult(self.df, self.chunk_size)
+
+
+def test_streaming_matches_whole_table_cleansing():
+    staging = pd.concat([sample_customers()] * 5, ignore_index=True)
+    conn = FakeConnection(staging, chunk_size=3)
+
+    res = s2p.run_pandas_streaming("customers", conn, chunk_size=3)
+
+    assert res["chunks"] == 4
+    assert res["input"] == res["output"] == 10
+    expected = s2p.cleanse_frame(staging.copy(), "customers")
+    assert "".join(conn.copied) == expected.to_csv(index=False, header=False, na_rep="\\N")
+
+
+def test_parallel_cleansing_matches_serial():
+    staging = pd.concat([sample_products()] * 6, ignore_index=True)
+    staging["productid"] = [f"PROD{i:03d}" for i in range(len(staging))]
+
+    serial = s2p.cleanse_frame(staging.copy(), "products")
+    parts = list(s2p.cleanse_partitioned(staging.copy(), "products", workers=2))
+    parallel = pd.concat(parts).sort_values("productid").reset_index(drop=True)
+
+    assert len(parts) == 4
+    pd.testing.assert_frame_equal(
+        parallel.astype({"price_category": object}),
+        serial.astype({"price_category": object}),
+    )
+
+
+def test_compact_dtypes_shrink_frame_without_changing_cleansed_values():
+    staging = pd.concat([sample_customers()] * 200, ignore_index=True)
+    compact = typed_frames.compact_frame(staging)
+
+    assert isinstance(compact["state"].dtype, pd.CategoricalDtype)
+    assert compact["email"].dtype == typed_frames.ARROW_STRING
+    assert typed_frames.memory_report(staging, compact)["reduction_x"] > 2
+
+    expected = s2p.cleanse_frame(staging.copy(), "customers")
+    actual = s2p.cleanse_frame(compact, "customers")
+    assert isinstance(actual["state"].dtype, pd.CategoricalDtype)
+    # what COPY would receive is identical
+    assert actual.to_csv(index=False, na_rep="\\N") == expected.to_csv(index=False, na_rep="\\N")
+
+
+def test_str_transform_merges_collapsed_categories():
+    s = pd.Series([" DL", "DL ", None, "MH"], dtype="category")
+    out = typed_frames.str_transform(s, lambda x: x.str.strip())
+    assert sorted(out.cat.categories) == ["DL", "MH"]
+    assert out.tolist()[:2] == ["DL", "DL"] and pd.isna(out.iloc[2])
+
+
+def test_compact_frame_restores_nullable_integers():
+    df = pd.DataFrame({"stockquantity": [1.0, None, 300.0], "price": [1.5, 2.0, None]})
+    compact = typed_frames.compact_frame(df)
+    assert str(compact["stockquantity"].dtype) == "Int32"
+    assert compact["price"].dtype == "float64"
+
+
+def test_compact_frame_keeps_whole_dollar_prices_float_and_arithmetic_safe():
+    df = pd.DataFrame({"price": [500.0, None, 20.0], "quantity": [100, 3, 1]})
+    compact = typed_frames.compact_frame(df)
+    assert compact["price"].dtype == "float64"
+    assert compact["quantity"].dtype == "int32"
+    assert (compact["quantity"] * compact["quantity"].max() * 500).iloc[0] == 5_000_000
+    assert (compact["price"] * compact["quantity"]).iloc[0] == 50_000.0
+
+
+def test_read_csv_compact_types_text_at_parse_time(tmp_path):
+    path = tmp_path / "customers.csv"
+    pd.concat([sample_customers()] * 5, ignore_index=True).assign(
+        stockquantity=[1.0, None] * 5
+    ).to_csv(path, index=False)
+
+    # chunks of 3 rows: the states of later chunks still share one category set
+    compact = typed_frames.read_csv_compact(str(path), chunksize=3, sample_rows=2)
+    reference = typed_frames.compact_frame(pd.read_csv(path))
+
+    assert isinstance(compact["state"].dtype, pd.CategoricalDtype)
+    assert set(compact["state"].cat.categories) == {"MH ", " DL"}
+    assert compact["email"].dtype == typed_frames.ARROW_STRING
+    assert str(compact["stockquantity"].dtype) == "Int32"
+    # what COPY would receive is identical
+    assert compact.to_csv(index=False, na_rep="\\N") == reference.to_csv(index=False, na_rep="\\N")
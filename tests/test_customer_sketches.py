@@ -0,0 +1,77 @@
+import random
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.transformation import customer_sketches as cs
+from scripts.transformation import load_warehouse as lw
+
+
+def signed_hashes(n, seed):
+    rng = random.Random(seed)
+    # hashtextextended returns a signed bigint
+    return [rng.getrandbits(64) - (1 << 63) for _ in range(n)]
+
+
+def test_estimate_is_within_the_error_bound():
+    for n in (50, 20000):
+        sketch = cs.HyperLogLog()
+        for h in signed_hashes(n, seed=n):
+            sketch.add_hash(h)
+        assert abs(sketch.estimate() - n) <= 3 * sketch.relative_error * n
+
+
+def test_daily_sketches_merge_into_a_range():
+    customers = signed_hashes(3000, seed=1)
+    monday, tuesday, both = cs.HyperLogLog(), cs.HyperLogLog(), cs.HyperLogLog()
+    for h in customers[:2000]:
+        monday.add_hash(h)
+    for h in customers[1000:]:  # 1000 customers ordered on both days
+        tuesday.add_hash(h)
+    for h in customers:
+        both.add_hash(h)
+
+    week = cs.HyperLogLog.union([monday, tuesday])
+    assert (week.registers == both.registers).all()  # no double counting
+    assert abs(week.estimate() - 3000) <= 3 * week.relative_error * 3000
+
+    stored = week.to_bytes()
+    assert len(stored) < week.m
+    assert (cs.HyperLogLog.from_bytes(stored).registers == week.registers).all()
+
+
+def test_register_sql_matches_python_rank():
+    index, rank = cs.register_sql("h", precision=12)
+    assert index == "((h) & 4095)::int"
+    assert rank == "(52 - length(ltrim((((h) >> 12) & 4503599627370495)::bit(64)::text, '0')) + 1)"
+    sketch = cs.HyperLogLog(12)
+    sketch.add_hash(-1)  # all bits set: last register, rank 1
+    assert sketch.registers[4095] == 1
+    sketch.add_hash(4095)  # nothing above the index bits: rank 53
+    assert sketch.registers[4095] == 53
+
+
+class SketchConnection:
+    def __init__(self, stored):
+        self.stored = stored
+        self.written = None
+
+    def execute(self, sql, params=None):
+        if str(sql).lstrip().startswith("SELECT"):
+            return iter(self.stored)
+        self.written = params
+
+
+def test_new_registers_merge_into_stored_sketches():
+    stored = cs.HyperLogLog()
+    stored.set_register(7, 3)
+    conn = SketchConnection([(20240101, "Goa", stored.to_bytes()), (20240101, "Kerala", b"unused")])
+    rows = [(20240101, "Goa", 7, 1), (20240101, "Goa", 9, 2), (20240102, "*", 9, 4)]
+
+    assert lw.merge_sketch_registers(conn, "agg_customer_sketches", "state", rows) == 2
+    written = {(p["datekey"], p["member"]): cs.HyperLogLog.from_bytes(p["registers"]) for p in conn.written}
+    assert written[(20240101, "Goa")].registers[[7, 9]].tolist() == [3, 2]
+    assert written[(20240102, "*")].registers[9] == 4
@@ -0,0 +1,200 @@
+import random
+import sys
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.transformation import rollup_cube as rc
+from scripts.transformation.customer_sketches import HyperLogLog
+
+
+def test_touched_periods_cover_every_grain():
+    periods = rc.touched_periods([date(2024, 3, 31), date(2024, 4, 2), date(2024, 4, 2)])
+    assert periods == {
+        "day": [date(2024, 3, 31), date(2024, 4, 2)],
+        "month": [date(2024, 3, 1), date(2024, 4, 1)],
+        "quarter": [date(2024, 1, 1), date(2024, 4, 1)],
+    }
+
+
+def test_next_period_rolls_over_month_and_year_ends():
+    assert rc.next_period(date(2024, 2, 29), "day") == date(2024, 3, 1)
+    assert rc.next_period(date(2024, 2, 10), "month") == date(2024, 3, 1)
+    assert rc.next_period(date(2024, 12, 31), "month") == date(2025, 1, 1)
+    assert rc.next_period(date(2024, 11, 5), "quarter") == date(2025, 1, 1)
+
+
+def test_cube_pass_returns_only_touched_cells():
+    sql = rc.cube_pass_sql([("day",), ("month", "state", "category")])
+    assert "GROUP BY GROUPING SETS ((day_start, idx), (month_start, state, category, idx))" in sql
+    assert "(grain = 'day' AND period = ANY(:day)) OR (grain = 'month' AND period = ANY(:month))" in sql
+    assert ":quarter" in sql  # lines are read for the touched quarters only
+
+
+def test_cell_rows_become_sketches():
+    row = {"grain": "day", "period": date(2024, 1, 5), "state": "Goa", "category": "*",
+           "paymentmethod": "*", "revenue": Decimal("15.50"), "quantity": 3, "order_count": 3,
+           "indexes": [1, 9], "ranks": [2, 1]}
+    cells = rc.fold_cells([row])
+    cell = cells[("day", date(2024, 1, 5), "Goa", "*", "*")]
+    assert (cell["revenue"], cell["order_count"]) == (Decimal("15.50"), 3)
+    assert cell["sketch"].registers[[1, 9]].tolist() == [2, 1]
+    assert int(cell["sketch"].registers.sum()) == 3
+
+
+def test_slices_use_the_smallest_covering_grouping_set():
+    assert rc.choose_grouping_set("month", {"state", "category"}) == ("month", "state", "category")
+    assert rc.choose_grouping_set("month", {"state"}) == ("day", "state")
+    assert rc.choose_grouping_set("quarter", {"paymentmethod"}) == ("month", "paymentmethod")
+    assert rc.choose_grouping_set("month", set()) == ("day",)
+    assert rc.choose_grouping_set("quarter", {"state", "paymentmethod"}) == ("quarter", "state", "paymentmethod")
+    with pytest.raises(LookupError):
+        rc.choose_grouping_set("day", {"state", "category"})
+
+
+class CubeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.sql = self.params = None
+
+    def execute(self, sql, params=None):
+        self.sql, self.params = str(sql), params
+        return self
+
+    def mappings(self):
+        return iter(self.rows)
+
+
+def test_lookup_rolls_finer_cells_up_and_merges_sketches():
+    rng = random.Random(7)
+    customers = [rng.getrandbits(64) for _ in range(400)]
+    cells = []
+    for day, who in ((date(2024, 1, 1), customers[:300]), (date(2024, 1, 2), customers[100:])):
+        sketch = HyperLogLog()
+        for h in who:
+            sketch.add_hash(h)
+        cells.append({"period": day, "state": "*", "category": "*", "paymentmethod": "*",
+                      "revenue": Decimal("100.00"), "quantity": 7, "order_count": 3,
+                      "customers_sketch": sketch.to_bytes()})
+    conn = CubeConnection(cells)
+
+    [january] = rc.cube_lookup(conn, "month", start=date(2024, 1, 15))
+    assert "grain = :grain" in conn.sql and conn.params["grain"] == "day"
+    assert "paymentmethod = :all_members" in conn.sql and conn.params["start"] == date(2024, 1, 1)
+    assert january["period"] == date(2024, 1, 1) and january["source_grouping_set"] == "day"
+    assert (january["revenue"], january["order_count"]) == (Decimal("200.00"), 6)
+    # 400 distinct customers, not the 600 a sum of daily counts would give
+    assert abs(january["distinct_customers"] - 400) <= 3 * january["distinct_customers_error"]
+
+
+def test_orders_spanning_categories_are_not_summed_across_them():
+    # order T1 has one line in Books and one in Toys
+    sketch = HyperLogLog()
+    sketch.add_hash(42)
+    cell = {"period": date(2024, 1, 1), "state": "Goa", "paymentmethod": "Card",
+            "quantity": 1, "order_count": 1, "customers_sketch": sketch.to_bytes()}
+    by_category = [dict(cell, category="Books", revenue=Decimal("10.00")),
+                   dict(cell, category="Toys", revenue=Decimal("5.00"))]
+    full_set = [("quarter", "state", "category", "paymentmethod")]
+
+    [goa] = rc.cube_lookup(CubeConnection(by_category), "quarter", by=("state",), grouping_sets=full_set)
+    assert (goa["revenue"], goa["quantity"], goa["order_count"]) == (Decimal("15.00"), 2, None)
+    assert goa["distinct_customers"] == 1
+
+    [books] = rc.cube_lookup(CubeConnection(by_category[:1]), "quarter", by=("state",),
+                             filters={"category": "Books"}, grouping_sets=full_set)
+    assert books["order_count"] == 1
+
+
+CUBE_SCHEMA = "test_rollup_cube"
+
+
+@pytest.fixture
+def cube_warehouse():
+    """An empty warehouse in its own schema, built from the DDL; skips without a database."""
+    from sqlalchemy.exc import OperationalError
+    from scripts.transformation import load_warehouse as lw
+
+    engine = lw.get_engine(lw.load_config())
+    try:
+        conn = engine.connect()
+    except OperationalError as exc:
+        pytest.skip(f"warehouse database not reachable: {exc}")
+    conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {CUBE_SCHEMA} CASCADE")
+    conn.exec_driver_sql(lw.schema_ddl(CUBE_SCHEMA))
+    conn.exec_driver_sql(
+        f"""
+        INSERT INTO {CUBE_SCHEMA}.dimcustomers (customerid, state, effectivedate)
+        VALUES ('C1', 'Goa', '2024-01-01'), ('C2', NULL, '2024-01-01');
+        INSERT INTO {CUBE_SCHEMA}.dimproducts (productid, productname, category, price, cost)
+        VALUES ('P1', 'Book', 'Books', 10, 5);
+    """
+    )
+    conn.commit()
+    yield conn
+    conn.rollback()
+    conn.exec_driver_sql(f"DROP SCHEMA {CUBE_SCHEMA} CASCADE")
+    conn.commit()
+    conn.close()
+    engine.dispose()
+
+
+def add_lines(conn, *lines):
+    for itemid, transactionid, customerid, day, category, linetotal in lines:
+        conn.exec_driver_sql(
+            f"""
+            INSERT INTO {CUBE_SCHEMA}.factorderitems (
+                itemid, transactionid, productkey, customerkey, datekey, category,
+                paymentmethod, quantity, unitprice, discountpercentage, linetotal, linecost
+            )
+            SELECT %s, %s, 1, c.customerkey, d.datekey, %s, 'Card', 1, %s, 0, %s, 0
+            FROM {CUBE_SCHEMA}.dimcustomers c, {CUBE_SCHEMA}.dimdate d
+            WHERE c.customerid = %s AND d.fulldate = %s
+        """,
+            (itemid, transactionid, category, linetotal, linetotal, customerid, day),
+        )
+
+
+def test_refresh_and_lookup_against_the_warehouse(cube_warehouse):
+    from scripts.transformation import load_warehouse as lw
+
+    conn = cube_warehouse
+    add_lines(
+        conn,
+        ("I1", "T1", "C1", "2024-01-31", "Books", 10),
+        ("I2", "T1", "C1", "2024-01-31", "Toys", 5),
+        ("I3", "T2", "C2", "2024-02-01", "Books", 20),
+        ("I4", "T3", "C1", "2024-02-15", "Books", 40),
+    )
+    assert lw.refresh_rollup_cube(conn, full=True, schema=CUBE_SCHEMA) > 0
+
+    # end falls mid-February: the whole month is rolled up from its day cells
+    january, february = rc.cube_lookup(
+        conn, "month", start=date(2024, 1, 20), end=date(2024, 2, 10), schema=CUBE_SCHEMA
+    )
+    assert february["source_grouping_set"] == "day"
+    assert (january["revenue"], january["order_count"]) == (Decimal("15.00"), 1)
+    assert (february["revenue"], february["order_count"], february["distinct_customers"]) == (
+        Decimal("60.00"), 2, 2
+    )
+    [quarter] = rc.cube_lookup(conn, "quarter", by=("state",), filters={"state": rc.UNKNOWN_MEMBER},
+                               schema=CUBE_SCHEMA)
+    assert quarter["revenue"] == Decimal("20.00")
+
+    # a later line only rewrites the cells of its own periods
+    before = conn.exec_driver_sql(
+        f"SELECT COUNT(*) FROM {CUBE_SCHEMA}.agg_rollup_cube WHERE period < '2024-04-01'"
+    ).scalar()
+    add_lines(conn, ("I5", "T4", "C2", "2024-04-02", "Toys", 7))
+    lw.refresh_rollup_cube(conn, schema=CUBE_SCHEMA)
+    [april] = rc.cube_lookup(conn, "month", by=("category",), start=date(2024, 4, 1), schema=CUBE_SCHEMA)
+    assert (april["category"], april["revenue"], april["order_count"]) == ("Toys", Decimal("7.00"), 1)
+    assert conn.exec_driver_sql(
+        f"SELECT COUNT(*) FROM {CUBE_SCHEMA}.agg_rollup_cube WHERE period < '2024-04-01'"
+    ).scalar() == before
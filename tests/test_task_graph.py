@@ -0,0 +1,98 @@
+import sys
+import time
+import threading
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.pipeline.task_graph import run_task_graph
+
+
+def test_dependencies_run_after_their_parents():
+    order = []
+    lock = threading.Lock()
+
+    def task(name):
+        def run():
+            time.sleep(0.05)
+            with lock:
+                order.append(name)
+            return name.upper()
+        return run
+
+    results, timeline = run_task_graph(
+        {n: task(n) for n in ("a", "b", "c")},
+        {"c": ["a", "b"]},
+        max_workers=2,
+    )
+
+    assert results == {"a": "A", "b": "B", "c": "C"}
+    assert order[-1] == "c"
+    by_task = {e["task"]: e for e in timeline}
+    assert by_task["c"]["start_offset_seconds"] >= max(
+        by_task["a"]["end_offset_seconds"], by_task["b"]["end_offset_seconds"]
+    )
+    # a and b were independent, so they overlapped
+    assert by_task["b"]["start_offset_seconds"] < by_task["a"]["end_offset_seconds"]
+
+
+def test_concurrency_limit_respected():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def run():
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.02)
+        with lock:
+            active.pop()
+
+    run_task_graph({str(i): run for i in range(6)}, {}, max_workers=2)
+    assert max(peak) <= 2
+
+
+def test_failure_skips_dependents():
+    ran = []
+
+    def boom():
+        raise RuntimeError("load failed")
+
+    with pytest.raises(RuntimeError):
+        run_task_graph({"a": boom, "b": lambda: ran.append("b")}, {"b": ["a"]})
+    assert ran == []
+
+
+def test_cycle_detected():
+    with pytest.raises(ValueError):
+        run_task_graph({"a": lambda: 1, "b": lambda: 2}, {"a": ["b"], "b": ["a"]})
+
+
+def test_failure_skips_only_its_dependents():
+    ran = []
+
+    def boom():
+        time.sleep(0.02)
+        raise RuntimeError("load failed")
+
+    def task(name, delay=0.0):
+        def run():
+            time.sleep(delay)
+            ran.append(name)
+        return run
+
+    tasks = {
+        "a": boom,
+        "b": task("b"),  # needs a
+        "c": task("c"),  # needs b, so transitively a
+        "d": task("d", 0.05),  # independent, still running when a fails
+        "e": task("e"),  # needs d
+    }
+    with pytest.raises(RuntimeError, match="load failed"):
+        run_task_graph(tasks, {"b": ["a"], "c": ["b"], "e": ["d"]}, max_workers=2)
+    assert sorted(ran) == ["d", "e"]
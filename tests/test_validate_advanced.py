@@ -2,6 +2,8 @@
 
 import os
 from unittest.mock import Mock
+
+import pytest
 import sys
 from pathlib import Path
 
@@ -176,3 +178,78 @@ def test_main_with_warehouse_tables(monkeypatch, tmp_path):
 
     assert reports_dir.exists()
     assert (reports_dir / "quality_report.json").exists()
+
+
+def test_quality_cache_serves_unchanged_tables(tmp_path):
+    """Checks re-run only when the fingerprint changes (or on force)."""
+    cache_path = str(tmp_path / "quality_cache.json")
+    calls = []
+
+    def run():
+        calls.append(1)
+        return {"email": 0}
+
+    cache = validate_data.QualityCheckCache(path=cache_path)
+    assert cache.get_or_run("nulls:staging.customers", "10|ts|1:0:0", run) == {"email": 0}
+    cache.save()
+
+    cache = validate_data.QualityCheckCache(path=cache_path)
+    cache.get_or_run("nulls:staging.customers", "10|ts|1:0:0", run)
+    assert len(calls) == 1
+    assert cache.is_cached("nulls:staging.customers")
+
+    cache.get_or_run("nulls:staging.customers", "11|ts|2:0:0", run)
+    assert len(calls) == 2
+
+    forced = validate_data.QualityCheckCache(path=cache_path, force=True)
+    forced.get_or_run("nulls:staging.customers", "10|ts|1:0:0", run)
+    assert len(calls) == 3
+    assert forced.summary()["hits"] == 0
+
+
+def test_partition_changes_force_a_recheck(tmp_path):
+    """An update inside a partition changes the parent's fingerprint; skips without a database."""
+    from sqlalchemy.exc import OperationalError
+
+    engine = validate_data.get_engine(validate_data.load_config())
+    try:
+        conn = engine.connect()
+    except OperationalError as exc:
+        pytest.skip(f"database not reachable: {exc}")
+    with conn:
+        conn.exec_driver_sql("DROP SCHEMA IF EXISTS test_validate_data CASCADE")
+        conn.exec_driver_sql(
+            """
+            CREATE SCHEMA test_validate_data;
+            CREATE TABLE test_validate_data.facts (datekey INT, amount NUMERIC) PARTITION BY RANGE (datekey);
+            CREATE TABLE test_validate_data.facts_1 PARTITION OF test_validate_data.facts FOR VALUES FROM (0) TO (10);
+            CREATE TABLE test_validate_data.facts_2 PARTITION OF test_validate_data.facts FOR VALUES FROM (10) TO (20);
+            INSERT INTO test_validate_data.facts VALUES (1, 5), (12, 7);
+        """
+        )
+        conn.commit()
+        try:
+            calls = []
+            cache = validate_data.QualityCheckCache(path=str(tmp_path / "quality_cache.json"))
+
+            def check():
+                calls.append(1)
+                return {"total_mismatch": 0}
+
+            before = validate_data.table_fingerprint(conn, "test_validate_data.facts")
+            cache.get_or_run("ranges:warehouse", before, check)
+            conn.commit()
+            assert validate_data.table_fingerprint(conn, "test_validate_data.facts") == before
+            cache.get_or_run("ranges:warehouse", before, check)
+
+            # same row count, one row rewritten in the second partition
+            conn.exec_driver_sql("UPDATE test_validate_data.facts SET amount = 8 WHERE datekey = 12")
+            conn.commit()
+            after = validate_data.table_fingerprint(conn, "test_validate_data.facts")
+            cache.get_or_run("ranges:warehouse", after, check)
+            assert after != before and len(calls) == 2
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql("DROP SCHEMA test_validate_data CASCADE")
+            conn.commit()
+    engine.dispose()
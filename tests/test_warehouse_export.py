@@ -0,0 +1,67 @@
+import sys
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.transformation import export_warehouse_parquet as ex
+
+
+def test_arrow_types_follow_column_definitions():
+    assert ex.arrow_type("integer", 32, 0) == pa.int32()
+    assert ex.arrow_type("numeric", 10, 2) == pa.decimal128(10, 2)
+    assert ex.arrow_type("numeric", None, None) == pa.float64()
+    assert ex.arrow_type("date", None, None) == pa.date32()
+    assert ex.arrow_type("timestamp without time zone", None, None) == pa.timestamp("us")
+    assert ex.arrow_type("character varying", None, None) == pa.string()
+
+
+def test_only_changed_partitions_are_exported():
+    exported = {
+        "year=2024/month=01": {"fingerprint": "1"},
+        "year=2024/month=02": {"fingerprint": "2"},
+        "year=2023/month=12": {"fingerprint": "9"},
+    }
+    current = {
+        "year=2024/month=01": {"fingerprint": "1"},
+        "year=2024/month=02": {"fingerprint": "22"},  # month reloaded
+        "year=2024/month=03": {"fingerprint": "3"},  # new month
+    }
+    changed, unchanged, removed = ex.plan_exports(current, exported)
+    assert changed == ["year=2024/month=02", "year=2024/month=03"]
+    assert unchanged == ["year=2024/month=01"]
+    assert removed == ["year=2023/month=12"]
+
+
+def test_parquet_row_groups_carry_statistics(tmp_path):
+    schema = pa.schema(
+        [
+            pa.field("datekey", pa.int32()),
+            pa.field("totalamount", pa.decimal128(10, 2)),
+            pa.field("fulldate", pa.date32()),
+            pa.field("status", pa.string()),
+        ]
+    )
+    batches = [
+        [(1, Decimal("10.50"), date(2024, 1, 1), "paid"), (2, None, date(2024, 1, 2), None)],
+        [(3, Decimal("7.25"), date(2024, 1, 3), "paid")],
+    ]
+    path = tmp_path / "factorders" / "year=2024" / "month=01" / "part-0.parquet"
+    assert ex.write_parquet(iter(batches), schema, str(path)) == 3
+    assert not Path(f"{path}.part").exists()
+
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_row_groups == 2
+    stats = metadata.row_group(0).column(0).statistics
+    assert (stats.min, stats.max) == (1, 2)
+    assert metadata.row_group(0).column(1).statistics.null_count == 1
+
+    table = pq.read_table(tmp_path / "factorders")  # hive partitions become columns
+    assert table.num_rows == 3
+    assert table.column("month").to_pylist() == [1, 1, 1]
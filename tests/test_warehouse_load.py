@@ -0,0 +1,415 @@
+import re
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from scripts.transformation import load_warehouse as lw
+
+SCRATCH_SCHEMA = "test_warehouse_load"
+
+
+def test_monthly_partition_ddl():
+    bounds = {"year": 2025, "month": 3, "lo": 426, "hi": 457}
+    assert lw.partition_name(2025, 3) == "factorders_202503"
+    assert lw.partition_ddl(bounds) == (
+        "CREATE TABLE IF NOT EXISTS warehouse.factorders_202503 "
+        "PARTITION OF warehouse.factorders FOR VALUES FROM (426) TO (457)"
+    )
+
+
+def test_fact_select_is_shared_by_append_and_reload():
+    sql = lw.fact_select_sql("dd.datekey >= :lo AND dd.datekey < :hi")
+    assert "JOIN warehouse.dimdate dd" in sql
+    assert sql.rstrip().endswith("WHERE dd.datekey >= :lo AND dd.datekey < :hi")
+
+
+class RecordingResult:
+    def __init__(self, value=None, rowcount=0, rows=()):
+        self.value = value
+        self.rowcount = rowcount
+        self.rows = list(rows)
+
+    def all(self):
+        return self.rows
+
+    def scalars(self):
+        return self
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def scalar(self):
+        return self.value
+
+    def scalar_one(self):
+        return self.value
+
+    def one(self):
+        return self.value
+
+
+class RecordingConnection:
+    """Records executed SQL; answers watermark / MAX(key) lookups."""
+
+    def __init__(self, watermark=None, max_orderkey=100, populated=True, inserted=(0, None, None),
+                 inserted_items=(0, None)):
+        self.watermark = watermark
+        self.max_orderkey = max_orderkey
+        self.populated = populated
+        self.inserted = inserted
+        self.inserted_items = inserted_items
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        sql = str(sql)
+        self.statements.append((sql, params))
+        if "FROM warehouse.load_watermarks" in sql:
+            return RecordingResult(self.watermark)
+        if "COALESCE(MAX(" in sql:
+            return RecordingResult(self.max_orderkey)
+        if "FROM pg_matviews" in sql:
+            return RecordingResult(self.populated)
+        if "RETURNING orderkey" in sql:
+            return RecordingResult(self.inserted)
+        if "RETURNING itemkey" in sql:
+            return RecordingResult(self.inserted_items)
+        return RecordingResult(rowcount=3)
+
+    def exec_driver_sql(self, sql, params=None):
+        return self.execute(sql, params)
+
+    @contextmanager
+    def begin(self):
+        yield
+
+
+def test_late_facts_below_the_watermark_are_loaded_and_rebuild_aggregates():
+    # orders 40..45 were skipped while their customer was missing; 56..60 are new
+    conn = RecordingConnection(watermark=55, inserted=(11, 40, 60))
+    assert lw.build_fact_orders(conn) == 11
+
+    insert = next(sql for sql, _ in conn.statements if "RETURNING orderkey" in sql)
+    assert ":high_water_mark" not in insert and "NOT EXISTS" in insert
+    reset = next(p for sql, p in conn.statements if "DELETE FROM warehouse.load_watermarks" in sql)
+    assert reset == {"pattern": "agg%.orderkey", "lowest": 40}
+    watermark = next(p for sql, p in conn.statements if "INSERT INTO warehouse.load_watermarks" in sql)
+    assert watermark == {"name": "factorders.orderkey", "value": 60}
+
+    conn = RecordingConnection(watermark=55, inserted=(5, 56, 60))
+    lw.build_fact_orders(conn)
+    assert not any("DELETE FROM" in sql for sql, _ in conn.statements)
+
+
+def test_new_line_items_drop_the_item_watermarks_they_fall_under():
+    conn = RecordingConnection(inserted_items=(4, 31))
+    assert lw.build_fact_order_items(conn) == 4
+    reset = next(p for sql, p in conn.statements if "DELETE FROM warehouse.load_watermarks" in sql)
+    assert reset == {"pattern": "agg%.itemkey", "lowest": 31}
+
+    conn = RecordingConnection()
+    assert lw.build_fact_order_items(conn) == 0
+    assert not any("DELETE FROM" in sql for sql, _ in conn.statements)
+
+
+def test_aggregates_merge_only_the_delta():
+    conn = RecordingConnection(watermark=40, max_orderkey=55)
+    stats = lw.build_aggregates(conn)
+
+    assert stats == {
+        "agg_daily_sales": 3,
+        "agg_customer_metrics": 3,
+        "agg_product_performance": 3,
+        "agg_customer_sketches": 0,  # no register rows in the delta
+        "agg_category_sketches": 0,
+        "agg_rollup_cube": 0,  # no days touched
+    }
+    assert not any(sql.startswith("TRUNCATE") for sql, _ in conn.statements)
+    assert any(f"COALESCE(c.state, '{lw.UNKNOWN_MEMBER}') AS state" in sql for sql, _ in conn.statements)
+    merges = [(sql, p) for sql, p in conn.statements if "ON CONFLICT" in sql and "agg_" in sql]
+    assert len(merges) == 3
+    assert all(p == {"after": 40, "upto": 55} for _, p in merges)
+    watermarks = [p["name"] for sql, p in conn.statements if "INSERT INTO warehouse.load_watermarks" in sql]
+    assert watermarks == [
+        "agg_daily_sales.orderkey",
+        "agg_customer_metrics.orderkey",
+        "agg_product_performance.itemkey",
+        "agg_customer_sketches.orderkey",
+        "agg_category_sketches.itemkey",
+        "agg_rollup_cube.itemkey",
+    ]
+
+
+def test_aggregates_rebuild_without_watermark():
+    conn = RecordingConnection(watermark=None)
+    lw.build_aggregates(conn)
+    assert conn.statements[1][0].startswith("TRUNCATE warehouse.agg_daily_sales")
+    assert all(p["after"] == 0 for sql, p in conn.statements if p and "after" in p)
+
+
+def test_materialized_mode_leaves_views_to_the_refresh():
+    conn = RecordingConnection(watermark=40, max_orderkey=55)
+    stats = lw.build_aggregates(conn, aggregate_mode="materialized_views")
+    assert set(stats) == set(lw.AGGREGATE_STEPS) - set(lw.AGGREGATE_VIEWS)
+    assert not any(f"warehouse.{name} " in sql for sql, _ in conn.statements for name in lw.AGGREGATE_VIEWS)
+
+
+def test_views_keep_the_aggregate_table_columns():
+    ddl = open(ROOT / "sql" / "ddl" / "create_aggregates.sql").read()
+    for name, spec in lw.AGGREGATE_VIEWS.items():
+        body = re.search(rf"warehouse\.{name} \((.*?)\n\);", ddl, re.S).group(1)
+        table_columns = [line.split()[0] for line in body.strip().splitlines() if not line.strip().startswith("PRIMARY")]
+        select_list = re.search(r"SELECT(.*?)\n\s*FROM", spec["sql"], re.S).group(1)
+        view_columns = [re.split(r"\s+AS\s+|\.", line.strip().rstrip(","))[-1] for line in select_list.strip().splitlines()]
+        assert view_columns == table_columns, name
+
+
+def test_view_ddl_has_the_unique_index_concurrent_refresh_needs():
+    ddl = lw.aggregate_view_ddl("agg_daily_sales", lw.SHADOW_SCHEMA, with_data=False)
+    assert ddl.startswith("CREATE MATERIALIZED VIEW warehouse_next.agg_daily_sales AS")
+    assert "FROM warehouse_next.factorders f" in ddl and "WITH NO DATA;" in ddl
+    assert ddl.endswith("CREATE UNIQUE INDEX idx_agg_daily_sales_key ON warehouse_next.agg_daily_sales (datekey);")
+
+
+def test_refresh_is_concurrent_once_the_view_is_populated():
+    conn = RecordingConnection(max_orderkey=55)
+    lw.refresh_aggregate_view(conn, "agg_customer_metrics")
+    statements = [sql for sql, _ in conn.statements]
+    assert "REFRESH MATERIALIZED VIEW CONCURRENTLY warehouse.agg_customer_metrics" in statements
+    watermark = next(p for sql, p in conn.statements if "INSERT INTO warehouse.load_watermarks" in sql)
+    assert watermark == {"name": "agg_customer_metrics.orderkey", "value": 55}
+    refresh = next(p for sql, p in conn.statements if "aggregate_refreshes" in sql)
+    assert refresh["name"] == "agg_customer_metrics" and refresh["concurrent"] is True
+
+    conn = RecordingConnection(populated=False)
+    lw.refresh_aggregate_view(conn, "agg_customer_metrics")
+    assert "REFRESH MATERIALIZED VIEW warehouse.agg_customer_metrics" in [sql for sql, _ in conn.statements]
+
+
+def test_shadow_schema_carries_over_customers_and_refresh_history():
+    conn = RecordingConnection()
+    lw.prepare_shadow_schema(conn)
+    copies = [sql for sql, _ in conn.statements if sql.startswith("INSERT INTO warehouse_next.")]
+    assert [sql.split()[2] for sql in copies] == [
+        "warehouse_next.dimcustomers",
+        "warehouse_next.aggregate_refreshes",
+    ]
+    assert all("FROM warehouse." in sql for sql in copies)
+
+
+def test_shadow_schema_ddl_is_retargeted():
+    ddl = lw.schema_ddl(lw.SHADOW_SCHEMA)
+    assert "CREATE SCHEMA IF NOT EXISTS warehouse_next;" in ddl
+    assert "warehouse_next.factorders" in ddl
+    assert " warehouse." not in ddl and "(warehouse." not in ddl
+
+
+def test_declared_indexes_cover_fact_foreign_keys():
+    indexed = {(s["table"], s["columns"]) for s in lw.INDEX_SPECS}
+    assert {(fk["table"], fk["column"]) for fk in lw.FOREIGN_KEY_SPECS} <= indexed
+    assert lw.index_ddl(lw.INDEX_SPECS[1], "warehouse_next") == (
+        "CREATE INDEX IF NOT EXISTS idx_factorders_customerkey "
+        "ON warehouse_next.factorders (customerkey)"
+    )
+
+
+def test_build_graph_covers_every_step():
+    steps = {**lw.BUILD_STEPS, **lw.AGGREGATE_STEPS}
+    assert set(lw.BUILD_DEPENDENCIES) <= set(steps)
+    assert {d for deps in lw.BUILD_DEPENDENCIES.values() for d in deps} <= set(steps)
+    # BUILD_STEPS order doubles as the serial (incremental) order
+    order = list(steps)
+    for name, deps in lw.BUILD_DEPENDENCIES.items():
+        assert all(order.index(d) < order.index(name) for d in deps)
+
+
+@pytest.fixture
+def scratch_warehouse():
+    """An empty warehouse in its own schema, built from the DDL; skips without a database.
+
+    production rows a test adds must use TEST- business keys; they are
+    deleted again afterwards.
+    """
+    from sqlalchemy.exc import OperationalError
+
+    engine = lw.get_engine(lw.load_config())
+    try:
+        conn = engine.connect()
+    except OperationalError as exc:
+        pytest.skip(f"warehouse database not reachable: {exc}")
+    conn.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE")
+    conn.exec_driver_sql(lw.schema_ddl(SCRATCH_SCHEMA))
+    conn.commit()
+    yield conn
+    conn.rollback()
+    conn.exec_driver_sql(f"DROP SCHEMA {SCRATCH_SCHEMA} CASCADE")
+    conn.exec_driver_sql("DELETE FROM production.customers WHERE customerid LIKE 'TEST-%%'")
+    conn.commit()
+    conn.close()
+    engine.dispose()
+
+
+def add_production_customers(conn, *customers):
+    for customerid, city in customers:
+        conn.exec_driver_sql(
+            """
+            INSERT INTO production.customers (
+                customerid, firstname, lastname, city, state, country, agegroup, registrationdate
+            )
+            VALUES (%s, 'Test', 'Customer', %s, 'Goa', 'India', '25-34', '2024-01-01')
+        """,
+            (customerid, city),
+        )
+
+
+def dim_test_customers(conn):
+    return conn.exec_driver_sql(
+        f"""
+        SELECT customerid, customerkey, city, iscurrent, enddate IS NOT NULL AS ended
+        FROM {SCRATCH_SCHEMA}.dimcustomers
+        WHERE customerid LIKE 'TEST-%%'
+        ORDER BY customerid, customerkey
+    """
+    ).all()
+
+
+def test_scd2_versions_changed_customers_and_keeps_unchanged_ones(scratch_warehouse):
+    conn = scratch_warehouse
+    add_production_customers(conn, ("TEST-1", "Panaji"), ("TEST-2", "Margao"))
+    first = lw.build_dim_customers(conn, SCRATCH_SCHEMA)
+    assert first["new_customers"] >= 2 and first["new_versions"] == first["expired"] == 0
+    before = {row.customerid: row.customerkey for row in dim_test_customers(conn)}
+
+    conn.exec_driver_sql("UPDATE production.customers SET city = 'Vasco' WHERE customerid = 'TEST-1'")
+    add_production_customers(conn, ("TEST-3", "Mapusa"))
+    second = lw.build_dim_customers(conn, SCRATCH_SCHEMA)
+
+    assert (second["new_customers"], second["new_versions"], second["expired"]) == (1, 1, 1)
+    assert second["unchanged"] == first["new_customers"] - 1
+    rows = dim_test_customers(conn)
+    assert [(r.customerid, r.city, r.iscurrent, r.ended) for r in rows] == [
+        ("TEST-1", "Panaji", False, True),
+        ("TEST-1", "Vasco", True, False),
+        ("TEST-2", "Margao", True, False),
+        ("TEST-3", "Mapusa", True, False),
+    ]
+    assert rows[0].customerkey == before["TEST-1"] and rows[2].customerkey == before["TEST-2"]
+
+
+def test_pre_scd2_rows_get_their_hash_and_stay_unchanged(scratch_warehouse):
+    conn = scratch_warehouse
+    add_production_customers(conn, ("TEST-1", "Panaji"))
+    # a dimcustomers table from before row hashing
+    conn.exec_driver_sql(f"DROP INDEX {SCRATCH_SCHEMA}.idx_dimcustomers_current")
+    conn.exec_driver_sql(f"ALTER TABLE {SCRATCH_SCHEMA}.dimcustomers DROP COLUMN rowhash")
+    conn.exec_driver_sql(
+        f"""
+        INSERT INTO {SCRATCH_SCHEMA}.dimcustomers (
+            customerid, firstname, lastname, city, state, country, agegroup, effectivedate, iscurrent
+        )
+        SELECT customerid, firstname, lastname, city, state, country, agegroup, registrationdate, TRUE
+        FROM production.customers
+    """
+    )
+    conn.commit()
+
+    lw.ensure_scd2_columns(conn, SCRATCH_SCHEMA)
+    [(key,)] = conn.exec_driver_sql(
+        f"SELECT customerkey FROM {SCRATCH_SCHEMA}.dimcustomers WHERE customerid = 'TEST-1'"
+    ).all()
+    stats = lw.build_dim_customers(conn, SCRATCH_SCHEMA)
+
+    assert (stats["new_customers"], stats["new_versions"], stats["expired"]) == (0, 0, 0)
+    assert [(r.customerkey, r.iscurrent) for r in dim_test_customers(conn)] == [(key, True)]
+
+
+def test_load_state_is_reapplied_from_the_ddl(scratch_warehouse):
+    conn = scratch_warehouse
+    dates = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {SCRATCH_SCHEMA}.dimdate").scalar()
+    # a warehouse from before the watermarks, the cube and the date lookup index
+    conn.exec_driver_sql(
+        f"""
+        DROP TABLE {SCRATCH_SCHEMA}.load_watermarks, {SCRATCH_SCHEMA}.agg_rollup_cube;
+        DROP INDEX {SCRATCH_SCHEMA}.idx_dimdate_fulldate;
+    """
+    )
+    conn.commit()
+
+    lw.ensure_load_state(conn, SCRATCH_SCHEMA)
+    lw.ensure_load_state(conn, SCRATCH_SCHEMA)
+
+    found = conn.exec_driver_sql(
+        f"""
+        SELECT relname FROM pg_class
+        WHERE relnamespace = '{SCRATCH_SCHEMA}'::regnamespace
+          AND relname IN ('load_watermarks', 'agg_rollup_cube', 'idx_dimdate_fulldate')
+        ORDER BY relname
+    """
+    ).scalars().all()
+    assert found == ["agg_rollup_cube", "idx_dimdate_fulldate", "load_watermarks"]
+    assert conn.exec_driver_sql(f"SELECT COUNT(*) FROM {SCRATCH_SCHEMA}.dimdate").scalar() == dates
+
+
+def test_product_columns_are_not_altered_under_readers(scratch_warehouse):
+    conn = scratch_warehouse
+    reader = conn.engine.connect()
+    try:
+        # a long-running report holds a share lock on the aggregate
+        reader.exec_driver_sql(f"SELECT COUNT(*) FROM {SCRATCH_SCHEMA}.agg_product_performance")
+        conn.exec_driver_sql("SET lock_timeout = '1s'")
+        conn.commit()
+        lw.ensure_product_tables(conn, SCRATCH_SCHEMA)  # columns exist: no ALTER to wait on
+    finally:
+        reader.rollback()
+        reader.close()
+
+    conn.exec_driver_sql(f"ALTER TABLE {SCRATCH_SCHEMA}.agg_product_performance DROP COLUMN order_lines")
+    conn.commit()
+    lw.ensure_product_tables(conn, SCRATCH_SCHEMA)
+    assert conn.exec_driver_sql(
+        f"""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = '{SCRATCH_SCHEMA}' AND table_name = 'agg_product_performance'
+          AND column_name = 'order_lines'
+    """
+    ).scalar() == 1
+
+
+def test_late_facts_reach_the_aggregates(scratch_warehouse):
+    conn = scratch_warehouse
+    conn.exec_driver_sql(
+        f"""
+        INSERT INTO {SCRATCH_SCHEMA}.dimcustomers (customerid, state, effectivedate, iscurrent)
+        VALUES ('TEST-2', 'Goa', '2024-01-01', TRUE);
+        INSERT INTO {SCRATCH_SCHEMA}.dimorders (orderid, customerid, orderdate, orderstatus)
+        VALUES ('O1', 'TEST-1', '2024-03-01', 'Completed'),
+               ('O2', 'TEST-2', '2024-03-02', 'Completed');
+    """
+    )
+    # O1's customer has not arrived yet, so only O2 (the higher key) loads
+    assert lw.build_fact_orders(conn, SCRATCH_SCHEMA) == 1
+    lw.build_aggregates(conn, schema=SCRATCH_SCHEMA)
+
+    conn.exec_driver_sql(
+        f"""
+        INSERT INTO {SCRATCH_SCHEMA}.dimcustomers (customerid, state, effectivedate, iscurrent)
+        VALUES ('TEST-1', 'Goa', '2024-01-01', TRUE)
+    """
+    )
+    assert lw.build_fact_orders(conn, SCRATCH_SCHEMA) == 1
+    lw.build_aggregates(conn, schema=SCRATCH_SCHEMA)
+
+    facts, aggregated, customers = conn.exec_driver_sql(
+        f"""
+        SELECT
+            (SELECT SUM(totalamount) FROM {SCRATCH_SCHEMA}.factorders),
+            (SELECT SUM(total_revenue) FROM {SCRATCH_SCHEMA}.agg_daily_sales),
+            (SELECT COUNT(*) FROM {SCRATCH_SCHEMA}.agg_customer_metrics)
+    """
+    ).one()
+    assert aggregated == facts and customers == 2